@@ -0,0 +1,33 @@
+"""
+Benchmarks for tasko and the radio utilities.
+
+Run every suite with `python -m bench` from the repository root, or a single suite with
+e.g. `python -m bench.tasko_bench`.  Results are merged into bench_output.txt as JSON,
+keyed by suite name, so runs before and after a change can be diffed.
+"""
+import json
+import os
+import platform
+import time
+
+BENCH_OUTPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "bench_output.txt")
+
+
+def record(suite, results, path=BENCH_OUTPUT):
+    """Merge one suite's results into the JSON benchmark output file"""
+    try:
+        with open(path) as f:
+            output = json.load(f)
+    except (OSError, ValueError):
+        output = {}
+
+    output[suite] = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(output, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return output[suite]
@@ -0,0 +1,6 @@
+from bench import compression_bench, memory_bench, reassembly_bench, tasko_bench
+
+SUITES = [tasko_bench, memory_bench, reassembly_bench, compression_bench]
+
+for suite in SUITES:
+    suite.main()
@@ -0,0 +1,95 @@
+"""
+Compression benchmarks: compression ratio against CPU time for each codec in
+lib/radio_utils/compression.py, on the kinds of files that go over the link.
+
+Files are compressed and decompressed in READ_SIZE chunks, as compress_file and the ground
+station's DecompressingSink do.
+
+usage: python -m bench.compression_bench
+"""
+import glob
+import json
+import os
+import random
+import time
+
+from bench import record
+from lib.radio_utils import compression
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_BYTES = 64 * 1024
+
+
+def _python_source():
+    paths = sorted(glob.glob(os.path.join(ROOT, "lib", "**", "*.py"), recursive=True))
+    data = b"".join(open(path, "rb").read() for path in paths)
+    return data[:SAMPLE_BYTES]
+
+
+def _json_listing():
+    rng = random.Random(1)
+    names = [f"{rng.choice(['beacon', 'log', 'img', 'downlink'])}_{rng.randrange(10 ** 9)}."
+             f"{rng.choice(['txt', 'bin', 'json'])}" for _ in range(3000)]
+    return json.dumps(names).encode()[:SAMPLE_BYTES]
+
+
+def _log():
+    rng = random.Random(2)
+    lines = []
+    t = 1700000000
+    while sum(len(line) for line in lines) < SAMPLE_BYTES:
+        t += rng.randrange(1, 60)
+        lines.append(f"[{t}] battery_voltage: {3.6 + rng.random() / 2:.3f}, temperature: {rng.gauss(20, 3):.2f}, "
+                     f"rssi: {-rng.randrange(60, 120)}, tq_size: {rng.randrange(0, 30)}\n")
+    return "".join(lines).encode()[:SAMPLE_BYTES]
+
+
+def _random():
+    return os.urandom(SAMPLE_BYTES)
+
+
+SAMPLES = {"python_source": _python_source, "json_listing": _json_listing, "log": _log, "random": _random}
+
+
+def _chunked(transform, flush, data):
+    out = bytearray()
+    for i in range(0, len(data), compression.READ_SIZE):
+        out += transform(data[i:i + compression.READ_SIZE])
+    out += flush()
+    return bytes(out)
+
+
+def codec_on(codec, data):
+    start = time.perf_counter()
+    c = compression.compressor(codec)
+    compressed = _chunked(c.compress, c.flush, data)
+    compress_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    d = compression.decompressor(codec)
+    decompressed = _chunked(d.decompress, d.flush, compressed)
+    decompress_seconds = time.perf_counter() - start
+    assert decompressed == data
+
+    return {
+        "bytes": len(data),
+        "compressed_bytes": len(compressed),
+        "ratio": len(data) / len(compressed),
+        "compress_seconds": compress_seconds,
+        "compress_kb_per_second": len(data) / 1024 / compress_seconds,
+        "decompress_seconds": decompress_seconds,
+    }
+
+
+def main():
+    results = {}
+    for name, sample in SAMPLES.items():
+        data = sample()
+        for codec in (compression.CODEC_LZSS, compression.CODEC_ZLIB):
+            if compression.can_compress(codec):
+                results[f"{name}_{compression.CODEC_NAMES[codec]}"] = codec_on(codec, data)
+    return record("compression", results)
+
+
+if __name__ == "__main__":
+    print(json.dumps(main(), indent=2))
@@ -0,0 +1,92 @@
+"""
+Memory footprint benchmarks: bytes per queued transmission message and per sleeping tasko task,
+measured with tracemalloc at 10k entries.
+
+usage: python -m bench.memory_bench
+"""
+import gc
+import tracemalloc
+
+from bench import record
+from lib.radio_utils.message import Message
+from lib.radio_utils.memory_buffered_message import MemoryBufferedMessage
+from lib.radio_utils.transmission_queue import TransmissionQueue
+from tasko import Loop
+from tasko.loop import Sleeper, Task
+from tasko.simulation import virtual_time
+
+ENTRIES = 10000
+
+
+def _measure(build):
+    """Bytes still allocated after build() returns, while its result is alive"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del kept
+    return after - before
+
+
+def queued_messages(entries=ENTRIES):
+    """A TransmissionQueue holding `entries` single packet messages with 8 byte payloads"""
+    payloads = [b'%08d' % i for i in range(entries)]
+
+    def build():
+        queue = TransmissionQueue(limit=entries)
+        for i, payload in enumerate(payloads):
+            queue.push(Message(i % 10, payload), ttl=60)
+        return queue
+
+    total = _measure(build)
+    return {"entries": entries, "bytes": total, "bytes_per_message": total / entries}
+
+
+def buffered_messages(entries=ENTRIES):
+    """MemoryBufferedMessage objects alone, payload excluded"""
+    payload = b'x' * 200
+    total = _measure(lambda: [MemoryBufferedMessage(payload) for _ in range(entries)])
+    return {"entries": entries, "bytes": total, "bytes_per_message": total / entries}
+
+
+def sleepers(entries=ENTRIES):
+    """A loop with `entries` tasks parked in sleep(); includes each task's coroutine frame"""
+
+    def build():
+        loop = Loop()
+
+        async def sleeper():
+            await loop.sleep(1)
+
+        for _ in range(entries):
+            loop.add_task(sleeper(), 1)
+        loop._step()
+        assert len(loop._sleeping) == entries
+        return loop
+
+    with virtual_time(step_nanos=0):
+        total = _measure(build)
+    return {"entries": entries, "bytes": total, "bytes_per_sleeper": total / entries}
+
+
+def scheduler_records(entries=ENTRIES):
+    """Task and Sleeper records alone, without coroutines"""
+    total = _measure(lambda: [Sleeper(i, Task(None, 1)) for i in range(entries)])
+    return {"entries": entries, "bytes": total, "bytes_per_record": total / entries}
+
+
+def main():
+    results = {
+        "queued_messages": queued_messages(),
+        "memory_buffered_messages": buffered_messages(),
+        "sleepers": sleepers(),
+        "task_and_sleeper_records": scheduler_records(),
+    }
+    return record("memory", results)
+
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(main(), indent=2))
@@ -0,0 +1,96 @@
+"""
+Downlink reassembly benchmarks: 1 MB synthetic downloads through the previous `bytes +=`
+reassembly and through gs_reassembly.Reassembler, in order and for shuffled stream chunks.
+
+usage: python -m bench.reassembly_bench
+"""
+import os
+import random
+import time
+
+from bench import record
+from gs_reassembly import Reassembler
+from lib.radio_utils import PACKET_DATA_LEN, STREAM_DATA_LEN
+
+DOWNLOAD_BYTES = 1 << 20
+
+
+def _chunks(data, chunk_len):
+    return [data[i:i + chunk_len] for i in range(0, len(data), chunk_len)]
+
+
+def _concatenate(chunks):
+    """The reassembly wait_for_message used before Reassembler: concatenation with last-payload dedup"""
+    msg = chunks[0]
+    last = chunks[0]
+    for chunk in chunks[1:]:
+        if chunk != last:
+            msg += chunk
+        last = chunk
+    return msg
+
+
+def _reassemble_legacy(chunks):
+    reassembler = Reassembler()
+    for chunk in chunks:
+        reassembler.append(chunk)
+    reassembler.finish()
+    return reassembler.join()
+
+
+def _reassemble_stream(indexed_chunks, end_index):
+    reassembler = Reassembler()
+    for index, chunk in indexed_chunks:
+        reassembler.add(index, chunk)
+    reassembler.finish(end_index)
+    assert reassembler.complete()
+    return reassembler.join()
+
+
+def _timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def download(size=DOWNLOAD_BYTES):
+    data = os.urandom(size)
+    legacy_chunks = _chunks(data, PACKET_DATA_LEN)
+
+    concat_seconds, concat_result = _timed(_concatenate, legacy_chunks)
+    legacy_seconds, legacy_result = _timed(_reassemble_legacy, legacy_chunks)
+    assert concat_result == data and legacy_result == data
+
+    # stream chunks arrive out of order with 5% duplicates, e.g. interleaved with retries
+    stream_chunks = list(enumerate(_chunks(data, STREAM_DATA_LEN)))
+    rng = random.Random(size)
+    arrivals = stream_chunks + rng.sample(stream_chunks, len(stream_chunks) // 20)
+    rng.shuffle(arrivals)
+    stream_seconds, stream_result = _timed(_reassemble_stream, arrivals, len(stream_chunks) - 1)
+    assert stream_result == data
+
+    # zero filled blocks: without chunk indices identical consecutive chunks can't be told from resent ones,
+    # so the legacy headers drop them; stream chunks keep them
+    zeros = bytes(size // 16)
+    zero_chunks = _chunks(zeros, PACKET_DATA_LEN)
+    zero_stream_chunks = list(enumerate(_chunks(zeros, STREAM_DATA_LEN)))
+    return {
+        "bytes": size,
+        "chunks": len(legacy_chunks),
+        "concatenate_seconds": concat_seconds,
+        "reassembler_seconds": legacy_seconds,
+        "speedup": concat_seconds / legacy_seconds,
+        "reassembler_shuffled_stream_seconds": stream_seconds,
+        "zero_filled_bytes": size // 16,
+        "zero_filled_legacy_bytes": len(_concatenate(zero_chunks)),
+        "zero_filled_stream_bytes": len(_reassemble_stream(zero_stream_chunks, len(zero_stream_chunks) - 1)),
+    }
+
+
+def main():
+    return record("reassembly", {"download_1mb": download()})
+
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(main(), indent=2))
@@ -0,0 +1,174 @@
+"""
+tasko scheduler benchmarks: task switch rate, sleeper scaling, ScheduledTask jitter,
+ManagedResource handoff latency under contention and suspend/resume cost.
+
+usage: python -m bench.tasko_bench [--quick]
+"""
+import random
+import sys
+import time
+
+from bench import record
+from tasko import Loop
+from tasko.loop import _yield_once
+from tasko.managed_resource import ManagedResource
+from tasko.simulation import virtual_time
+
+
+def task_switches(tasks=100, switches_per_task=1000):
+    """Many tasks that do nothing but yield back to the loop"""
+    loop = Loop()
+
+    async def spinner():
+        for _ in range(switches_per_task):
+            await _yield_once()
+
+    for _ in range(tasks):
+        loop.add_task(spinner(), 1)
+    start = time.perf_counter()
+    loop.run()
+    elapsed = time.perf_counter() - start
+    switches = tasks * (switches_per_task + 1)
+    return {
+        "tasks": tasks,
+        "switches": switches,
+        "seconds": elapsed,
+        "switches_per_second": switches / elapsed,
+    }
+
+
+def concurrent_sleepers(sleepers):
+    """`sleepers` tasks asleep at once with spread out wake times, on a virtual clock so only loop overhead is timed"""
+    rng = random.Random(sleepers)
+    with virtual_time(step_nanos=0):
+        loop = Loop()
+        woken = 0
+
+        async def sleeper(seconds):
+            nonlocal woken
+            await loop.sleep(seconds)
+            woken += 1
+
+        start = time.perf_counter()
+        for _ in range(sleepers):
+            loop.add_task(sleeper(rng.uniform(0, 10)), 1)
+        loop.run()
+        elapsed = time.perf_counter() - start
+    assert woken == sleepers
+    return {
+        "sleepers": sleepers,
+        "seconds": elapsed,
+        "ns_per_sleeper": int(elapsed * 1e9 / sleepers),
+    }
+
+
+def scheduled_jitter(rates=(1, 10, 100), duration=3.0):
+    """Real time ScheduledTasks at several rates running together; jitter is start time error vs. the ideal grid"""
+    loop = Loop()
+    starts = {hz: [] for hz in rates}
+
+    def make(hz):
+        async def tick():
+            starts[hz].append(time.monotonic_ns())
+        return tick
+
+    tasks = [loop.schedule(hz, make(hz), 1) for hz in rates]
+
+    async def stop_all():
+        for task in tasks:
+            task.stop()
+
+    loop.run_later(duration, stop_all(), 0)
+    loop.run()
+
+    results = {}
+    for hz in rates:
+        samples = starts[hz]
+        period = 1e9 / hz
+        errors = [abs(t - samples[0] - i * period) for i, t in enumerate(samples)]
+        results["{}hz".format(hz)] = {
+            "invocations": len(samples),
+            "mean_jitter_us": sum(errors) / len(errors) / 1000 if errors else None,
+            "max_jitter_us": max(errors) / 1000 if errors else None,
+        }
+    return results
+
+
+def resource_handoff(contenders=10, acquisitions_per_task=500):
+    """Tasks fighting over one ManagedResource; latency from release to the next owner running"""
+    loop = Loop()
+    resource = ManagedResource(object(), loop=loop)
+    released_at = None
+    latencies = []
+
+    async def contender():
+        nonlocal released_at
+        handle = resource.handle()
+        for _ in range(acquisitions_per_task):
+            async with handle:
+                if released_at is not None:
+                    latencies.append(time.perf_counter_ns() - released_at)
+                await _yield_once()
+                released_at = time.perf_counter_ns()
+            await _yield_once()
+
+    for _ in range(contenders):
+        loop.add_task(contender(), 1)
+    start = time.perf_counter()
+    loop.run()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    metrics = resource.metrics()
+    return {
+        "contenders": contenders,
+        "acquisitions": metrics["acquisitions"],
+        "acquisitions_per_second": metrics["acquisitions"] / elapsed,
+        "contended": metrics["contended"],
+        "max_queue_depth": metrics["max_queue_depth"],
+        "handoff_latency_ns_p50": latencies[len(latencies) // 2],
+        "handoff_latency_ns_p99": latencies[int(len(latencies) * 0.99)],
+    }
+
+
+def suspend_resume(round_trips=20000):
+    """Two tasks handing control back and forth with Loop.suspend"""
+    loop = Loop()
+    parked = []
+
+    async def ping_pong():
+        for _ in range(round_trips):
+            if parked:
+                parked.pop()()
+            await_handle, resume = loop.suspend()
+            parked.append(resume)
+            await await_handle
+        if parked:
+            parked.pop()()
+
+    loop.add_task(ping_pong(), 1)
+    loop.add_task(ping_pong(), 1)
+    start = time.perf_counter()
+    loop.run()
+    elapsed = time.perf_counter() - start
+    return {
+        "round_trips": 2 * round_trips,
+        "seconds": elapsed,
+        "ns_per_suspend_resume": int(elapsed * 1e9 / (2 * round_trips)),
+    }
+
+
+def main(quick=False):
+    results = {
+        "task_switches": task_switches(),
+        "sleepers_1k": concurrent_sleepers(1000),
+        "sleepers_10k": concurrent_sleepers(10000),
+        "scheduled_jitter": scheduled_jitter(duration=1.0 if quick else 3.0),
+        "resource_handoff": resource_handoff(),
+        "suspend_resume": suspend_resume(),
+    }
+    return record("tasko", results)
+
+
+if __name__ == "__main__":
+    import json
+    print(json.dumps(main(quick="--quick" in sys.argv), indent=2))
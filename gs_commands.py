@@ -1,10 +1,20 @@
 """
 """
 import json
+import os
 from lib.logs import unpack_beacon
+from lib.radio_utils import headers, MAX_PACKET_LEN
+from lib.radio_utils import compression
+from lib.radio_utils import hashing
+from lib.radio_utils.commands import super_secret_code, commands, _pack, _unpack, CORRELATION_ID_MIN
+from gs_reassembly import DecompressingSink, FileSink, Reassembler
+from gs_delta import parse_block_hashes, compute_delta
+from lib.radio_utils.fountain import SIZE_LEN, SYMBOL_LEN
+from lib.radio_utils.blast_message import write_bitmap
 from lib.radio_utils.disk_buffered_message import DiskBufferedMessage
-from lib.radio_utils import headers
-from lib.radio_utils.commands import super_secret_code, commands, _pack, _unpack
+from lib.radio_utils.upload_session import UploadMessage
+import gs_transfer_state
+from gs_file_hashes import local_hash
 from shell_utils import bold, normal, red
 import time
 import struct
@@ -15,26 +25,84 @@ except:
     HAS_CALENDAR = False
 
 
+# smaller blocks find smaller edits, but there are more block hashes to downlink
+DELTA_BLOCK_SIZE = 256
+
+# the most missing chunk bitmap that fits in a BLAST_REPAIR command packet after the stream id and base index
+BLAST_BITMAP_BYTES = MAX_PACKET_LEN - 1 - len(super_secret_code) - 2 - 3
+
+# codecs the ground station can decompress, in order of preference
+DOWNLINK_CODECS = [compression.CODEC_ZLIB, compression.CODEC_LZSS]
+# the codec uploads are compressed with; every board can decompress it
+UPLOAD_CODEC = compression.CODEC_LZSS
+# where the satellite's radio task saves an uplinked DiskBufferedMessage (see _upload_staged)
+UPLOAD_STAGING_PATH = "/sd/disk_buffered_message"
+
+# the hash transfers are checked with; satellites without hashlib answer with crc32 instead
+HASH_ALGORITHM = hashing.SHA256
+# the response of a request_file that was skipped because local_path already matched the satellite's copy
+UP_TO_DATE = "up to date"
+
+# receive timeouts in a row after which a fountain download that can't decode yet asks for more symbols
+FOUNTAIN_MORE_AFTER = 3
+# the symbols asked for with each FOUNTAIN_MORE, as a fraction of the file's block count (before loss),
+# and the fewest asked for
+FOUNTAIN_MORE_FRACTION = 0.5
+FOUNTAIN_MORE_MIN = 10
+
+_upload_session_id = 0
+# whether the satellite answers upload sessions; None until an upload has found out
+_upload_sessions = None
+# whether the satellite answers COMMAND_CORRELATED; None until a correlated command has found out
+_correlated_commands = None
+_correlation_id = CORRELATION_ID_MIN - 1
+
 commands_by_name = {
     commands[cb]["name"]:
     {"bytes": cb, "will_respond": commands[cb]["will_respond"], "has_args": commands[cb]["has_args"]}
     for cb in commands.keys()}
 
 
-async def send_command(radio, command_bytes, args, will_respond, max_rx_fails=30, debug=False, args_are_bytes=False):
+async def send_command(radio, command_bytes, args, will_respond, max_rx_fails=30, debug=False, args_are_bytes=False,
+                       sink=None, progress=None, correlated=False):
+    """Sends a command, and waits for its response if it will respond.  Returns (success, header, response).
+
+    A sink is given the buffered response as it arrives (see wait_for_message).  With `correlated` the
+    command is sent as a COMMAND_CORRELATED, so its response can be told apart from anything else the
+    satellite sends meanwhile.  If the satellite never answers that, the command is sent again
+    uncorrelated, and later correlated commands are sent uncorrelated too.
+    """
+    global _correlated_commands
     success = False
     response = None
     header = None
     if not args_are_bytes:
         args = bytes(args, 'utf-8')
-    msg = bytes([headers.COMMAND]) + super_secret_code + command_bytes + args
+    correlation_id = None
+    if correlated and _correlated_commands is not False:
+        correlation_id = _next_correlation_id()
+    msg = _command_packet(command_bytes, args, correlation_id)
     if await radio.send_with_ack(msg, debug=debug):
         if debug:
             print('Successfully sent command')
         if will_respond:
             if debug:
                 print('Waiting for response')
-            header, response = await wait_for_message(radio, max_rx_fails=max_rx_fails, debug=debug)
+            data = _data(sink, progress, correlation_id)
+            header, response = await _wait(radio, data, max_rx_fails, debug,
+                                           beacons=command_bytes == commands_by_name["REQUEST_BEACON"]["bytes"])
+            if correlation_id is not None and _correlated_commands is None:
+                if header is not None or data.started:
+                    _correlated_commands = True
+                else:
+                    if debug:
+                        print('No response to a correlated command, sending it uncorrelated')
+                    success, header, response = await send_command(
+                        radio, command_bytes, args, will_respond, max_rx_fails=max_rx_fails, debug=debug,
+                        args_are_bytes=True, sink=sink, progress=progress)
+                    if success:
+                        _correlated_commands = False
+                    return success, header, response
             if debug:
                 print_message(header, response)
             if header is not None:
@@ -50,6 +118,142 @@ async def send_command(radio, command_bytes, args, will_respond, max_rx_fails=30
     return success, header, response
 
 
+def _command_packet(command_bytes, args, correlation_id=None):
+    if correlation_id is None:
+        return bytes([headers.COMMAND]) + super_secret_code + command_bytes + args
+    return bytes([headers.COMMAND_CORRELATED]) + super_secret_code + bytes([correlation_id]) + command_bytes + args
+
+
+class PendingCommand:
+    """A command sent by a CommandPipeline, and its response once it arrives"""
+
+    def __init__(self, name, correlation_id, data):
+        self.name = name
+        self.correlation_id = correlation_id
+        self.data = data
+        self.success = False
+        self.header = None
+        self.response = None
+        self.finished = False
+
+    def done(self):
+        return self.finished
+
+    def result(self):
+        """(success, header, response), as send_command returns them"""
+        return self.success, self.header, self.response
+
+    def finish(self, success, header=None, response=None):
+        self.success = success
+        self.header = header
+        self.response = response
+        self.finished = True
+
+
+class CommandPipeline:
+    """
+    Sends commands back to back, each tagged with a correlation id, and matches up the responses in
+    whatever order they arrive, so a pass isn't spent waiting out a round trip per command.
+
+    The satellite echoes the correlation id in each response (see headers.COMMAND_CORRELATED):
+    single packet responses arrive as RESPONSE, and buffered ones on a stream whose id is the
+    correlation id.
+
+    At most MAX_PENDING commands can wait for their responses at once, one per correlation id; send
+    more in windows of MAX_PENDING with a wait() after each.
+
+    usage:
+        pipeline = CommandPipeline(radio)
+        size = await pipeline.send("QUERY", "os.stat('/sd/a.txt')[6]")
+        names = await pipeline.send("LIST_DIR", "/sd")
+        await pipeline.wait()
+        success, header, response = size.result()
+    """
+
+    MAX_PENDING = 0x100 - CORRELATION_ID_MIN
+
+    def __init__(self, radio, debug=False):
+        self.radio = radio
+        self.debug = debug
+        self.pending = {}  # correlation id -> PendingCommand waiting for its response
+
+    async def send(self, name, args="", args_are_bytes=False, sink=None, progress=None):
+        """Sends the command `name` without waiting for its response, and returns its PendingCommand.
+        With a sink, a buffered response is written to it as it arrives (see wait_for_message)."""
+        if not args_are_bytes:
+            args = bytes(args, 'utf-8')
+        if len(self.pending) >= self.MAX_PENDING:
+            raise ValueError("Every correlation id is waiting for a response")
+        correlation_id = _next_correlation_id(self.pending)
+        command = PendingCommand(name, correlation_id, _data(sink, progress, correlation_id))
+        msg = _command_packet(commands_by_name[name]["bytes"], args, command.correlation_id)
+        if not await self.radio.send_with_ack(msg, debug=self.debug):
+            if self.debug:
+                print(f'Failed to send {name}')
+            command.finish(False)
+        elif not commands_by_name[name]["will_respond"]:
+            command.finish(True)
+        else:
+            self.pending[command.correlation_id] = command
+        return command
+
+    async def wait(self, max_rx_fails=30):
+        """Routes responses to the commands waiting for them, until every one has its response or nothing has
+        arrived for max_rx_fails receives. Commands still waiting then fail. Returns True if every command got its
+        response."""
+        rx_fails = 0
+        while self.pending:
+            res = await receive(self.radio, debug=self.debug)
+            if res is None:
+                rx_fails += 1
+                if rx_fails > max_rx_fails:
+                    print("CommandPipeline: max_rx_fails hit")
+                    break
+                continue
+            rx_fails = 0
+            header, payload = res
+            self._route(header[5], payload)
+
+        for command in self.pending.values():
+            command.finish(False)
+        everything = not self.pending
+        self.pending = {}
+        return everything
+
+    def _route(self, oh, payload):
+        if oh == headers.RESPONSE:
+            command = self.pending.pop(payload[0], None)
+            if command is not None:
+                self._finish(command, payload[1], payload[2:])
+        elif oh in MEMORY_STREAM_HEADERS or oh in DISK_STREAM_HEADERS:
+            command = self.pending.get(payload[0])
+            done = handle_stream(oh, payload, command.data if command is not None else None, debug=self.debug)
+            if done is not None and command is not None:
+                del self.pending[command.correlation_id]
+                self._finish(command, *done)
+        elif oh == headers.FOUNTAIN_SYMBOL or oh == headers.BLAST_CHUNK:
+            pass  # packets still in flight from a fountain or blast download that has already finished
+        elif self.debug:
+            print(f"CommandPipeline: ignoring uncorrelated packet with header {oh}")
+
+    def _finish(self, command, header, response):
+        command.finish(True, header, response)
+        if self.debug:
+            print(f"{bold}{command.name} Response:{normal}")
+            print_message(header, response)
+
+
+def _next_correlation_id(pending=()):
+    """The next correlation id that is not in pending"""
+    global _correlation_id
+    while True:
+        _correlation_id += 1
+        if _correlation_id > 0xff:
+            _correlation_id = CORRELATION_ID_MIN
+        if _correlation_id not in pending:
+            return _correlation_id
+
+
 async def move_file(radio, source_path, destination_path, debug=False):
     arg_string = json.dumps([source_path, destination_path])
     success, _, response = await send_command(
@@ -73,37 +277,745 @@ async def move_file(radio, source_path, destination_path, debug=False):
     return success
 
 
-async def request_file(radio, path, debug=False):
+async def request_file(radio, path, debug=False, local_path=None, progress=None, resume=True, compress=False,
+                       verify=None):
+    """Downlinks the file at `path` on the satellite.
+
+    By default the file is returned in memory as the response.  With `local_path` it is instead
+    streamed to `local_path`.part as it arrives and renamed to `local_path` once complete, and the
+    response is `local_path`.  An interrupted download leaves what was received in the .part file,
+    and with `resume` the next request for the same file continues from where it stopped.
+
+    The request is sent correlated (see send_command), so only the transfer it starts is written to
+    `local_path`, and beacons or other responses arriving meanwhile are not taken for the file.
+
+    With `compress` the satellite compresses the file with the best codec it has (see
+    lib/radio_utils/compression.py), and it is decompressed as it arrives.  Resumed downloads
+    are sent uncompressed.  The satellite keeps the codecs, and compresses its longer responses
+    to other commands with them from then on.
+
+    With `verify` (by default, only when saving to `local_path`) the satellite hashes the file first
+    (see file_hash).  The download is skipped if `local_path` already holds a copy with the same
+    hash, with a response of UP_TO_DATE, and otherwise fails if what arrived does not match it; a
+    mismatched download is discarded rather than renamed into place.
+
+    :param progress: Optional function(received_bytes) called as the file arrives
+    """
+    if verify is None:
+        verify = local_path is not None
+    remote = None
+    if verify:
+        _, remote = await file_hash(radio, path, debug=debug)
+        if remote is not None and local_path is not None and os.path.exists(local_path):
+            algorithm, size, digest = remote
+            if local_hash(local_path, algorithm) == (size, digest):
+                if debug:
+                    print(f"{bold}REQUEST_FILE:{normal} {path}\n\n{local_path} is already up to date")
+                return True, headers.DISK_BUFFERED_START, UP_TO_DATE
+
+    sink = None
+    command = "REQUEST_FILE"
+    args = path
+    if compress:
+        command = "REQUEST_FILE_COMPRESSED"
+        args = json.dumps([path, DOWNLINK_CODECS])
+    if local_path is not None:
+        saved = gs_transfer_state.get("downloads", local_path)
+        resuming = (resume and saved is not None and saved["remote"] == path and
+                    os.path.exists(local_path + ".part"))
+        sink = FileSink(local_path, resume=resuming)
+        if sink.bytes_written > 0:
+            command = "REQUEST_FILE_FROM"
+            args = json.dumps([path, sink.bytes_written])
+            if debug:
+                print(f"Resuming {path} from byte {sink.bytes_written}")
+        gs_transfer_state.update("downloads", local_path, {"remote": path, "offset": sink.bytes_written})
+
     success, header, response = await send_command(
         radio,
-        commands_by_name["REQUEST_FILE"]["bytes"],
-        path,
-        commands_by_name["REQUEST_FILE"]["will_respond"],
+        commands_by_name[command]["bytes"],
+        args,
+        commands_by_name[command]["will_respond"],
         debug=debug,
-        max_rx_fails=40)
+        max_rx_fails=40,
+        sink=sink,
+        progress=progress,
+        correlated=True)
 
     if header == headers.DEFAULT:
         success &= False  # this is not a DiskBufferedMessage - an error must have occurred
 
+    if sink is not None:
+        # a response of None means the transfer was the one written to the sink
+        if success and header == headers.DISK_BUFFERED_START and response is None:
+            sink.close()
+            if remote is None or _received_matches(path, remote, hashing.hash_file(sink.part_path, remote[0]), debug):
+                sink.commit()
+                response = local_path
+            else:
+                success = False
+                os.remove(sink.part_path)  # resuming from a corrupt .part would only repeat the mismatch
+            gs_transfer_state.update("downloads", local_path, None)
+        else:
+            success = False
+            _forget_sink(sink)
+            sink.abort()
+            if sink.bytes_written > 0:
+                gs_transfer_state.update("downloads", local_path, {"remote": path, "offset": sink.bytes_written})
+            else:
+                gs_transfer_state.update("downloads", local_path, None)
+    elif success and remote is not None:
+        success = _received_matches(path, remote, (len(response), hashing.hash_data(bytes(response), remote[0])),
+                                    debug)
+
     if debug:
         if success:
-            print(f"{bold}REQUEST_FILE:{normal} {path}\n\nContents:\n{response}")
+            contents = f"Saved to {local_path}" if sink is not None else f"Contents:\n{response}"
+            print(f"{bold}REQUEST_FILE:{normal} {path}\n\n{contents}")
         else:
             print(f"{bold}REQUEST_FILE:{normal} {path} {red}FAILED{normal}")
 
     return success, header, response
 
 
-async def upload_file(radio, local_path, satellite_path, debug=False):
-    msg = DiskBufferedMessage(local_path)
+def _received_matches(path, remote, received, debug):
+    """Whether the (size, digest) of a download is the one file_hash reported for path"""
+    algorithm, size, digest = remote
+    if received == (size, digest):
+        return True
+    if debug:
+        print(f"{bold}REQUEST_FILE:{normal} {path} {red}{algorithm} mismatch{normal}: "
+              f"received {received[0]} bytes, {received[1]}, expected {size} bytes, {digest}")
+    return False
+
+
+async def request_file_fountain(radio, path, debug=False, local_path=None, progress=None, max_rx_fails=40,
+                                max_more=4):
+    """Downlinks the file at `path` on the satellite as fountain coded symbols, without per packet acks
+    (see lib/radio_utils/fountain.py).
+
+    Symbols are decoded as they arrive; once the file is complete the satellite is told to stop with
+    FOUNTAIN_DONE.  If the symbols stop before then, as they do once the satellite has sent all it
+    planned to on a link losing more than that allows for, more are asked for with FOUNTAIN_MORE, up
+    to `max_more` times.  Returns like request_file, including saving to `local_path` if given.
+
+    :param progress: Optional function(received_bytes) called as symbols arrive
+    """
+    from gs_fountain import FountainDecoder  # needs numpy, which the other commands don't
+
+    success, _, _ = await send_command(
+        radio,
+        commands_by_name["REQUEST_FILE_FOUNTAIN"]["bytes"],
+        path,
+        False,  # the response is the symbol stream, received below
+        debug=debug)
+    if not success:
+        return False, None, None
+
+    decoder = None
+    stream_id = None
+    rx_fails = 0
+    more = 0
+    last_symbol_id = 0
+    while decoder is None or not decoder.complete():
+        res = await receive(radio, debug=debug)
+        if res is None:
+            rx_fails += 1
+            if decoder is not None and rx_fails == FOUNTAIN_MORE_AFTER and more < max_more:
+                # the last few blocks take many symbols to come up, and FOUNTAIN_DONE stops any not needed,
+                # so ask for a good share of the file, scaled up for the symbols lost so far
+                delivered = max(decoder.received / (last_symbol_id + 1), 0.1)
+                symbols = max(FOUNTAIN_MORE_MIN, int(decoder.k * FOUNTAIN_MORE_FRACTION / delivered))
+                if debug:
+                    print(f"{decoder.solved} of {decoder.k} blocks decoded from {decoder.received} symbols, "
+                          f"asking for {symbols} more")
+                success, _, _ = await send_command(
+                    radio, commands_by_name["FOUNTAIN_MORE"]["bytes"], json.dumps([stream_id, symbols]),
+                    commands_by_name["FOUNTAIN_MORE"]["will_respond"], debug=debug)
+                if success:
+                    more += 1
+                    rx_fails = 0
+                continue
+            if rx_fails > max_rx_fails:
+                if debug:
+                    received = decoder.received if decoder is not None else 0
+                    print(f"{bold}REQUEST_FILE_FOUNTAIN:{normal} {path} {red}FAILED{normal} after {received} symbols")
+                return False, None, None
+            continue
+        rx_fails = 0
+
+        header, payload = res
+        oh = header[5]
+        if oh == headers.DEFAULT:
+            # e.g. File not found
+            if debug:
+                print(f"{bold}REQUEST_FILE_FOUNTAIN:{normal} {path} {red}FAILED{normal} {payload}")
+            return False, oh, payload
+        if oh != headers.FOUNTAIN_SYMBOL:
+            if debug:
+                print(f"Ignoring packet with header {oh} during fountain download")
+            continue
+        if stream_id is None:
+            stream_id = payload[0]
+        elif payload[0] != stream_id:
+            continue
+
+        if decoder is None:
+            decoder = FountainDecoder(int.from_bytes(payload[4:4 + SIZE_LEN], "big"))
+        symbol_id = (payload[2] << 8) | payload[3]
+        last_symbol_id = max(last_symbol_id, symbol_id)
+        start = 4 + SIZE_LEN
+        if decoder.add(symbol_id, payload[start:start + SYMBOL_LEN]):
+            if progress is not None:
+                progress(decoder.received * SYMBOL_LEN)
+            if decoder.received >= decoder.k:
+                decoder.decode()
+
+    await send_command(radio, commands_by_name["FOUNTAIN_DONE"]["bytes"], str(stream_id),
+                       commands_by_name["FOUNTAIN_DONE"]["will_respond"], debug=debug)
+
+    response = decoder.join()
+    if local_path is not None:
+        sink = FileSink(local_path)
+        sink.write(response)
+        sink.commit()
+        response = local_path
+
+    if debug:
+        contents = f"Saved to {local_path}" if local_path is not None else f"Contents:\n{response}"
+        print(f"{bold}REQUEST_FILE_FOUNTAIN:{normal} {path}: {decoder.received} symbols for {decoder.k} blocks\n\n"
+              f"{contents}")
+
+    return True, headers.DISK_BUFFERED_START, response
+
+
+async def blast_repair(radio, stream_id, missing, debug=False):
+    """Asks for the first missing chunks of a blast that fit in one BLAST_REPAIR, or with no missing chunks ends it"""
+    base, bitmap = write_bitmap(missing, BLAST_BITMAP_BYTES)
+    args = bytes([stream_id, base >> 8, base & 0xff]) + bytes(bitmap)
+    success, _, _ = await send_command(
+        radio,
+        commands_by_name["BLAST_REPAIR"]["bytes"],
+        args,
+        False,  # any response is the repair round, received by request_file_blast
+        debug=debug,
+        args_are_bytes=True)
+    return success
+
+
+async def request_file_blast(radio, path, debug=False, local_path=None, progress=None, max_rx_fails=40,
+                             max_idle_rounds=5):
+    """Downlinks the file at `path` on the satellite in blast mode (see lib/radio_utils/blast_message.py).
+
+    Every chunk is sent back to back without acks.  After each round's BLAST_END the missing
+    chunks are requested with a BLAST_REPAIR bitmap, until the file is complete.  Chunks are
+    streamed to `local_path` like request_file, otherwise the file is returned in memory.
+
+    :param progress: Optional function(received_bytes) called as chunks arrive
+    :param max_idle_rounds: Give up after this many repair rounds in a row bring no new chunks
+    """
+    success, _, _ = await send_command(
+        radio,
+        commands_by_name["REQUEST_FILE_BLAST"]["bytes"],
+        path,
+        False,  # the response is the blast, received below
+        debug=debug)
+    if not success:
+        return False, None, None
+
+    sink = FileSink(local_path) if local_path is not None else None
+    reassembler = Reassembler(sink, progress)
+    stream_id = None
+    rounds = 0
+    idle_rounds = 0
+    received_at_repair = 0
+    rx_fails = 0
+    while not reassembler.complete():
+        res = await receive(radio, debug=debug)
+        if res is None:
+            rx_fails += 1
+            if rx_fails <= max_rx_fails:
+                continue
+            if stream_id is None:
+                break
+            # the round's BLAST_END or our BLAST_REPAIR went missing; ask again
+            rx_fails = 0
+        else:
+            rx_fails = 0
+            header, payload = res
+            oh = header[5]
+            if oh == headers.DEFAULT:
+                # e.g. File not found
+                if debug:
+                    print(f"{bold}REQUEST_FILE_BLAST:{normal} {path} {red}FAILED{normal} {payload}")
+                break
+            if oh != headers.BLAST_CHUNK and oh != headers.BLAST_END:
+                if debug:
+                    print(f"Ignoring packet with header {oh} during blast download")
+                continue
+            if stream_id is None:
+                stream_id = payload[0]
+            elif payload[0] != stream_id:
+                continue
+
+            index = (payload[2] << 8) | payload[3]
+            if oh == headers.BLAST_CHUNK:
+                reassembler.add(index, payload[4:])
+                continue
+            # BLAST_END: index is the chunk count
+            reassembler.finish(index - 1)
+            if reassembler.complete():
+                break
+
+        missing = reassembler.missing()
+        if reassembler.end_index is None:
+            # no BLAST_END yet, so the chunk count is unknown: also ask for the chunk after the last one
+            # received, which the satellite skips if it is past the end before resending BLAST_END
+            missing.append(reassembler.received + len(missing))
+        if debug:
+            print(f"\nBlast round {rounds}: {reassembler.received} chunks received, {len(missing)} missing")
+        idle_rounds = idle_rounds + 1 if reassembler.received == received_at_repair else 0
+        if idle_rounds >= max_idle_rounds:
+            break
+        received_at_repair = reassembler.received
+        rounds += 1
+        await blast_repair(radio, stream_id, missing, debug=debug)
+
+    if not reassembler.complete():
+        if debug:
+            print(f"{bold}REQUEST_FILE_BLAST:{normal} {path} {red}FAILED{normal} after {rounds} repair rounds")
+        if sink is not None:
+            sink.abort()
+        return False, None, None
+
+    # an empty bitmap tells the satellite the blast is done
+    await blast_repair(radio, stream_id, [], debug=debug)
+    if sink is not None:
+        sink.commit()
+        response = local_path
+    else:
+        response = reassembler.join()
+    if debug:
+        contents = f"Saved to {local_path}" if sink is not None else f"Contents:\n{response}"
+        print(f"{bold}REQUEST_FILE_BLAST:{normal} {path}: {rounds} repair rounds\n\n{contents}")
+    return True, headers.DISK_BUFFERED_START, response
+
+
+async def append_file(radio, source_path, destination_path, offset, debug=False):
+    """Appends source_path to destination_path on the satellite, if destination_path is offset bytes long.
+    Returns success, and the size of destination_path reported by the satellite (or None)."""
+    arg_string = json.dumps([source_path, destination_path, offset])
+    success, _, response = await send_command(
+        radio,
+        commands_by_name["APPEND_FILE"]["bytes"],
+        arg_string,
+        commands_by_name["APPEND_FILE"]["will_respond"],
+        debug=debug)
+
+    if isinstance(response, (bytes, bytearray)):
+        response = response.decode("ascii", "replace")
+    response = str(response)
+    size = None
+    if "size " in response:
+        try:
+            size = int(response.rsplit("size ", 1)[1])
+        except ValueError:
+            pass
+    success &= "success" in response.lower()
+
+    if debug:
+        if success:
+            print(f"{bold}APPEND_FILE Response:{normal} {response}")
+        else:
+            print(f"{bold}APPEND_FILE Response:{normal} {red}FAILED{normal} {response}")
+
+    return success, size
+
+
+async def upload_file(radio, local_path, satellite_path, debug=False, segment_bytes=8192, resume=True, compress=False,
+                      verify=True):
+    """Uploads local_path to satellite_path.
+
+    The file is sent in upload sessions of segment_bytes that name satellite_path in their first
+    packet (see lib/radio_utils/upload_session.py).  The satellite appends each one to
+    satellite_path.part as it arrives and renames it into place once complete, so uploads to
+    different paths can run at once.  Progress is saved after every session, so an upload
+    interrupted by a missed ack or the end of a pass continues from where the satellite's .part
+    file ends the next time it is started with `resume`.
+
+    A satellite that does not answer upload sessions (one whose radio task does not pass upload
+    packets to commands.upload_packet) is sent the file the older way instead: in segments staged
+    in UPLOAD_STAGING_PATH, appended to satellite_path.part with APPEND_FILE and moved into
+    place with MOVE_FILE, one upload at a time.
+
+    With `compress` the file is compressed with UPLOAD_CODEC, uploaded to satellite_path.z and
+    decompressed into place on the satellite, unless compressing does not make it smaller.
+
+    With `verify` the upload is skipped if satellite_path already has the same hash as local_path
+    (see file_hash), and otherwise fails if satellite_path does not have it once in place.
+    """
+    if verify and await _satellite_copy_matches(radio, local_path, satellite_path, debug=debug):
+        if debug:
+            print(f"{satellite_path} is already up to date")
+        return True
+
+    if compress:
+        success = await _upload_compressed(radio, local_path, satellite_path, debug, segment_bytes, resume)
+    else:
+        success = await _upload(radio, local_path, satellite_path, debug, segment_bytes, resume)
+
+    if success and verify:
+        success = await _satellite_copy_matches(radio, local_path, satellite_path, debug=debug)
+        if debug and not success:
+            print(f"{bold}UPLOAD:{normal} {satellite_path} {red}hash mismatch{normal}")
+    return success
+
+
+async def _upload_compressed(radio, local_path, satellite_path, debug, segment_bytes, resume):
+    """Uploads local_path compressed with UPLOAD_CODEC (see upload_file)"""
+    compressed_path = _compressed_upload_path(local_path)
+    if (not os.path.exists(compressed_path) or
+            os.path.getmtime(compressed_path) < os.path.getmtime(local_path)):
+        compression.compress_file(UPLOAD_CODEC, local_path, compressed_path)
+    if os.path.getsize(compressed_path) >= os.path.getsize(local_path):
+        os.remove(compressed_path)
+        return await _upload(radio, local_path, satellite_path, debug, segment_bytes, resume)
+
+    if debug:
+        print(f"Compressed {local_path} to {os.path.getsize(compressed_path)} bytes")
+    success = await _upload(radio, compressed_path, satellite_path + ".z", debug, segment_bytes, resume)
+    if success:
+        success = await decompress_file(radio, satellite_path + ".z", satellite_path, UPLOAD_CODEC, debug=debug)
+    if success:
+        os.remove(compressed_path)
+    return success
+
+
+async def _upload(radio, local_path, satellite_path, debug, segment_bytes, resume):
+    """Uploads local_path in upload sessions of segment_bytes (see lib/radio_utils/upload_session.py), which the
+    satellite appends to satellite_path.part and renames into place once it is complete.
+    Falls back to _upload_staged if the satellite does not answer upload sessions."""
+    global _upload_sessions
+    stat = os.stat(local_path)
+    identity = {"local": local_path, "size": stat.st_size, "mtime": stat.st_mtime}
+    saved = gs_transfer_state.get("uploads", satellite_path)
+    offset = 0
+    if resume and saved is not None and all(saved.get(k) == v for k, v in identity.items()):
+        offset = saved["offset"]
+        if debug:
+            print(f"Resuming upload of {local_path} from byte {offset}")
+
+    if _upload_sessions is False:
+        return await _upload_staged(radio, local_path, satellite_path, debug, segment_bytes, identity, offset)
+
+    retried = False
+    while True:
+        session_id = _next_upload_session_id()
+        msg = UploadMessage(local_path, satellite_path, session_id, offset=offset, length=segment_bytes)
+        if not await send_message(radio, msg, debug=debug):
+            if msg.acked_bytes() > 0:
+                gs_transfer_state.update("uploads", satellite_path, dict(identity, offset=offset + msg.acked_bytes()))
+            return False
+        answered, success, size = await _upload_result(radio, session_id, debug=debug)
+        if not answered and _upload_sessions is None:
+            if debug:
+                print("No answer to the upload session, uploading with APPEND_FILE and MOVE_FILE instead")
+            success = await _upload_staged(radio, local_path, satellite_path, debug, segment_bytes, identity, offset)
+            if success:
+                _upload_sessions = False  # the link is fine, so the satellite does not handle upload sessions
+            return success
+        _upload_sessions = _upload_sessions or answered
+        if size is None or size > stat.st_size:
+            return False
+        gs_transfer_state.update("uploads", satellite_path, dict(identity, offset=size))
+        if not success:
+            # the satellite's part file is not where we left it; continue from where it is, once
+            if retried:
+                return False
+            retried = True
+        elif size == stat.st_size:
+            break
+        else:
+            retried = False
+        offset = size
+
+    gs_transfer_state.update("uploads", satellite_path, None)
+    return True
+
 
-    success = await send_message(radio, msg, debug=debug)
+async def _upload_staged(radio, local_path, satellite_path, debug, segment_bytes, identity, offset):
+    """Uploads local_path from offset in segments staged in UPLOAD_STAGING_PATH, which are appended to
+    satellite_path.part with APPEND_FILE and moved into place with MOVE_FILE (see upload_file)"""
+    part_path = satellite_path + ".part"
+    size = identity["size"]
+    while offset < size or offset == 0:
+        msg = DiskBufferedMessage(local_path, offset=offset, length=segment_bytes)
+        if not await send_message(radio, msg, debug=debug):
+            return False
+        success, part_size = await append_file(radio, UPLOAD_STAGING_PATH, part_path, offset, debug=debug)
+        if not success and offset == 0 and part_size:
+            # a part file left over from an older upload; start it over
+            await send_command(radio, commands_by_name["DELETE_FILE"]["bytes"], part_path,
+                               commands_by_name["DELETE_FILE"]["will_respond"], debug=debug)
+            success, part_size = await append_file(radio, UPLOAD_STAGING_PATH, part_path, offset, debug=debug)
+        if not success:
+            if part_size is not None and part_size <= size:
+                # the satellite's part file is not where we left it; continue from where it is next time
+                gs_transfer_state.update("uploads", satellite_path, dict(identity, offset=part_size))
+            return False
+        offset = part_size if part_size is not None else msg.msg_len
+        gs_transfer_state.update("uploads", satellite_path, dict(identity, offset=offset))
+        if offset == 0:
+            break  # empty file
 
+    success = await move_file(radio, part_path, satellite_path, debug=debug)
     if success:
-        success &= await move_file(radio, "/sd/disk_buffered_message", satellite_path, debug=debug)
+        gs_transfer_state.update("uploads", satellite_path, None)
+    return success
+
+
+async def _upload_result(radio, session_id, debug=False):
+    """Waits for the satellite's answer to the end of upload session session_id.
+    Returns whether anything was received, success, and the size of the part file (or of the file, once complete)
+    reported by the satellite (or None)."""
+    header, response = await wait_for_message(radio, max_rx_fails=30, debug=debug, beacons=False)
+
+    if isinstance(response, (bytes, bytearray)):
+        response = response.decode("utf-8", "replace")
+    response = str(response)
+    size = None
+    if f"uploading {session_id}:" in response and "size " in response:
+        try:
+            size = int(response.rsplit("size ", 1)[1])
+        except ValueError:
+            pass
+    success = response.startswith(f"Success uploading {session_id}:")
+
+    if debug:
+        if success:
+            print(f"{bold}UPLOAD Response:{normal} {response}")
+        else:
+            print(f"{bold}UPLOAD Response:{normal} {red}FAILED{normal} {response}")
+
+    return header is not None, success, size
+
+
+def _next_upload_session_id():
+    """Session ids for uploads, so the satellite can tell concurrent uploads apart"""
+    global _upload_session_id
+    _upload_session_id = (_upload_session_id + 1) & 0xff
+    return _upload_session_id
+
+
+def _compressed_upload_path(local_path):
+    """Where the compressed copy of local_path is kept until it is uploaded.
+    It is reused while local_path is unchanged, so an interrupted compressed upload can resume."""
+    import hashlib
+    import tempfile
+    name = hashlib.sha1(os.path.abspath(local_path).encode()).hexdigest()[:16]
+    return os.path.join(tempfile.gettempdir(), f"gs_upload_{name}.z")
+
+
+async def file_hash(radio, path, algorithm=HASH_ALGORITHM, debug=False):
+    """Returns success, and the (algorithm, size, hex digest) of `path` on the satellite.
+    The satellite hashes with crc32 instead if it can't do algorithm."""
+    success, _, response = await send_command(
+        radio,
+        commands_by_name["FILE_HASH"]["bytes"],
+        json.dumps([path, algorithm]),
+        commands_by_name["FILE_HASH"]["will_respond"],
+        debug=debug,
+        max_rx_fails=40)
+
+    if isinstance(response, (bytes, bytearray)):
+        response = response.decode("ascii", "replace")
+    response = str(response)
+    result = None
+    if success and response.startswith("Success hashing file: "):
+        try:
+            algorithm, size, digest = response.split(": ", 1)[1].split()
+            result = (algorithm, int(size), digest)
+        except ValueError:
+            pass
+    success = result is not None
+
+    if debug:
+        if success:
+            print(f"{bold}FILE_HASH Response:{normal} {response}")
+        else:
+            print(f"{bold}FILE_HASH Response:{normal} {red}FAILED{normal} {response}")
+
+    return success, result
+
+
+async def _satellite_copy_matches(radio, local_path, satellite_path, debug=False):
+    """Whether satellite_path on the satellite has the same size and hash as local_path"""
+    success, remote = await file_hash(radio, satellite_path, debug=debug)
+    if not success:
+        return False
+    algorithm, size, digest = remote
+    return local_hash(local_path, algorithm) == (size, digest)
+
+
+async def decompress_file(radio, source_path, destination_path, codec, debug=False):
+    arg_string = json.dumps([source_path, destination_path, codec])
+    success, _, response = await send_command(
+        radio,
+        commands_by_name["DECOMPRESS_FILE"]["bytes"],
+        arg_string,
+        commands_by_name["DECOMPRESS_FILE"]["will_respond"],
+        debug=debug)
+
+    success &= "success" in str(response).lower()
+
+    if debug:
+        if success:
+            print(f"{bold}DECOMPRESS_FILE Response:{normal} {response}")
+        else:
+            print(f"{bold}DECOMPRESS_FILE Response:{normal} {red}FAILED{normal} {response}")
+
+    return success
+
+
+async def file_block_hashes(radio, path, block_size, debug=False):
+    """Returns success, and the parsed block hashes of `path` on the satellite (see gs_delta.parse_block_hashes)"""
+    success, header, response = await send_command(
+        radio,
+        commands_by_name["FILE_BLOCK_HASHES"]["bytes"],
+        json.dumps([path, block_size]),
+        commands_by_name["FILE_BLOCK_HASHES"]["will_respond"],
+        debug=debug,
+        max_rx_fails=40)
+
+    hashes = None
+    if success and header != headers.DEFAULT:
+        try:
+            hashes = parse_block_hashes(bytes(response))
+        except ValueError:
+            # e.g. the file does not exist, and the response is an error message
+            success = False
+    else:
+        success = False
+
+    if debug and not success:
+        print(f"{bold}FILE_BLOCK_HASHES Response:{normal} {red}FAILED{normal} {response}")
+
+    return success, hashes
+
+
+async def apply_delta(radio, basis_path, delta_path, destination_path, debug=False):
+    arg_string = json.dumps([basis_path, delta_path, destination_path])
+    success, _, response = await send_command(
+        radio,
+        commands_by_name["APPLY_DELTA"]["bytes"],
+        arg_string,
+        commands_by_name["APPLY_DELTA"]["will_respond"],
+        debug=debug)
+
+    success &= "success" in str(response).lower()
+
+    if debug:
+        if success:
+            print(f"{bold}APPLY_DELTA Response:{normal} {response}")
+        else:
+            print(f"{bold}APPLY_DELTA Response:{normal} {red}FAILED{normal} {response}")
+
     return success
 
 
+async def upload_file_delta(radio, local_path, satellite_path, basis_path=None, block_size=DELTA_BLOCK_SIZE,
+                            debug=False):
+    """Uploads local_path to satellite_path as the changes from basis_path (default: satellite_path)
+    on the satellite, rsync style.
+
+    The satellite sends the hashes of each block of basis_path, the blocks it already has are found
+    in the local file, and only a delta of block references and changed bytes is uploaded and
+    applied.  Falls back to upload_file if the basis can't be hashed (e.g. it does not exist yet) or
+    the delta would not be smaller than the file.
+    """
+    if basis_path is None:
+        basis_path = satellite_path
+
+    with open(local_path, "rb") as f:
+        data = f.read()
+
+    success, hashes = await file_block_hashes(radio, basis_path, block_size, debug=debug)
+    if not success:
+        if debug:
+            print(f"Could not hash {basis_path}, uploading the whole file")
+        return await upload_file(radio, local_path, satellite_path, debug=debug)
+
+    delta, literal_bytes, copied_blocks = compute_delta(data, *hashes)
+    if debug:
+        print(f"Delta: {len(delta)} bytes for {len(data)}, {literal_bytes} literal bytes, {copied_blocks} blocks reused")
+    if len(delta) >= len(data):
+        return await upload_file(radio, local_path, satellite_path, debug=debug)
+
+    import tempfile
+    fd, delta_local_path = tempfile.mkstemp(suffix=".delta")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(delta)
+        delta_path = satellite_path + ".delta"
+        if not await upload_file(radio, delta_local_path, delta_path, debug=debug, resume=False, verify=False):
+            return False
+    finally:
+        os.remove(delta_local_path)
+
+    return await apply_delta(radio, basis_path, delta_path, satellite_path, debug=debug)
+
+
+async def list_dir(radio, path, debug=False):
+    """Returns success, and the names of the entries in the directory `path` on the satellite"""
+    success, header, response = await send_command(
+        radio,
+        commands_by_name["LIST_DIR"]["bytes"],
+        path,
+        commands_by_name["LIST_DIR"]["will_respond"],
+        debug=debug)
+
+    names = None
+    if success and header != headers.DEFAULT:
+        try:
+            names = json.loads(bytes(response))
+        except ValueError:
+            success = False
+    else:
+        success = False
+
+    return success, names
+
+
+def file_size_query(path):
+    """The QUERY that returns the size in bytes of the file `path` on the satellite (see parse_file_size)"""
+    return f"os.stat({path!r})[6]"
+
+
+async def file_size(radio, path, debug=False):
+    """Returns success, and the size in bytes of the file `path` on the satellite"""
+    success, header, response = await send_command(
+        radio,
+        commands_by_name["QUERY"]["bytes"],
+        file_size_query(path),
+        commands_by_name["QUERY"]["will_respond"],
+        debug=debug)
+    return parse_file_size(success, header, response)
+
+
+def parse_file_size(success, header, response):
+    """Returns success, and the size from the response to file_size_query"""
+    size = None
+    if success and header != headers.DEFAULT:
+        try:
+            size = int(bytes(response))
+        except ValueError:
+            success = False
+    else:
+        success = False
+
+    return success, size
+
+
 async def request_beacon(radio, debug=False):
     success, header, response = await send_command(
         radio,
@@ -170,11 +1082,15 @@ async def receive(rfm9x, with_ack=True, debug=False):
 
 async def send_message(radio, msg, debug=False):
     success = True
+    # every packet is written into the same buffer, and handed to the radio as a view of it
+    buffer = bytearray(MAX_PACKET_LEN)
+    view = memoryview(buffer)
     while True:
-        packet, with_ack = msg.packet()
+        length, with_ack = msg.packet_into(buffer)
+        packet = view[:length]
 
         if debug:
-            debug_packet = str(packet)[:20] + "...." if len(packet) > 23 else packet
+            debug_packet = str(bytes(packet[:20])) + "...." if length > 23 else bytes(packet)
             print(f"Sending packet: {debug_packet}, with_ack: {with_ack}")
 
         if with_ack:
@@ -193,18 +1109,74 @@ async def send_message(radio, msg, debug=False):
     return success
 
 
+# stream id -> (header, Reassembler, codec).  Module level, so a transfer interrupted by a beacon or
+# command response is picked up again by the next wait_for_message call.
+_streams = {}
+
+MEMORY_STREAM_HEADERS = (headers.MEMORY_STREAM_START, headers.MEMORY_STREAM_MID, headers.MEMORY_STREAM_END)
+DISK_STREAM_HEADERS = (headers.DISK_STREAM_START, headers.DISK_STREAM_MID, headers.DISK_STREAM_END)
+
+
+def _forget_sink(sink):
+    """Drops unfinished streams that were writing to sink"""
+    for stream_id in [sid for sid, (_, stream, _) in _streams.items()
+                      if stream.sink is sink or getattr(stream.sink, "sink", None) is sink]:
+        del _streams[stream_id]
+
+
 class _data:
+    """What a wait for a message has received.  stream_id is the stream the message waited for arrives on:
+    the correlation id of a correlated command, otherwise whichever transfer starts first (None for the
+    legacy buffered headers).  Once that transfer has started, started is True."""
 
-    def __init__(self):
-        self.msg = bytes([])
-        self.msg_last = bytes([])
-        self.cmsg = bytes([])
-        self.cmsg_last = bytes([])
+    def __init__(self, sink=None, progress=None, stream_id=None):
+        self.msg = Reassembler()
+        self.cmsg = Reassembler()
+        self.msg_last = None  # (header, payload) of the last legacy packet, to spot resent ones
+        self.cmsg_last = None
+        self.sink = sink
+        self.progress = progress
+        self.stream_id = stream_id
+        self.correlated = stream_id is not None
+        self.started = False
 
+    def new_reassembler(self, codec=compression.CODEC_NONE, stream_id=None):
+        """A Reassembler for a transfer starting on stream_id.  The transfer waited for is streamed to the sink, if
+        there is one, and decompressed on the way if it is compressed with codec; any other is kept in memory."""
+        if self.started or (self.correlated and stream_id != self.stream_id):
+            return Reassembler()
+        self.started = True
+        self.stream_id = stream_id
+        sink = self.sink
+        if sink is not None and codec != compression.CODEC_NONE:
+            sink = DecompressingSink(sink, compression.decompressor(codec))
+        reassembler = Reassembler(sink, self.progress)
+        self.sink = None
+        self.progress = None
+        return reassembler
 
-async def wait_for_message(radio, max_rx_fails=10, debug=False):
-    data = _data()
 
+def _result(reassembler):
+    # transfers streamed to a sink have nothing left in memory; they complete with None
+    return reassembler.join() if reassembler.sink is None else None
+
+
+async def wait_for_message(radio, max_rx_fails=10, debug=False, sink=None, progress=None, correlation_id=None,
+                           beacons=True):
+    """Receives packets until a complete message arrives, and returns (header, message).
+
+    With a correlation_id, the message is the response to that correlated command.  Otherwise it is
+    the first to arrive, or once a buffered transfer has started, that transfer.  Beacons, single packet
+    messages and other transfers that arrive meanwhile are printed, and do not end the wait.  Without
+    `beacons` a beacon is never the message waited for.
+
+    With a sink (e.g. gs_reassembly.FileSink), the buffered transfer waited for is written to the
+    sink as it arrives instead of being held in memory, and completes with a message of None.
+    """
+    return await _wait(radio, _data(sink, progress, correlation_id), max_rx_fails, debug, beacons)
+
+
+async def _wait(radio, data, max_rx_fails=10, debug=False, beacons=True):
     rx_fails = 0
     while True:
         res = await receive(radio, debug=debug)
@@ -213,7 +1185,7 @@ async def wait_for_message(radio, max_rx_fails=10, debug=False):
             rx_fails += 1
             if rx_fails > max_rx_fails:
                 print("wait_for_message: max_rx_fails hit")
-                return None, data.msg + data.cmsg
+                return None, (_result(data.msg) or b'') + (_result(data.cmsg) or b'')
             else:
                 continue
         else:
@@ -223,16 +1195,37 @@ async def wait_for_message(radio, max_rx_fails=10, debug=False):
 
         oh = header[5]
         if oh == headers.DEFAULT or oh == headers.BEACON:
+            if data.correlated or data.started or (oh == headers.BEACON and not beacons):
+                print_message(oh, payload)  # not the response being waited for
+                continue
             return oh, payload
+        elif oh == headers.RESPONSE:
+            if data.correlated and payload[0] == data.stream_id:
+                return payload[1], payload[2:]
+            print_message(payload[1], payload[2:])
         elif oh == headers.MEMORY_BUFFERED_START or oh == headers.MEMORY_BUFFERED_MID or oh == headers.MEMORY_BUFFERED_END:
             handle_memory_buffered(oh, data, payload)
             if oh == headers.MEMORY_BUFFERED_END:
-                return headers.MEMORY_BUFFERED_START, data.msg
+                if data.started and data.stream_id is None:
+                    return headers.MEMORY_BUFFERED_START, _result(data.msg)
+                print_message(headers.MEMORY_BUFFERED_START, _result(data.msg))
 
         elif oh == headers.DISK_BUFFERED_START or oh == headers.DISK_BUFFERED_MID or oh == headers.DISK_BUFFERED_END:
             handle_disk_buffered(oh, data, payload)
             if oh == headers.DISK_BUFFERED_END:
-                return headers.DISK_BUFFERED_START, data.cmsg
+                if data.started and data.stream_id is None:
+                    return headers.DISK_BUFFERED_START, _result(data.cmsg)
+                print_message(headers.DISK_BUFFERED_START, _result(data.cmsg))
+
+        elif oh in MEMORY_STREAM_HEADERS or oh in DISK_STREAM_HEADERS:
+            done = handle_stream(oh, payload, data, debug=debug)
+            if done is not None:
+                if data.started and payload[0] == data.stream_id:
+                    return done
+                print_message(*done)  # a transfer left over from an earlier request
+        elif oh == headers.FOUNTAIN_SYMBOL or oh == headers.BLAST_CHUNK:
+            # packets still in flight from a fountain or blast download that has already finished
+            continue
         else:
             print(f"Unrecognized header {oh}")
             return oh, payload
@@ -245,6 +1238,9 @@ def print_message(header, message):
         print(beacon_str(message))
     elif header == headers.MEMORY_BUFFERED_START or header == headers.DISK_BUFFERED_START:
         print(f"Buffered:\n")
+        if message is None:
+            print("(written to file)")
+            return
         try:
             print(message.decode(encoding="utf-8", errors="strict"))
         except UnicodeDecodeError:
@@ -268,29 +1264,65 @@ def beacon_str(beacon):
 
 
 def handle_memory_buffered(header, data, payload):
+    # Legacy packets carry no chunk index.  A chunk resent after its ack was lost goes out with a new RadioHead
+    # identifier, so the radio driver does not drop it; it is spotted by repeating the last packet instead.
     if header == headers.MEMORY_BUFFERED_START:
-        data.msg_last = payload
-        data.msg = payload
-    else:
-        if payload != data.msg_last:
-            data.msg += payload
-        else:
-            print('Repeated payload')
+        data.msg = data.new_reassembler()
+    elif (header, payload) == data.msg_last:
+        print('Repeated payload')
+        return
+    data.msg_last = (header, bytes(payload))
+    data.msg.append(payload)
 
     if header == headers.MEMORY_BUFFERED_END:
-        data.msg_last = bytes([])
+        data.msg.finish()
+
+
+def handle_stream(header, payload, data=None, debug=False):
+    """Adds a stream multiplexed packet to its stream.
+    Returns (header, message) when the stream is complete, with the header of the equivalent
+    legacy buffered message, otherwise None.  A stream that begins with its first chunk (a START, or
+    the END of a one chunk transfer) is given data.new_reassembler(); one first seen mid transfer (its
+    START was lost, or it is left over from an earlier request) is kept in memory, so it can't take
+    the sink from the transfer that was asked for."""
+    stream_id = payload[0]
+    codec = payload[1] & compression.CODEC_MASK
+    index = (payload[2] << 8) | payload[3]
+    kind = headers.MEMORY_BUFFERED_START if header in MEMORY_STREAM_HEADERS else headers.DISK_BUFFERED_START
+
+    first = index == 0 and header != headers.MEMORY_STREAM_MID and header != headers.DISK_STREAM_MID
+    if first or stream_id not in _streams:
+        if stream_id in _streams and debug:
+            print(f'Stream {stream_id} restarted, missing chunks {_streams[stream_id][1].missing()}')
+        _streams[stream_id] = (kind, data.new_reassembler(codec, stream_id) if first and data is not None else Reassembler(),
+                               codec)
+    _, stream, codec = _streams[stream_id]
+
+    if not stream.add(index, payload[4:]) and debug:
+        print(f'Repeated chunk {index} on stream {stream_id}')
+    if header == headers.MEMORY_STREAM_END or header == headers.DISK_STREAM_END:
+        stream.finish(index)
+
+    if stream.complete():
+        del _streams[stream_id]
+        if codec == compression.CODEC_NONE:
+            return kind, _result(stream)
+        if isinstance(stream.sink, DecompressingSink):
+            stream.sink.finish()
+            return kind, None
+        return kind, compression.decompress(codec, stream.join())
+    return None
 
 
 def handle_disk_buffered(header, data, response):
+    # see handle_memory_buffered
     if header == headers.DISK_BUFFERED_START:
-        data.cmsg = response
-        data.cmsg_last = response
-    else:
-        if response != data.cmsg_last:
-            data.cmsg += response
-        else:
-            print('Repeated payload')
-        data.cmsg_last = response
+        data.cmsg = data.new_reassembler()
+    elif (header, response) == data.cmsg_last:
+        print('Repeated payload')
+        return
+    data.cmsg_last = (header, bytes(response))
+    data.cmsg.append(response)
 
     if header == headers.DISK_BUFFERED_END:
-        data.cmsg_last = bytes([])
+        data.cmsg.finish()
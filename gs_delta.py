@@ -0,0 +1,129 @@
+"""
+Computes rsync style deltas against a file on the satellite.
+
+Given the block hashes the satellite downlinks for its copy of a file (FILE_BLOCK_HASHES), the
+new file is scanned with a rolling weak checksum, one byte at a time, for blocks the satellite
+already has.  Matched blocks are sent as block references and everything else as literal bytes,
+in the delta format read by lib/radio_utils/delta.apply_delta.
+"""
+import struct
+from lib.radio_utils.delta import (weak_checksum, strong_hash, HASHES_HEADER, DELTA_HEADER, COPY, LITERAL,
+                                   COPY_OP, LITERAL_OP, MAX_LITERAL)
+
+
+def parse_block_hashes(data):
+    """Parses a FILE_BLOCK_HASHES response into (block_size, file_size, strong_len, [(weak, strong), ...])"""
+    header_len = struct.calcsize(HASHES_HEADER)
+    if len(data) < header_len:
+        raise ValueError("Block hashes too short")
+    block_size, file_size, strong_len = struct.unpack(HASHES_HEADER, data[:header_len])
+    entry_len = 4 + strong_len
+    blocks = (file_size + block_size - 1) // block_size if block_size else 0
+    if block_size == 0 or len(data) != header_len + blocks * entry_len:
+        raise ValueError("Block hashes do not match the file size")
+    hashes = []
+    for offset in range(header_len, len(data), entry_len):
+        weak = struct.unpack('>I', data[offset:offset + 4])[0]
+        hashes.append((weak, bytes(data[offset + 4:offset + entry_len])))
+    return block_size, file_size, strong_len, hashes
+
+
+class _DeltaWriter:
+    """Appends ops to a delta, merging consecutive block references into one COPY op"""
+
+    def __init__(self, delta):
+        self.delta = delta
+        self.copy_first = None
+        self.copy_count = 0
+        self.literal_bytes = 0
+        self.copied_blocks = 0
+
+    def literal(self, data):
+        if not data:
+            return
+        self._flush_copy()
+        for i in range(0, len(data), MAX_LITERAL):
+            chunk = data[i:i + MAX_LITERAL]
+            self.delta += struct.pack(LITERAL, LITERAL_OP, len(chunk))
+            self.delta += chunk
+        self.literal_bytes += len(data)
+
+    def copy(self, block):
+        self.copied_blocks += 1
+        if self.copy_first is not None and block == self.copy_first + self.copy_count and self.copy_count < 0xffff:
+            self.copy_count += 1
+            return
+        self._flush_copy()
+        self.copy_first = block
+        self.copy_count = 1
+
+    def finish(self):
+        self._flush_copy()
+        return self.delta
+
+    def _flush_copy(self):
+        if self.copy_first is not None:
+            self.delta += struct.pack(COPY, COPY_OP, self.copy_first, self.copy_count)
+            self.copy_first = None
+
+
+def compute_delta(data, block_size, file_size, strong_len, hashes):
+    """Returns (delta, literal_bytes, copied_blocks): the delta that rebuilds `data` from the
+    file_size byte file the satellite sent `hashes` for"""
+    data = memoryview(bytes(data))
+    n = len(data)
+    L = block_size
+
+    # full blocks by weak checksum; a short last block can only match at the very end of data
+    table = {}
+    short = None
+    short_len = file_size % L
+    for index, (weak, strong) in enumerate(hashes):
+        if short_len and index == len(hashes) - 1:
+            short = (index, weak, strong)
+        else:
+            table.setdefault(weak, []).append(index)
+
+    writer = _DeltaWriter(bytearray(struct.pack(DELTA_HEADER, strong_len, L, n)))
+    writer.delta += strong_hash(data, strong_len)
+
+    literal_start = 0
+    i = 0
+    rolling = False
+    a = b = 0
+    while i + L <= n:
+        if not rolling:
+            weak = weak_checksum(data[i:i + L])
+            a = weak & 0xffff
+            b = weak >> 16
+            rolling = True
+        match = None
+        candidates = table.get((b << 16) | a)
+        if candidates:
+            strong = strong_hash(data[i:i + L], strong_len)
+            for index in candidates:
+                if hashes[index][1] == strong:
+                    match = index
+                    break
+        if match is not None:
+            writer.literal(data[literal_start:i])
+            writer.copy(match)
+            i += L
+            literal_start = i
+            rolling = False
+        else:
+            if i + L < n:
+                out = data[i]
+                a = (a - out + data[i + L]) & 0xffff
+                b = (b - L * out + a) & 0xffff
+            i += 1
+
+    if short is not None and n - short_len >= literal_start:
+        tail = data[n - short_len:]
+        if weak_checksum(tail) == short[1] and strong_hash(tail, strong_len) == short[2]:
+            writer.literal(data[literal_start:n - short_len])
+            writer.copy(short[0])
+            literal_start = n
+
+    writer.literal(data[literal_start:])
+    return bytes(writer.finish()), writer.literal_bytes, writer.copied_blocks
@@ -0,0 +1,211 @@
+"""
+Downloads a queue of satellite files back to back on one tasko loop.
+
+Files are added by path or by a glob on the file name (e.g. /sd/logs/*.txt), sized with QUERY,
+and ordered by priority (higher is better) and then by estimated airtime, so small files are not
+held up behind large ones.  The queue is saved in gs_transfer_state, so files still waiting when a
+pass ends are picked up again by the next run, and partially received files resume where they
+stopped (see gs_commands.request_file).
+"""
+import fnmatch
+import os
+import posixpath
+from gs_commands import (request_file, list_dir, file_size, file_size_query, parse_file_size, CommandPipeline,
+                         UP_TO_DATE)
+from lib.configuration import radio_configuration as rf_config
+from lib.radio_utils import STREAM_HEADER_LEN, STREAM_DATA_LEN
+import gs_commands
+import gs_transfer_state
+import tasko
+
+# bytes on air per packet besides the payload: sync word, length, RadioHead header and checksum
+PACKET_OVERHEAD = 4 + 1 + 4 + 2
+ACK_LEN = 1
+
+# weight of the newest download in the measured throughput
+THROUGHPUT_SMOOTHING = 0.3
+
+
+def estimated_throughput():
+    """Bytes per second downlinked by request_file.
+    Measured from earlier downloads, or estimated from the radio configuration before the first one."""
+    measured = gs_transfer_state.get("stats", "download_bytes_per_second")
+    if measured:
+        return measured
+    on_air_bits = 8 * (2 * (rf_config.PREAMBLE_LENGTH + PACKET_OVERHEAD) + STREAM_HEADER_LEN + STREAM_DATA_LEN + ACK_LEN)
+    seconds_per_packet = on_air_bits / rf_config.BITRATE + rf_config.ACK_DELAY
+    return STREAM_DATA_LEN / seconds_per_packet
+
+
+def record_throughput(bytes_per_second):
+    """Folds one download's throughput into the measured throughput"""
+    measured = gs_transfer_state.get("stats", "download_bytes_per_second")
+    if measured:
+        bytes_per_second = THROUGHPUT_SMOOTHING * bytes_per_second + (1 - THROUGHPUT_SMOOTHING) * measured
+    gs_transfer_state.update("stats", "download_bytes_per_second", bytes_per_second)
+
+
+def _has_magic(pattern):
+    return any(c in pattern for c in "*?[")
+
+
+class DownloadManager:
+    """
+    A persistent queue of satellite files to download into `local_dir`.
+
+    Each file is saved under local_dir at its satellite path, e.g. /sd/logs/a.txt is saved to
+    local_dir/sd/logs/a.txt.
+
+    :param radio: The radio to download with
+    :param local_dir: The local directory files are saved under
+    :param debug: Print the progress of each command
+    """
+
+    def __init__(self, radio, local_dir, debug=False):
+        self.radio = radio
+        self.local_dir = local_dir
+        self.debug = debug
+
+    def local_path(self, remote_path):
+        return os.path.join(self.local_dir, remote_path.lstrip("/"))
+
+    async def add(self, pattern, priority=1):
+        """Queues the file `pattern`, or every file in its directory whose name matches it.
+        Returns the satellite paths queued."""
+        if _has_magic(pattern):
+            directory, name_pattern = posixpath.split(pattern)
+            success, names = await list_dir(self.radio, directory, debug=self.debug)
+            if not success:
+                print(f"Could not list {directory}")
+                return []
+            paths = [posixpath.join(directory, name) for name in sorted(names)
+                     if fnmatch.fnmatchcase(name, name_pattern)]
+        else:
+            paths = [pattern]
+
+        queued = []
+        for path, (success, size) in zip(paths, await self._sizes(paths)):
+            if not success:
+                # e.g. a directory matched by the glob, or a missing file
+                print(f"Could not size {path}, skipping")
+                continue
+            gs_transfer_state.update("queue", self.local_path(path),
+                                     {"remote": path, "priority": priority, "size": size, "attempts": 0})
+            queued.append(path)
+        return queued
+
+    async def _sizes(self, paths):
+        """(success, size) of each of the files at paths on the satellite"""
+        # back to back QUERYs rather than a round trip each, as many at a time as there are correlation ids
+        pipeline = CommandPipeline(self.radio, debug=self.debug)
+        window = CommandPipeline.MAX_PENDING
+        sizes = []
+        correlated = gs_commands._correlated_commands is not False
+        for start in range(0, len(paths), window):
+            batch = paths[start:start + window]
+            if correlated:
+                pending = [await pipeline.send("QUERY", file_size_query(path)) for path in batch]
+                await pipeline.wait()
+                if any(command.success for command in pending):
+                    gs_commands._correlated_commands = True
+                    sizes += [parse_file_size(*command.result()) for command in pending]
+                    continue
+                # nothing answered, e.g. a satellite that predates COMMAND_CORRELATED; ask one at a time
+                correlated = False
+                if self.debug:
+                    print("No responses to correlated commands, sizing files with plain QUERYs")
+            batch_sizes = [await file_size(self.radio, path, debug=self.debug) for path in batch]
+            if gs_commands._correlated_commands is None and any(success for success, _ in batch_sizes):
+                gs_commands._correlated_commands = False  # the link is fine, so the satellite ignores them
+            sizes += batch_sizes
+        return sizes
+
+    def remove(self, remote_path):
+        gs_transfer_state.update("queue", self.local_path(remote_path), None)
+
+    def remaining_bytes(self, local_path, entry):
+        """Bytes of the file still to download, after any part already received"""
+        saved = gs_transfer_state.get("downloads", local_path)
+        offset = saved["offset"] if saved is not None and saved["remote"] == entry["remote"] else 0
+        return max(entry["size"] - offset, 0)
+
+    def pending(self):
+        """The queued files as (local_path, entry, estimated_seconds), in the order they will be downloaded"""
+        throughput = estimated_throughput()
+        files = [(local_path, entry, self.remaining_bytes(local_path, entry) / throughput)
+                 for local_path, entry in gs_transfer_state.load()["queue"].items()
+                 if local_path.startswith(os.path.join(self.local_dir, ""))]
+        files.sort(key=lambda f: (-f[1]["priority"], f[2]))
+        return files
+
+    async def run(self, pass_seconds=None, max_failures=2, progress=None):
+        """Downloads the queued files until the queue is empty or the pass is over.
+
+        :param pass_seconds: How long the pass has left.  Files estimated to fit in the rest of the
+            pass are downloaded first; once none fit, the next file is started anyway, and what
+            arrives is resumed next pass.
+        :param max_failures: Stop after this many downloads fail in a row, as they do once the satellite
+            has gone below the horizon and stopped answering
+        :param progress: Optional function(received_bytes) called as each file arrives
+        :return: A list of {"remote", "local", "bytes", "seconds", "bytes_per_second", "success", "skipped"};
+            files that were skipped because the local copy was already up to date have "skipped" set and 0 "bytes"
+        """
+        start = tasko.monotonic()
+        failures = 0
+        failed = set()  # files that already failed this run are left for the next pass
+        results = []
+        while failures < max_failures:
+            files = [f for f in self.pending() if f[0] not in failed]
+            if not files:
+                break
+            if pass_seconds is not None:
+                left = pass_seconds - (tasko.monotonic() - start)
+                if left <= 0:
+                    break
+                files = [f for f in files if f[2] <= left] or files
+            local_path, entry, estimate = files[0]
+
+            os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+            before = entry["size"] - self.remaining_bytes(local_path, entry)
+            if self.debug:
+                print(f"Downloading {entry['remote']} ({entry['size']} bytes, about {estimate:.0f} s)")
+
+            file_start = tasko.monotonic()
+            success, _, response = await request_file(self.radio, entry["remote"], debug=self.debug,
+                                                      local_path=local_path, progress=progress)
+            seconds = tasko.monotonic() - file_start
+            skipped = success and response == UP_TO_DATE
+
+            if skipped:
+                received = 0  # only the hash was sent, which says nothing about the download rate
+                gs_transfer_state.update("queue", local_path, None)
+                failures = 0
+            elif success:
+                received = entry["size"] - before
+                gs_transfer_state.update("queue", local_path, None)
+                failures = 0
+            else:
+                received = max(entry["size"] - self.remaining_bytes(local_path, entry) - before, 0)
+                entry["attempts"] += 1
+                gs_transfer_state.update("queue", local_path, entry)
+                failed.add(local_path)
+                failures += 1
+
+            bytes_per_second = received / seconds if seconds > 0 else 0.0
+            if received > 0 and seconds > 0:
+                record_throughput(bytes_per_second)
+            results.append({"remote": entry["remote"], "local": local_path, "bytes": received,
+                            "seconds": seconds, "bytes_per_second": bytes_per_second, "success": success,
+                            "skipped": skipped})
+            print_result(results[-1])
+
+        return results
+
+
+def print_result(result):
+    if result["skipped"]:
+        print(f"\n{result['remote']}: already up to date")
+        return
+    status = "done" if result["success"] else "incomplete"
+    print(f"\n{result['remote']}: {result['bytes']} bytes in {result['seconds']:.1f} s "
+          f"({result['bytes_per_second']:.1f} B/s) {status}")
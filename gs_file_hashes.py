@@ -0,0 +1,26 @@
+"""
+Hashes of local files, cached in gs_transfer_state by path.
+
+Each entry remembers the size and modification time the file had when it was hashed, and its
+digest for each algorithm asked for so far, so checking an unchanged file against the satellite's
+copy (see gs_commands.file_hash) does not read it again.
+"""
+import os
+from lib.radio_utils import hashing
+import gs_transfer_state
+
+
+def local_hash(path, algorithm=hashing.SHA256):
+    """The size and hex digest of the local file at path, from the cache while the file is unchanged"""
+    key = os.path.abspath(path)
+    stat = os.stat(path)
+    entry = gs_transfer_state.get("hashes", key)
+    if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+        entry = {"size": stat.st_size, "mtime": stat.st_mtime}
+    if algorithm not in entry:
+        size, entry[algorithm] = hashing.hash_file(path, algorithm)
+        if size != stat.st_size:
+            return size, entry[algorithm]  # changed while it was read; don't cache it
+        gs_transfer_state.update("hashes", key, entry)
+    return entry["size"], entry[algorithm]
+
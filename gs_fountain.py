@@ -0,0 +1,106 @@
+"""
+Decodes fountain coded downlinks (see lib/radio_utils/fountain.py).
+
+Symbols are collected as they arrive and decoded by peeling: a symbol with one unknown block
+left is that block, and each block found is XORed out of every other symbol that contains it.
+Peeling runs in rounds over the whole edge list (symbol, block) at once, so each round is a
+handful of NumPy operations however many symbols are waiting.  It only runs once a new symbol has
+exactly one unknown block left: until then no symbol can be peeled, so decoding after every symbol
+costs nothing while the symbols that arrive can't help.
+"""
+import numpy as np
+from lib.radio_utils.fountain import SYMBOL_LEN, block_count, soliton_cdf, neighbors
+
+
+class FountainDecoder:
+    """
+    The symbols received so far of one fountain coded file.
+
+    :param size: The size of the file in bytes, as carried by every symbol
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.k = block_count(size)
+        self.cdf = soliton_cdf(self.k)
+        self.blocks = np.zeros((self.k, SYMBOL_LEN), dtype=np.uint8)
+        self.known = np.zeros(self.k, dtype=bool)
+        self.solved = 0
+        self.received = 0
+        self.duplicates = 0
+        self._seen = set()
+        # symbols not yet fully peeled, and their edges to unknown blocks
+        self._data = np.zeros((0, SYMBOL_LEN), dtype=np.uint8)
+        self._degree = np.zeros(0, dtype=np.int64)
+        self._edge_symbol = np.zeros(0, dtype=np.int64)
+        self._edge_block = np.zeros(0, dtype=np.int64)
+        self._new = []
+        self._ripple = False  # whether a symbol added since the last decode has one unknown block left
+
+    def add(self, symbol_id, symbol):
+        """Stores a symbol.  Returns False if it was already received."""
+        if symbol_id in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(symbol_id)
+        self.received += 1
+        blocks = neighbors(symbol_id, self.k, self.cdf)
+        if not self._ripple and np.count_nonzero(~self.known[blocks]) == 1:
+            self._ripple = True
+        self._new.append((blocks, bytes(symbol)))
+        return True
+
+    def decode(self):
+        """Peels as many blocks as the symbols received so far allow. Returns True once the file is complete."""
+        if not self._ripple:
+            return self.complete()  # the last decode peeled everything it could, and no new symbol changes that
+        self._ripple = False
+        if self._new:
+            self._merge()
+        data = self._data
+        degree = self._degree
+        edge_symbol = self._edge_symbol
+        edge_block = self._edge_block
+        while True:
+            # XOR known blocks out of the symbols that contain them
+            known = self.known[edge_block]
+            if known.any():
+                np.bitwise_xor.at(data, edge_symbol[known], self.blocks[edge_block[known]])
+                degree -= np.bincount(edge_symbol[known], minlength=len(degree))
+                edge_symbol = edge_symbol[~known]
+                edge_block = edge_block[~known]
+            # a symbol with one unknown block left is that block
+            ripple = degree[edge_symbol] == 1
+            if not ripple.any():
+                break
+            blocks, first = np.unique(edge_block[ripple], return_index=True)
+            self.blocks[blocks] = data[edge_symbol[ripple][first]]
+            self.known[blocks] = True
+            self.solved += len(blocks)
+
+        # drop the symbols that have nothing left to give
+        alive = degree > 0
+        remap = np.cumsum(alive) - 1
+        self._data = data[alive]
+        self._degree = degree[alive]
+        self._edge_symbol = remap[edge_symbol]
+        self._edge_block = edge_block
+        return self.complete()
+
+    def complete(self):
+        return self.solved == self.k
+
+    def join(self):
+        return self.blocks.tobytes()[:self.size]
+
+    def _merge(self):
+        first = len(self._data)
+        rows = np.frombuffer(b''.join(symbol for _, symbol in self._new), dtype=np.uint8).reshape(-1, SYMBOL_LEN)
+        degree = np.array([len(blocks) for blocks, _ in self._new], dtype=np.int64)
+        edge_block = np.fromiter((b for blocks, _ in self._new for b in blocks), dtype=np.int64)
+        edge_symbol = np.repeat(np.arange(first, first + len(self._new), dtype=np.int64), degree)
+        self._data = np.concatenate((self._data, rows))
+        self._degree = np.concatenate((self._degree, degree))
+        self._edge_symbol = np.concatenate((self._edge_symbol, edge_symbol))
+        self._edge_block = np.concatenate((self._edge_block, edge_block))
+        self._new = []
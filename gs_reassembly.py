@@ -0,0 +1,166 @@
+"""
+Reassembles buffered downlinks from their chunks.
+
+Chunks are kept in a list indexed by chunk number and joined once at the end, so assembling a
+message is linear in its size.  Duplicates and gaps are detected exactly by index rather than by
+comparing payloads, so identical consecutive chunks (e.g. zero filled blocks) are kept.
+
+Given a sink (like FileSink), chunks are written out as soon as every chunk before them has
+arrived, so only out of order chunks are held in memory.  Compressed transfers are decompressed
+on the way to the sink by a DecompressingSink.
+"""
+import os
+
+
+class Reassembler:
+    """
+    The chunks of one transfer.
+
+    Stream multiplexed packets carry their chunk index; use add(index, chunk) and mark the last
+    chunk with finish(index).  Legacy buffered packets carry no index; use append(chunk), after
+    dropping resent packets (see gs_commands.handle_memory_buffered).
+
+    :param sink: Optional object with a write(chunk) method that in order chunks are streamed to
+    :param progress: Optional function(received_bytes) called after each new chunk
+    """
+
+    def __init__(self, sink=None, progress=None):
+        self.sink = sink
+        self.progress = progress
+        self._chunks = []  # chunks from index self._flushed onwards, None where not yet received
+        self._flushed = 0
+        self.received = 0
+        self.duplicates = 0
+        self.received_bytes = 0
+        self.end_index = None
+
+    def add(self, index, chunk):
+        """Stores chunk `index`.  Returns False if that chunk was already received."""
+        chunks = self._chunks
+        offset = index - self._flushed
+        if offset < 0:
+            self.duplicates += 1
+            return False
+        if offset >= len(chunks):
+            chunks.extend([None] * (offset + 1 - len(chunks)))
+        elif chunks[offset] is not None:
+            self.duplicates += 1
+            return False
+        chunks[offset] = chunk
+        self.received += 1
+        self.received_bytes += len(chunk)
+        if self.sink is not None:
+            self._flush()
+        if self.progress is not None:
+            self.progress(self.received_bytes)
+        return True
+
+    def append(self, chunk):
+        """Stores the chunk after the last one received"""
+        return self.add(self._flushed + len(self._chunks), chunk)
+
+    def finish(self, end_index=None):
+        """Marks `end_index` (default: the last chunk received so far) as the final chunk"""
+        self.end_index = self._flushed + len(self._chunks) - 1 if end_index is None else end_index
+
+    def complete(self):
+        """True once the final chunk and every chunk before it have been received"""
+        return self.end_index is not None and self.received == self.end_index + 1
+
+    def missing(self):
+        """Indices of the chunks not yet received, up to the final chunk or the highest received chunk"""
+        end = self._flushed + len(self._chunks) if self.end_index is None else self.end_index + 1
+        chunks = self._chunks
+        return [i for i in range(self._flushed, end)
+                if i - self._flushed >= len(chunks) or chunks[i - self._flushed] is None]
+
+    def join(self):
+        """The chunks received and not yet written to the sink, in order, with any gaps left out"""
+        return b''.join(chunk for chunk in self._chunks if chunk is not None)
+
+    def _flush(self):
+        chunks = self._chunks
+        ready = 0
+        while ready < len(chunks) and chunks[ready] is not None:
+            self.sink.write(chunks[ready])
+            ready += 1
+        if ready:
+            del chunks[:ready]
+            self._flushed += ready
+
+
+class FileSink:
+    """
+    Streams a download to `path` through `path`.part.
+
+    Writes are batched into `batch_bytes` and fsynced as each batch is written, so an interrupted
+    download leaves everything received so far in the .part file.  commit() atomically renames the
+    completed file into place.
+
+    :param path: The local path the finished file is written to
+    :param batch_bytes: How much data to collect before writing and syncing it to disk
+    :param resume: Append to an existing .part file instead of starting over
+    """
+
+    def __init__(self, path, batch_bytes=64 * 1024, resume=False):
+        self.path = path
+        self.part_path = path + ".part"
+        self.batch_bytes = batch_bytes
+        self._batch = bytearray()
+        self._file = open(self.part_path, "ab" if resume else "wb")
+        self.bytes_written = self._file.tell()
+
+    def write(self, chunk):
+        self._batch += chunk
+        if len(self._batch) >= self.batch_bytes:
+            self._write_batch()
+
+    def close(self):
+        """Writes out the remaining data and closes the .part file, e.g. to check it before commit()"""
+        if self._file is not None:
+            self._write_batch()
+            self._file.close()
+            self._file = None
+
+    def commit(self):
+        """Writes out the remaining data and renames the .part file to the final path"""
+        self.close()
+        os.replace(self.part_path, self.path)
+
+    def abort(self):
+        """Writes out the remaining data and closes the .part file, leaving it in place (or removing it if empty)"""
+        self.close()
+        if self.bytes_written == 0:
+            os.remove(self.part_path)
+
+    def _write_batch(self):
+        if self._batch:
+            self._file.write(self._batch)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.bytes_written += len(self._batch)
+            self._batch = bytearray()
+
+
+class DecompressingSink:
+    """
+    Decompresses a compressed transfer on its way to another sink.
+
+    :param sink: The sink the decompressed data is written to
+    :param decompressor: e.g. lib.radio_utils.compression.decompressor(codec)
+    """
+
+    def __init__(self, sink, decompressor):
+        self.sink = sink
+        self.decompressor = decompressor
+
+    def write(self, chunk):
+        data = self.decompressor.decompress(chunk)
+        if data:
+            self.sink.write(data)
+
+    def finish(self):
+        """Writes out anything the decompressor is still holding, once the transfer is complete"""
+        data = self.decompressor.flush()
+        if data:
+            self.sink.write(data)
@@ -10,9 +10,12 @@ from lib.configuration import radio_configuration as rf_config
 from shell_utils import bold, normal
 
 
-def initialize_radio(spi, cs, reset):
+def initialize_radio(spi, cs, reset, managed_spi=None):
     """
     Initialize the radio - uses lib/configuration/radio_configuration to configure with defaults
+
+    Pass managed_spi (a tasko.managed_spi.ManagedSpi for the bus, shared by every device on it)
+    to share the SPI bus cooperatively with other tasks.
     """
 
     radio = pycubed_rfm9x_fsk.RFM9x(
@@ -20,7 +23,8 @@ def initialize_radio(spi, cs, reset):
         cs,
         reset,
         rf_config.FREQUENCY,
-        checksum=rf_config.CHECKSUM)
+        checksum=rf_config.CHECKSUM,
+        managed_spi=managed_spi)
 
     # configure to match satellite
     radio.tx_power = rf_config.TX_POWER
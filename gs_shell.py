@@ -8,6 +8,7 @@ from shell_utils import *
 from gs_shell_tasks import *
 from gs_setup import *
 import tasko
+from tasko.loop import OVERRUN_SKIP
 
 try:
     import supervisor
@@ -22,7 +23,11 @@ if supervisor is not None:
 prompt_options = {"Receive loop": ("r", "receive"),
                   "Beacon request loop": ("b", "beacon"),
                   "Upload file": ("u", "upload"),
+                  "Upload changes to file": ("du", "delta"),
                   "Request file": ("rf", "request"),
+                  "Request file without acks (fountain coded)": ("ff", "fountain"),
+                  "Request file without acks (blast and repair)": ("bf", "blast"),
+                  "Download queue": ("dq", "queue"),
                   "Send command": ("c", "command"),
                   "Set time": ("st", "settime"),
                   "Get time": ("gt", "gettime"),
@@ -101,19 +106,64 @@ def gs_shell_main_loop():
                 beacon_frequency_hz = 1.0 / float(beacon_period)
                 logname = input("log file name (empty to not log) = ")
                 def get_beacon_noargs(): return get_beacon(radio, debug=verbose, logname=logname)
-                tasko.schedule(beacon_frequency_hz, get_beacon_noargs, 10)
+                beacon_task = tasko.schedule(beacon_frequency_hz, get_beacon_noargs, 10)
+                # a beacon request that missed its window is stale - wait for the next one instead
+                beacon_task.set_overrun_policy(OVERRUN_SKIP)
                 tasko.run()
 
             elif choice in prompt_options["Upload file"]:
                 source = input('source path = ')
                 dest = input('destination path = ')
-                tasko.add_task(upload_file(radio, source, dest, debug=verbose), 1)
+                compress = get_input_discrete(f"Compress? {bold}(y/N){normal}", ["", "y", "n"]) == "y"
+                tasko.add_task(upload_file(radio, source, dest, debug=verbose, compress=compress), 1)
+                tasko.run()
+                tasko.reset()
+
+            elif choice in prompt_options["Upload changes to file"]:
+                source = input('source path = ')
+                dest = input('destination path = ')
+                tasko.add_task(upload_file_delta(radio, source, dest, debug=verbose), 1)
                 tasko.run()
                 tasko.reset()
 
             elif choice in prompt_options["Request file"]:
                 source = input('source path = ')
-                tasko.add_task(request_file(radio, source, debug=verbose), 1)
+                local_path = input('save to local path (empty to print) = ')
+                compress = get_input_discrete(f"Compress? {bold}(y/N){normal}", ["", "y", "n"]) == "y"
+                if local_path == "":
+                    tasko.add_task(request_file(radio, source, debug=verbose, compress=compress), 1)
+                else:
+                    tasko.add_task(request_file(radio, source, debug=verbose, local_path=local_path,
+                                                progress=print_download_progress, compress=compress), 1)
+                tasko.run()
+                tasko.reset()
+
+            elif choice in prompt_options["Request file without acks (fountain coded)"]:
+                source = input('source path = ')
+                local_path = input('save to local path (empty to print) = ')
+                tasko.add_task(request_file_fountain(radio, source, debug=verbose, local_path=local_path or None,
+                                                     progress=print_download_progress), 1)
+                tasko.run()
+                tasko.reset()
+
+            elif choice in prompt_options["Request file without acks (blast and repair)"]:
+                source = input('source path = ')
+                local_path = input('save to local path (empty to print) = ')
+                tasko.add_task(request_file_blast(radio, source, debug=verbose, local_path=local_path or None,
+                                                  progress=print_download_progress), 1)
+                tasko.run()
+                tasko.reset()
+
+            elif choice in prompt_options["Download queue"]:
+                patterns = input('satellite paths or globs, comma separated (empty to resume the queue) = ')
+                patterns = [p.strip() for p in patterns.split(",") if p.strip()]
+                priority = get_input_range("priority, higher first (enter for 1)", (0, 10)) if patterns else ""
+                priority = int(float(priority)) if priority else 1
+                local_dir = input('save under local directory (empty for downloads) = ') or "downloads"
+                pass_seconds = input('pass time left in seconds (empty for no limit) = ')
+                pass_seconds = float(pass_seconds) if pass_seconds else None
+                tasko.add_task(download_queue_task(radio, patterns, priority, local_dir,
+                                                   pass_seconds=pass_seconds, debug=verbose), 1)
                 tasko.run()
                 tasko.reset()
 
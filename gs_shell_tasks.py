@@ -1,5 +1,7 @@
 from gs_commands import *
+from gs_download_manager import DownloadManager
 from shell_utils import *
+import tasko
 
 
 async def send_command_task(radio, command_bytes, args, will_respond, debug=False):
@@ -27,6 +29,25 @@ async def read_loop(radio, debug=False):
         print_message(header, message)
 
 
+def print_download_progress(received_bytes):
+    print(f"\rReceived {received_bytes} bytes", end="")
+
+
+async def download_queue_task(radio, patterns, priority, local_dir, pass_seconds=None, debug=False):
+    """Queues the files matching patterns, then downloads everything queued under local_dir"""
+    manager = DownloadManager(radio, local_dir, debug=debug)
+    for pattern in patterns:
+        queued = await manager.add(pattern, priority=priority)
+        print(f"Queued {len(queued)} file(s) for {pattern}")
+    for _, entry, seconds in manager.pending():
+        print(f"{entry['remote']:.<40} priority {entry['priority']}, about {seconds:.0f} s")
+    results = await manager.run(pass_seconds=pass_seconds, progress=print_download_progress)
+    remaining = len(manager.pending())
+    downloaded = sum(r['success'] and not r['skipped'] for r in results)
+    skipped = sum(r['skipped'] for r in results)
+    print(f"Downloaded {downloaded} file(s), {skipped} already up to date, {remaining} still queued")
+
+
 def human_time_stamp():
     """Returns a human readable time stamp in the format: 'year.month.day hour:min'
     Gets the local time."""
@@ -34,6 +55,14 @@ def human_time_stamp():
     return f'{t.tm_year:4}.{t.tm_mon:02}.{t.tm_mday:02}.{t.tm_hour:02}:{t.tm_min:02}:{t.tm_sec:02}'
 
 
+def _append_log(logname, line):
+    try:
+        with open(logname, "a") as f:
+            f.write(line)
+    except OSError as e:
+        print(e)
+
+
 def timestamped_log_print(str, printcolor=normal, logname=""):
     """
     Timestamp, print to stdout and log str to a file
@@ -44,19 +73,28 @@ def timestamped_log_print(str, printcolor=normal, logname=""):
           f"{printcolor}{str}{normal}")
 
     if logname is not None and not logname == "":
-        try:
-            with open(logname, "a") as f:
-                f.write(f"[{timestamp}]\t" +
-                        f"{str}" + "\n")
-        except OSError as e:
-            print(e)
+        _append_log(logname, f"[{timestamp}]\t" + f"{str}" + "\n")
+
+
+async def timestamped_log_print_async(str, printcolor=normal, logname=""):
+    """
+    Like timestamped_log_print, but appends to the log file on an executor thread
+    so a slow disk does not hold up the radio tasks
+    """
+    timestamp = human_time_stamp()
+
+    print(f"[{yellow}{timestamp}{normal}]\t" +
+          f"{printcolor}{str}{normal}")
+
+    if logname is not None and not logname == "":
+        await tasko.run_in_executor(_append_log, logname, f"[{timestamp}]\t" + f"{str}" + "\n")
 
 
 async def get_beacon(radio, debug=False, logname=""):
-    timestamped_log_print(f"Requesting beacon...", logname=logname)
+    await timestamped_log_print_async(f"Requesting beacon...", logname=logname)
     success, bs = await request_beacon(radio, debug=debug)
     if success:
-        timestamped_log_print(f"Successful beacon request", printcolor=green, logname=logname)
-        timestamped_log_print(bs, logname=logname)
+        await timestamped_log_print_async(f"Successful beacon request", printcolor=green, logname=logname)
+        await timestamped_log_print_async(bs, logname=logname)
     else:
-        timestamped_log_print(f"Failed beacon request", printcolor=red, logname=logname)
+        await timestamped_log_print_async(f"Failed beacon request", printcolor=red, logname=logname)
@@ -0,0 +1,52 @@
+"""
+Persists the progress of interrupted uploads and downloads, so the next pass can resume them.
+
+The state is a JSON file of the form
+    {"downloads": {local_path: {...}}, "uploads": {satellite_path: {...}},
+     "queue": {local_path: {...}}, "stats": {name: value}, "hashes": {local_path: {...}}}
+written atomically after every change.  "queue" holds the files waiting in the download manager
+(see gs_download_manager), "stats" the measured link throughput used to plan passes, and
+"hashes" the hashes of local files (see gs_file_hashes).
+"""
+import json
+import os
+
+TRANSFER_STATE_PATH = "transfer_state.json"
+KINDS = ("downloads", "uploads", "queue", "stats", "hashes")
+
+
+def load(path=TRANSFER_STATE_PATH):
+    """Returns the saved transfer state, or an empty state if there is none"""
+    try:
+        with open(path) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    for kind in KINDS:
+        state.setdefault(kind, {})
+    return state
+
+
+def save(state, path=TRANSFER_STATE_PATH):
+    """Writes the transfer state through a temporary file, so a crash never leaves it half written"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def update(kind, key, entry, path=TRANSFER_STATE_PATH):
+    """Sets (or with entry None, removes) the state of one transfer. kind is one of KINDS."""
+    state = load(path)
+    if entry is None:
+        state[kind].pop(key, None)
+    else:
+        state[kind][key] = entry
+    save(state, path)
+
+
+def get(kind, key, path=TRANSFER_STATE_PATH):
+    """The saved state of one transfer, or None"""
+    return load(path)[kind].get(key)
@@ -172,6 +172,18 @@ def ticks_diff(ticks1, ticks2):
     return diff
 
 
+class _NoLease:
+    # Stands in for a ManagedSpiDevice lease when the radio owns its bus outright.
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+_NO_LEASE = _NoLease()
+
+
 def twos_comp(val, bits):
     """compute the 2's complement of int value val"""
     if (val & (1 << (bits - 1))) != 0:  # if sign bit is set e.g., 8bit: 128-255
@@ -198,6 +210,9 @@ class RFM9x:
     choose to lower to 1mhz if using long wires or a breadboard.
     - agc: Boolean to Enable/Disable Automatic Gain Control - Default=False (AGC off)
     - checksum: Boolean to Enable/Disable appending a two byte checksum - Default=True (checksum Enabled)
+    - managed_spi: A tasko.managed_spi.ManagedSpi to share the bus with other tasks and devices.
+    The spi argument is then ignored.  Multi-register operations are batched under one bus lease,
+    and radio.bus_metrics() reports lease contention.
     Remember this library makes a best effort at receiving packets with pure
     Python code.  Trying to receive packets too quickly will result in lost data
     so limit yourself to simple scenarios of sending and receiving single
@@ -318,13 +333,21 @@ class RFM9x:
         bitrate=1200,
         frequency_deviation=5000,
         spi_baudrate=5000000,
-        checksum=True
+        checksum=True,
+        managed_spi=None
     ):
         self.high_power = high_power
         # Device support SPI mode 0 (polarity & phase = 0) up to a max of 10mhz.
         # Set Default Baudrate to 5MHz to avoid problems
-        self._device = spidev.SPIDevice(
-            spi, cs, baudrate=spi_baudrate, polarity=0, phase=0)
+        self._managed_spi = managed_spi
+        if managed_spi is None:
+            self._device = spidev.SPIDevice(
+                spi, cs, baudrate=spi_baudrate, polarity=0, phase=0)
+            self._lease = _NO_LEASE
+        else:
+            self._device = managed_spi.device(
+                cs, baudrate=spi_baudrate, polarity=0, phase=0)
+            self._lease = self._device.lease
         # Setup reset as a digital output - initially High
         # This line is pulled low as an output quickly to trigger a reset.
         self._reset = reset
@@ -431,6 +454,19 @@ class RFM9x:
         self.checksum = checksum
         self.checksum_error_count = 0
 
+        # Packets are framed in place here: length + 4 byte RadioHead header, up to 57 data bytes, checksum
+        self._tx_buffer = bytearray(64)
+
+    def bus_metrics(self):
+        """Lease contention metrics for a shared SPI bus, or None if the radio owns its bus"""
+        if self._managed_spi is None:
+            return None
+        return self._managed_spi.metrics()
+
+    async def _leased_tx_done(self):
+        async with self._lease:
+            return self.tx_done()
+
     # pylint: disable=no-member
     # Reconsider pylint: disable when this can be tested
     def _read_into(self, address, buf, length=None):
@@ -751,64 +787,71 @@ class RFM9x:
         # pylint: disable=len-as-condition
         assert 0 < len(data) <= 57  # TODO: Allow longer packets, see pg 76
         # pylint: enable=len-as-condition
-        self.idle()  # Stop receiving to clear FIFO and keep it clear.
-
-        # Combine header and data to form payload
-        payload = bytearray(5)
-        payload[0] = len(payload) + len(data) - 1  # first byte is length to meet semtech FSK requirements (pg 74)
-        if destination is None:  # use attribute
-            payload[1] = self.destination
-        else:  # use kwarg
-            payload[1] = destination
-        if node is None:  # use attribute
-            payload[2] = self.node
-        else:  # use kwarg
-            payload[2] = node
-        if identifier is None:  # use attribute
-            payload[3] = self.identifier
-        else:  # use kwarg
-            payload[3] = identifier
-        if flags is None:  # use attribute
-            payload[4] = self.flags
-        else:  # use kwarg
-            payload[4] = flags
-
-        payload = payload + data
-
-        if self.checksum:
-            payload[0] += 2
-            checksum = bsd_checksum(payload)
-            payload = payload + checksum
 
-        # Write payload.
-        self._write_from(_RH_RF95_REG_00_FIFO, payload)
-
-        # Turn on transmit mode to send out the packet.
-        self.transmit()
+        async with self._lease:
+            # Combine header and data to form payload in the preallocated tx buffer.
+            # This happens under the lease so a concurrent send can't overwrite it before it is written.
+            payload = self._tx_buffer
+            length = 5 + len(data)
+            payload[0] = length - 1  # first byte is length to meet semtech FSK requirements (pg 74)
+            if destination is None:  # use attribute
+                payload[1] = self.destination
+            else:  # use kwarg
+                payload[1] = destination
+            if node is None:  # use attribute
+                payload[2] = self.node
+            else:  # use kwarg
+                payload[2] = node
+            if identifier is None:  # use attribute
+                payload[3] = self.identifier
+            else:  # use kwarg
+                payload[3] = identifier
+            if flags is None:  # use attribute
+                payload[4] = self.flags
+            else:  # use kwarg
+                payload[4] = flags
+
+            payload[5:length] = data
+
+            if self.checksum:
+                payload[0] += 2
+                checksum = _bsd_checksum16(payload, length)
+                payload[length] = checksum >> 8
+                payload[length + 1] = checksum & 0xff
+                length += 2
+
+            self.idle()  # Stop receiving to clear FIFO and keep it clear.
+
+            # Write payload.
+            self._write_from(_RH_RF95_REG_00_FIFO, payload, length)
+
+            # Turn on transmit mode to send out the packet.
+            self.transmit()
         # Wait for tx done interrupt with explicit polling (not ideal but
         # best that can be done right now without interrupts).
         timed_out = False
         if HAS_SUPERVISOR:
             start = supervisor.ticks_ms()
-            while not timed_out and not self.tx_done():
+            while not timed_out and not await self._leased_tx_done():
                 if ticks_diff(supervisor.ticks_ms(), start) >= self.xmit_timeout * 1000:
                     timed_out = True
                 else:
                     await tasko.sleep(0)
         else:
-            start = time.monotonic()
-            while not timed_out and not self.tx_done():
-                if time.monotonic() - start >= self.xmit_timeout:
+            start = tasko.monotonic()
+            while not timed_out and not await self._leased_tx_done():
+                if tasko.monotonic() - start >= self.xmit_timeout:
                     timed_out = True
                 else:
                     await tasko.sleep(0)
 
         # Done transmitting - change modes (interrupt automatically cleared on mode change)
-        if keep_listening:
-            self.listen()
-        else:
-            # Enter idle mode to stop receiving other packets.
-            self.idle()
+        async with self._lease:
+            if keep_listening:
+                self.listen()
+            else:
+                # Enter idle mode to stop receiving other packets.
+                self.idle()
         return not timed_out
 
     async def send_with_ack(self, data, debug=False):
@@ -878,28 +921,33 @@ class RFM9x:
         if HAS_SUPERVISOR:
             start = supervisor.ticks_ms()
         else:
-            start = time.monotonic()
+            start = tasko.monotonic()
 
         packet = None
         # Make sure we are listening for packets.
-        self.listen()
+        async with self._lease:
+            self.listen()
         while True:
             # check for valid packets
-            if self.rx_done():
-                # save last RSSI reading
-                self.last_rssi = self.rssi
-                # Enter idle mode to stop receiving other packets.
-                self.idle()
+            async with self._lease:
+                rx_done = self.rx_done()
+                if rx_done:
+                    # save last RSSI reading
+                    self.last_rssi = self.rssi
+                    # Enter idle mode to stop receiving other packets.
+                    self.idle()
+            if rx_done:
                 # read packet
                 packet = await self._process_packet(with_header=with_header, with_ack=with_ack, debug=debug)
                 if packet is not None:
                     break  # packet valid - return it
                 # packet invalid - continue listening
-                self.listen()
+                async with self._lease:
+                    self.listen()
 
             # check if we have timed out
             if ((HAS_SUPERVISOR and (ticks_diff(supervisor.ticks_ms(), start) >= timeout * 1000)) or
-                    (not HAS_SUPERVISOR and (time.monotonic() - start >= timeout))):
+                    (not HAS_SUPERVISOR and (tasko.monotonic() - start >= timeout))):
                 # timed out
                 if debug:
                     print("RFM9X: RX timed out")
@@ -908,10 +956,11 @@ class RFM9x:
             await tasko.sleep(0)
 
         # Exit
-        if keep_listening:
-            self.listen()
-        else:
-            self.idle()
+        async with self._lease:
+            if keep_listening:
+                self.listen()
+            else:
+                self.idle()
 
         return packet
 
@@ -919,7 +968,8 @@ class RFM9x:
 
         # Read the data from the radio FIFO
         packet = bytearray(_MAX_FIFO_LENGTH)
-        packet_length = self._read_until_flag(_RH_RF95_REG_00_FIFO, packet, self.fifo_empty)
+        async with self._lease:
+            packet_length = self._read_until_flag(_RH_RF95_REG_00_FIFO, packet, self.fifo_empty)
 
         # Reject if the received packet is too small to include the 1 byte length, the
         # 4 byte RadioHead header and at least one byte of data
@@ -995,10 +1045,15 @@ class RFM9x:
 
 def bsd_checksum(bytedata):
     """Very simple, not secure, but fast 2 byte checksum"""
+    checksum = _bsd_checksum16(bytedata, len(bytedata))
+    return bytes([checksum >> 8, checksum & 0xff])
+
+def _bsd_checksum16(buf, length):
+    """bsd_checksum of buf[:length] as an int, without copying buf"""
     checksum = 0
 
-    for b in bytedata:
+    for i in range(length):
         checksum = (checksum >> 1) + ((checksum & 1) << 15)
-        checksum += b
+        checksum += buf[i]
         checksum &= 0xffff
-    return bytes([checksum >> 8, checksum & 0xff])
+    return checksum
@@ -1,2 +1,5 @@
 MAX_PACKET_LEN = 57
 PACKET_DATA_LEN = MAX_PACKET_LEN - 1
+# header byte, stream id, flags, 2 byte big endian chunk index
+STREAM_HEADER_LEN = 5
+STREAM_DATA_LEN = MAX_PACKET_LEN - STREAM_HEADER_LEN
@@ -0,0 +1,127 @@
+from .message import Message, write_stream_header
+from . import headers
+from . import STREAM_HEADER_LEN, STREAM_DATA_LEN
+
+SIZE_LEN = 4
+MAX_CHUNKS = 0xffff  # the chunk count is sent in the 16 bit chunk index of BLAST_END
+
+
+def read_bitmap(base, bitmap):
+    """The chunk indices set in a BLAST_REPAIR bitmap, whose bit i (lsb first) stands for chunk base + i"""
+    indices = []
+    for byte_index, byte in enumerate(bitmap):
+        if byte:
+            for bit in range(8):
+                if byte & (1 << bit):
+                    indices.append(base + byte_index * 8 + bit)
+    return indices
+
+
+def write_bitmap(indices, max_bytes):
+    """The base and bitmap for as many of the sorted chunk indices as fit in max_bytes (see read_bitmap)"""
+    if not indices:
+        return 0, bytearray()
+    base = indices[0]
+    bitmap = bytearray()
+    for index in indices:
+        offset = index - base
+        if offset >= max_bytes * 8:
+            break
+        while len(bitmap) <= offset // 8:
+            bitmap.append(0)
+        bitmap[offset // 8] |= 1 << (offset % 8)
+    return base, bitmap
+
+
+class BlastMessage(Message):
+    """Transmits a file in STREAM_DATA_LEN chunks back to back, without acks, then a BLAST_END with the chunk count.
+
+    The ground station answers BLAST_END with a BLAST_REPAIR bitmap of the chunks it is missing; repair(indices)
+    then resends just those, followed by another BLAST_END, until nothing is missing.
+
+    :param path: The path to the file to send
+    :type path: str
+    :param stream_id: The stream id (0-255) to send the chunks on
+    :type stream_id: int
+    :param priority: The priority of the message (higher is better)
+    :type priority: int
+    """
+
+    __slots__ = ('path', 'stream_id', 'size', 'chunk_count', 'pending', 'cursor', 'end_sent', 'rounds', 'file_err',
+                 '_file', '_end_pending')
+
+    def __init__(self, path, stream_id, priority=1):
+        super().__init__(priority, b'')
+        self.path = path
+        self.stream_id = stream_id
+        with open(path, 'rb') as f:
+            f.seek(0, 2)
+            self.size = f.tell()
+        self.chunk_count = (self.size + STREAM_DATA_LEN - 1) // STREAM_DATA_LEN
+        if self.chunk_count > MAX_CHUNKS:
+            raise ValueError("File too large for a blast's 16 bit chunk count")
+        self.pending = range(self.chunk_count)
+        self.cursor = 0
+        self.end_sent = False
+        self.rounds = 1
+        self.file_err = False
+        self._file = None
+        self._end_pending = False
+
+    def repair(self, indices):
+        """Starts a repair round, resending the chunks at indices"""
+        self.pending = [i for i in indices if i < self.chunk_count]
+        self.cursor = 0
+        self.end_sent = False
+        self._end_pending = False
+        self.rounds += 1
+
+    def packet(self):
+        pkt = bytearray(STREAM_HEADER_LEN + STREAM_DATA_LEN)
+        length, with_ack = self.packet_into(pkt)
+        del pkt[length:]
+        return pkt, with_ack
+
+    def packet_into(self, buf):
+        """Writes the next chunk of the round, or the round's BLAST_END, into buf.
+        Chunks are never acked, so each call moves on to the next one. BLAST_END is sent with ack."""
+        if self.cursor >= len(self.pending):
+            self.close()
+            self._end_pending = True
+            write_stream_header(buf, headers.BLAST_END, self.stream_id, self.chunk_count)
+            buf[STREAM_HEADER_LEN:STREAM_HEADER_LEN + SIZE_LEN] = self.size.to_bytes(SIZE_LEN, 'big')
+            return STREAM_HEADER_LEN + SIZE_LEN, True
+
+        index = self.pending[self.cursor]
+        try:
+            if self._file is None:
+                self._file = open(self.path, 'rb')
+            self._file.seek(index * STREAM_DATA_LEN)
+            n = self._file.readinto(memoryview(buf)[STREAM_HEADER_LEN:STREAM_HEADER_LEN + STREAM_DATA_LEN])
+        except Exception as e:
+            print(f'Error reading file {self.path}: {e}')
+            self.file_err = True
+            self.close()
+            error = b"Error reading file"
+            buf[0] = headers.DEFAULT
+            buf[1:len(error) + 1] = error
+            return len(error) + 1, True
+        write_stream_header(buf, headers.BLAST_CHUNK, self.stream_id, index)
+        self.cursor += 1
+        return STREAM_HEADER_LEN + n, False
+
+    def ack(self):
+        # only BLAST_END is acked
+        if self._end_pending:
+            self.end_sent = True
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def done(self):
+        return self.end_sent or self.file_err
+
+    def __repr__(self) -> str:
+        return f'<Blast: {self.path}>'
@@ -9,15 +9,22 @@ from pycubed import cubesat
 import radio_utils
 from radio_utils import transmission_queue as tq
 from radio_utils import headers
+from radio_utils import delta
+from radio_utils import compression
+from radio_utils import hashing
 from radio_utils.disk_buffered_message import DiskBufferedMessage
 from radio_utils.memory_buffered_message import MemoryBufferedMessage
 from radio_utils.message import Message
+from radio_utils.fountain import FountainMessage
+from radio_utils.blast_message import BlastMessage, read_bitmap
+from radio_utils.upload_session import UploadReceiver
 import json
 import supervisor
 from logs import beacon_packet
 import msgpack
 from io import BytesIO
 import struct
+import tasko
 
 NO_OP = b'\x00\x00'
 HARD_RESET = b'\x00\x01'
@@ -36,9 +43,32 @@ SET_RTC_UTIME = b'\x00\x14'
 GET_RTC_UTIME = b'\x00\x15'
 SET_RTC = b'\x00\x16'
 CLEAR_TX_QUEUE = b'\x00\x17'
+REQUEST_FILE_FROM = b'\x00\x18'
+APPEND_FILE = b'\x00\x19'
+FILE_BLOCK_HASHES = b'\x00\x20'
+APPLY_DELTA = b'\x00\x21'
+REQUEST_FILE_COMPRESSED = b'\x00\x22'
+DECOMPRESS_FILE = b'\x00\x23'
+REQUEST_FILE_FOUNTAIN = b'\x00\x24'
+FOUNTAIN_DONE = b'\x00\x25'
+REQUEST_FILE_BLAST = b'\x00\x26'
+BLAST_REPAIR = b'\x00\x27'
+FILE_HASH = b'\x00\x28'
+FOUNTAIN_MORE = b'\x00\x29'
 
 COMMAND_ERROR_PRIORITY = 9
 BEACON_PRIORITY = 10
+BEACON_TTL = 60  # seconds; a stale beacon is not worth the airtime
+DOWNLINK_COMPRESS_MIN = 64  # bytes; shorter responses are not worth compressing
+CORRELATION_ID_MIN = 0x80  # correlation ids are 0x80-0xff, and the satellite's own stream ids 0x00-0x7f
+HASH_YIELD_BYTES = 4096  # bytes of a file hashed between yields to the other tasks
+
+_stream_id = 0
+_correlation_id = None  # of the command running, if it is a COMMAND_CORRELATED
+_fountains = {}  # stream id -> (FountainMessage sending on it, its transmission queue id)
+_blasts = {}  # stream id -> BlastMessage waiting for the ground station's BLAST_REPAIR
+_uploads = UploadReceiver()
+_downlink_codecs = []  # the codecs the ground station has said it decompresses, in its order of preference
 
 def noop(self):
     """No operation"""
@@ -75,10 +105,141 @@ def request_file(task, file):
     :type file: str"""
     file = str(file, 'utf-8')
     if file_exists(file):
-        tq.push(DiskBufferedMessage(file))
+        tq.push(DiskBufferedMessage(file, stream_id=_next_stream_id()))
     else:
         task.debug(f'File not found: {file}')
-        tq.push(Message(9, b'File not found', with_ack=True))
+        tq.push(_response(9, b'File not found', with_ack=True))
+
+def request_file_from(task, args):
+    """Request a file to be downlinked starting at a byte offset, to resume an interrupted download
+
+    :param task: The task that called this function
+    :param args: json string [path, offset]
+    :type args: str"""
+    try:
+        path, offset = json.loads(args)
+        if offset >= os.stat(path)[6]:
+            tq.push(_response(9, b'Offset past end of file', with_ack=True))
+        else:
+            tq.push(DiskBufferedMessage(path, offset=offset, stream_id=_next_stream_id()))
+    except Exception as e:
+        task.debug(f'Error requesting file: {e}')
+        tq.push(_response(9, b'File not found', with_ack=True))
+
+def request_file_compressed(task, args):
+    """Request a file to be compressed and downlinked.
+    The file is compressed with the first of the requested codecs this board supports (see radio_utils/compression.py),
+    and sent uncompressed if that does not make it smaller. The codec is signalled in the stream flags.
+    The codecs are kept for the rest of the session, so that longer responses are compressed too (see _downlink).
+
+    :param task: The task that called this function
+    :param args: json string [path, codecs]
+    :type args: str"""
+    global _downlink_codecs
+    try:
+        path, codecs = json.loads(args)
+        _downlink_codecs = codecs
+        codec = compression.choose_codec(codecs)
+        if codec != compression.CODEC_NONE:
+            fname = _downlink_path('z')
+            size = compression.compress_file(codec, path, fname)
+            if size < os.stat(path)[6]:
+                task.debug(f'Compressed {path} to {size} bytes with {compression.CODEC_NAMES[codec]}')
+                tq.push(DiskBufferedMessage(fname, stream_id=_next_stream_id(), flags=codec))
+                return
+            os.remove(fname)
+        tq.push(DiskBufferedMessage(path, stream_id=_next_stream_id()))
+    except Exception as e:
+        task.debug(f'Error requesting file: {e}')
+        tq.push(_response(9, b'File not found', with_ack=True))
+
+def request_file_fountain(task, file):
+    """Request a file to be downlinked as fountain coded symbols, without acks (see radio_utils/fountain.py).
+    Symbols are sent until the ground station sends FOUNTAIN_DONE, or enough have been sent for any loss rate worth
+    trying; the ground station asks for more with FOUNTAIN_MORE if those were not enough.
+
+    :param task: The task that called this function
+    :param file: The path to the file to downlink
+    :type file: str"""
+    file = str(file, 'utf-8')
+    try:
+        stream_id = _next_stream_id()
+        msg = FountainMessage(file, stream_id)
+        _fountains[stream_id] = (msg, tq.push(msg))
+    except Exception as e:
+        task.debug(f'Error requesting file: {e}')
+        tq.push(_response(9, b'File not found', with_ack=True))
+
+def fountain_done(task, stream_id):
+    """Stop sending the fountain coded file on a stream, once the ground station has decoded it
+
+    :param task: The task that called this function
+    :param stream_id: The stream id, as a decimal string
+    :type stream_id: str"""
+    fountain = _fountains.pop(int(stream_id), None)
+    if fountain is not None:
+        msg, msg_id = fountain
+        msg.stop()  # in case it is already being sent
+        tq.remove(msg_id)
+    task.debug(f'Fountain stream {int(stream_id)} done')
+
+def fountain_more(task, args):
+    """Send more symbols of a fountain coded file, when those sent so far were not enough to decode it
+
+    :param task: The task that called this function
+    :param args: json string [stream_id, symbols]
+    :type args: str"""
+    stream_id, symbols = json.loads(args)
+    fountain = _fountains.get(stream_id)
+    if fountain is None:
+        task.debug(f'No fountain stream {stream_id}')
+        return
+    msg, msg_id = fountain
+    tq.remove(msg_id)  # in case it is still queued after its last symbol
+    msg.more(symbols)
+    _fountains[stream_id] = (msg, tq.push(msg))
+    task.debug(f'Fountain stream {stream_id}: {symbols} more symbols')
+
+def request_file_blast(task, file):
+    """Request a file to be downlinked in blast mode: every chunk back to back without acks, then repair rounds
+    for the chunks the ground station reports missing with BLAST_REPAIR (see radio_utils/blast_message.py).
+
+    :param task: The task that called this function
+    :param file: The path to the file to downlink
+    :type file: str"""
+    file = str(file, 'utf-8')
+    try:
+        stream_id = _next_stream_id()
+        msg = BlastMessage(file, stream_id)
+        _blasts[stream_id] = msg
+        tq.push(msg)
+    except Exception as e:
+        task.debug(f'Error requesting file: {e}')
+        tq.push(_response(9, b'File not found', with_ack=True))
+
+def blast_repair(task, args):
+    """Resend the chunks of a blast the ground station is missing, or finish the blast if none are.
+
+    :param task: The task that called this function
+    :param args: stream id (1 byte), base chunk index (2 bytes, big endian), then a bitmap of the missing chunks
+        from base (bit i, lsb first, is chunk base + i). An empty bitmap means the ground station has every chunk.
+    :type args: bytes"""
+    stream_id = args[0]
+    msg = _blasts.get(stream_id)
+    if msg is None:
+        task.debug(f'No blast on stream {stream_id}')
+        return
+    indices = read_bitmap((args[1] << 8) | args[2], args[3:])
+    if not indices:
+        del _blasts[stream_id]
+        task.debug(f'Blast on stream {stream_id} done after {msg.rounds} rounds')
+        return
+    # a blast whose BLAST_END ack was lost is still queued; it picks up the repair round where it is
+    queued = not msg.done()
+    msg.repair(indices)
+    if not queued:
+        tq.push(msg)
+    task.debug(f'Blast on stream {stream_id}: resending {len(indices)} chunks')
 
 def list_dir(task, path):
     """List the contents of a directory, and downlink the result
@@ -110,7 +271,7 @@ def move_file(task, args):
         args = json.loads(args)
         os.rename(args[0], args[1])
         task.debug('Sucess moving file')
-        tq.push(Message(9, b'Success moving file'))
+        tq.push(_response(9, b'Success moving file'))
     except Exception as e:
         task.debug(f'Error moving file: {e}')
         _downlink(f'Error moving file: {e}')
@@ -128,11 +289,132 @@ def copy_file(task, args):
         with open(args[0], 'rb') as source, open(args[1], 'wb') as dest:
             _cp(source, dest)
         task.debug('Sucess copying file')
-        tq.push(Message(9, b'Success copying file'))
+        tq.push(_response(9, b'Success copying file'))
     except Exception as e:
         task.debug(f'Error moving file: {e}')
         _downlink(f'Error moving file: {e}')
 
+def append_file(task, args):
+    """
+    Append the file at source to dest, if dest is offset bytes long, and delete source.
+    Used to upload a file in segments that can resume across passes.
+    Responds with dest's size, so the ground station can pick up where dest ends.
+
+    :param task: The task that called this function
+    :param args: json string [source, dest, offset]
+    :type args: str
+    """
+    try:
+        source, dest, offset = json.loads(args)
+        size = os.stat(dest)[6] if file_exists(dest) else 0
+        if size != offset:
+            task.debug(f'Not appending at {offset}, {dest} is {size} bytes')
+            tq.push(_response(9, bytes(f'Error appending file: size {size}', 'ascii')))
+            return
+        with open(source, 'rb') as s, open(dest, 'ab') as d:
+            _cp(s, d)
+        os.remove(source)
+        size = os.stat(dest)[6]
+        task.debug(f'Success appending file, {dest} is {size} bytes')
+        tq.push(_response(9, bytes(f'Success appending file: size {size}', 'ascii')))
+    except Exception as e:
+        task.debug(f'Error appending file: {e}')
+        _downlink(f'Error appending file: {e}')
+
+def file_block_hashes(task, args):
+    """
+    Downlink the weak and strong hash of each block of a file, so the ground station
+    can upload changes to it as a delta (see radio_utils/delta.py)
+
+    :param task: The task that called this function
+    :param args: json string [path, block_size]
+    :type args: str
+    """
+    try:
+        path, block_size = json.loads(args)
+        out = BytesIO()
+        delta.block_hashes(path, block_size, out)
+        _downlink(out.getvalue())
+    except Exception as e:
+        task.debug(f'Error hashing file: {e}')
+        _downlink(f'Error hashing file: {e}')
+
+def apply_delta(task, args):
+    """
+    Rebuild dest from the uploaded delta file and the basis file, and delete the delta.
+    basis and dest may be the same file; dest is only replaced once the delta has been checked.
+
+    :param task: The task that called this function
+    :param args: json string [basis, delta, dest]
+    :type args: str
+    """
+    tmp = None
+    try:
+        basis, delta_path, dest = json.loads(args)
+        tmp = dest + '.new'
+        delta.apply_delta(basis, delta_path, tmp)
+        if file_exists(dest):
+            os.remove(dest)
+        os.rename(tmp, dest)
+        os.remove(delta_path)
+        task.debug(f'Success applying delta to {dest}')
+        tq.push(_response(9, b'Success applying delta'))
+    except Exception as e:
+        task.debug(f'Error applying delta: {e}')
+        if tmp is not None and file_exists(tmp):
+            os.remove(tmp)
+        _downlink(f'Error applying delta: {e}')
+
+async def file_hash(task, args):
+    """
+    Downlink the size and hash of a file, so the ground station can check a transfer or skip one it doesn't need.
+    The file is hashed HASH_YIELD_BYTES at a time, yielding to the other tasks in between, so hashing a big file
+    doesn't hold up the radio.
+
+    :param task: The task that called this function
+    :param args: json string [path, algorithm]; algorithm is "sha256" or "crc32", and falls back to crc32 on boards
+        without hashlib. The response names the algorithm used.
+    :type args: str
+    """
+    try:
+        path, algorithm = json.loads(args)
+        h = hashing.Hasher(hashing.best_available(algorithm))
+        buf = bytearray(hashing.READ_SIZE)
+        size = 0
+        with open(path, 'rb') as f:
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                h.update(memoryview(buf)[:n])
+                size += n
+                if size % HASH_YIELD_BYTES < n:
+                    await tasko.sleep(0)
+        digest = h.hexdigest()
+        task.debug(f'{h.algorithm} of {path} ({size} bytes): {digest}')
+        _downlink(f'Success hashing file: {h.algorithm} {size} {digest}')  # a sha256 is too long for one packet
+    except Exception as e:
+        task.debug(f'Error hashing file: {e}')
+        _downlink(f'Error hashing file: {e}')
+
+def decompress_file(task, args):
+    """
+    Decompress the uploaded file at source into dest, and delete source.
+
+    :param task: The task that called this function
+    :param args: json string [source, dest, codec]
+    :type args: str
+    """
+    try:
+        source, dest, codec = json.loads(args)
+        size = compression.decompress_file(codec, source, dest)
+        os.remove(source)
+        task.debug(f'Success decompressing file, {dest} is {size} bytes')
+        tq.push(_response(9, bytes(f'Success decompressing file: size {size}', 'ascii')))
+    except Exception as e:
+        task.debug(f'Error decompressing file: {e}')
+        _downlink(f'Error decompressing file: {e}')
+
 def delete_file(task, file):
     """Delete file
 
@@ -142,7 +424,7 @@ def delete_file(task, file):
     """
     try:
         os.remove(file)
-        tq.push(Message(9, b'Success deleting file'))
+        tq.push(_response(9, b'Success deleting file'))
     except Exception as e:
         task.debug(f'Error deleting file: {e}')
         _downlink(f'Error deleting file: {e}')
@@ -163,7 +445,7 @@ def request_beacon(task):
 
     :param task: The task that called this function
     """
-    _downlink_msg(beacon_packet(), header=headers.BEACON, priority=BEACON_PRIORITY, with_ack=False)
+    _downlink_msg(beacon_packet(), header=headers.BEACON, priority=BEACON_PRIORITY, with_ack=False, ttl=BEACON_TTL)
 
 def get_rtc(task):
     """Get the RTC time"""
@@ -195,30 +477,128 @@ def clear_tx_queue(task):
     tq.clear()
     task.debug('Cleared transmission queue')
 
+def upload_packet(task, packet):
+    """Write an UPLOAD_START, UPLOAD_DATA or UPLOAD_END packet to its upload session (see radio_utils/upload_session.py),
+    and downlink the session's result once it ends. The radio task calls this for every packet with an upload header.
+
+    :param task: The task that called this function
+    :param packet: The packet, header byte first
+    :type packet: bytes"""
+    response = _uploads.receive(packet)
+    if response is not None:
+        task.debug(response)
+        _downlink(response)
+
+
+def parse_command(packet):
+    """Split a COMMAND or COMMAND_CORRELATED packet (header byte first) into (correlation id, command, args).
+    The correlation id is None for a COMMAND. Returns None if the packet does not carry super_secret_code.
+
+    :param packet: The packet, header byte first
+    :type packet: bytes"""
+    start = 1 + len(super_secret_code)
+    if bytes(packet[1:start]) != super_secret_code:
+        return None
+    correlation_id = None
+    if packet[0] == headers.COMMAND_CORRELATED:
+        correlation_id = packet[start]
+        start += 1
+    return correlation_id, bytes(packet[start:start + 2]), packet[start + 2:]
+
+async def run_command(task, packet):
+    """Run the command in a COMMAND or COMMAND_CORRELATED packet.
+    While a correlated command runs its responses echo its correlation id (see headers.py), so the ground station can
+    send several commands back to back and match up the responses. The radio task awaits each command before running
+    the next, so only one correlation id is current at a time.
+
+    :param task: The task that called this function
+    :param packet: The packet, header byte first
+    :type packet: bytes"""
+    global _correlation_id
+    parsed = parse_command(packet)
+    if parsed is None:
+        task.debug('Wrong command code')
+        return
+    correlation_id, cmd, args = parsed
+    _correlation_id = correlation_id
+    try:
+        if cmd not in commands:
+            task.debug(f'Unknown command {cmd}')
+            if correlation_id is not None:
+                _downlink(f'Unknown command {cmd}')  # so the ground station does not wait for it
+            return
+        command = commands[cmd]
+        if command["has_args"]:
+            result = command["function"](task, args)
+        else:
+            result = command["function"](task)
+        if result is not None and hasattr(result, 'send'):  # an async command
+            await result
+    except Exception as e:
+        task.debug(f'Error running command: {e}')
+        if commands[cmd]["will_respond"]:
+            _downlink(f'Error running command: {e}')
+    finally:
+        _correlation_id = None
+
 
 """
 HELPER FUNCTIONS
 """
 
-def _downlink_msg(data, priority=1, header=0x00, with_ack=True):
-    assert (len(data) <= radio_utils.MAX_PACKET_LEN)
-    tq.push(Message(priority, data, header=header, with_ack=with_ack))
+def _next_stream_id():
+    """Stream ids for buffered downlinks, so concurrent transfers can be told apart on the ground.
+    A correlated command's response is streamed on its correlation id."""
+    global _stream_id
+    if _correlation_id is not None:
+        return _correlation_id
+    _stream_id = (_stream_id + 1) % CORRELATION_ID_MIN
+    return _stream_id
+
+def _response(priority, data, with_ack=False, header=headers.DEFAULT):
+    """A response Message, which echoes the correlation id if the command running is correlated"""
+    if _correlation_id is None:
+        return Message(priority, data, with_ack=with_ack, header=header)
+    return Message(priority, bytes([_correlation_id, header]) + data, with_ack=with_ack, header=headers.RESPONSE)
+
+def _downlink_msg(data, priority=1, header=0x00, with_ack=True, ttl=None):
+    msg = _response(priority, data, with_ack=with_ack, header=header)
+    assert (len(msg.str) + 1 <= radio_utils.MAX_PACKET_LEN)
+    tq.push(msg, ttl=ttl)
 
 def _downlink(data):
-    """Write data to a file, and then create a new DiskBufferedMessage to downlink it"""
+    """Write data (str, or bytes for binary data) to a file, and then create a new DiskBufferedMessage to downlink it.
+    Responses of at least DOWNLINK_COMPRESS_MIN bytes are compressed when that makes them smaller, with a codec the
+    ground station has sent (see request_file_compressed). Until it has sent any, responses are left uncompressed, as
+    it may not be able to decompress them."""
+    if isinstance(data, str):
+        data = bytes(data, 'utf-8')
+    codec = compression.CODEC_NONE
+    if len(data) >= DOWNLINK_COMPRESS_MIN:
+        codec = compression.choose_codec(_downlink_codecs)
+    if codec != compression.CODEC_NONE:
+        compressed = compression.compress(codec, data)
+        if len(compressed) < len(data):
+            data = compressed
+        else:
+            codec = compression.CODEC_NONE
     if not (cubesat.sdcard and cubesat.vfs):
         if len(data) < 1024:  # 1kb limit for downlink
-            tq.push(MemoryBufferedMessage(data))
+            tq.push(MemoryBufferedMessage(data, stream_id=_next_stream_id(), flags=codec))
         else:
-            tq.push(Message(COMMAND_ERROR_PRIORITY, b'Downlink too large (sd missing)'))
+            tq.push(_response(COMMAND_ERROR_PRIORITY, b'Downlink too large (sd missing)'))
         return
-    fname = f'/sd/downlink/{time.monotonic_ns()}.txt'
-    if not file_exists('/sd/downlink'):
-        os.mkdir('/sd/downlink')
-    f = open(fname, 'w')
+    fname = _downlink_path('txt')
+    f = open(fname, 'wb')
     f.write(data)
     f.close()
-    tq.push(DiskBufferedMessage(fname))
+    tq.push(DiskBufferedMessage(fname, stream_id=_next_stream_id(), flags=codec))
+
+def _downlink_path(extension):
+    """A new file name in /sd/downlink"""
+    if not file_exists('/sd/downlink'):
+        os.mkdir('/sd/downlink')
+    return f'/sd/downlink/{time.monotonic_ns()}.{extension}'
 
 def _cp(source, dest, buffer_size=1024):
     """
@@ -268,6 +648,23 @@ commands = {
     SET_RTC: {"function": set_rtc, "name": "SET_RTC", "will_respond": False, "has_args": True},
     SET_RTC_UTIME: {"function": set_rtc_utime, "name": "SET_RTC_UTIME", "will_respond": False, "has_args": True},
     CLEAR_TX_QUEUE: {"function": clear_tx_queue, "name": "CLEAR_TX_QUEUE", "will_respond": False, "has_args": False},
+    REQUEST_FILE_FROM: {"function": request_file_from, "name": "REQUEST_FILE_FROM", "will_respond": True,
+                        "has_args": True},
+    APPEND_FILE: {"function": append_file, "name": "APPEND_FILE", "will_respond": True, "has_args": True},
+    FILE_BLOCK_HASHES: {"function": file_block_hashes, "name": "FILE_BLOCK_HASHES", "will_respond": True,
+                        "has_args": True},
+    APPLY_DELTA: {"function": apply_delta, "name": "APPLY_DELTA", "will_respond": True, "has_args": True},
+    REQUEST_FILE_COMPRESSED: {"function": request_file_compressed, "name": "REQUEST_FILE_COMPRESSED",
+                              "will_respond": True, "has_args": True},
+    DECOMPRESS_FILE: {"function": decompress_file, "name": "DECOMPRESS_FILE", "will_respond": True, "has_args": True},
+    REQUEST_FILE_FOUNTAIN: {"function": request_file_fountain, "name": "REQUEST_FILE_FOUNTAIN", "will_respond": True,
+                            "has_args": True},
+    FOUNTAIN_DONE: {"function": fountain_done, "name": "FOUNTAIN_DONE", "will_respond": False, "has_args": True},
+    FOUNTAIN_MORE: {"function": fountain_more, "name": "FOUNTAIN_MORE", "will_respond": False, "has_args": True},
+    REQUEST_FILE_BLAST: {"function": request_file_blast, "name": "REQUEST_FILE_BLAST", "will_respond": True,
+                         "has_args": True},
+    BLAST_REPAIR: {"function": blast_repair, "name": "BLAST_REPAIR", "will_respond": True, "has_args": True},
+    FILE_HASH: {"function": file_hash, "name": "FILE_HASH", "will_respond": True, "has_args": True},
 }
 
 super_secret_code = b'p\xba\xb8C'
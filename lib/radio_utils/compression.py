@@ -0,0 +1,268 @@
+"""
+Streaming compression for buffered transfers.
+
+Two codecs are supported:
+    CODEC_LZSS: a byte aligned LZSS (the heatshrink / Okumura family) with a 4 KiB window, in
+        plain python so it runs on every board.  Matches are found with bytearray.rfind, so
+        the search itself runs in C.
+    CODEC_ZLIB: deflate, where the zlib module can compress (CPython; most CircuitPython
+        builds can only decompress).
+
+Both compress chunk by chunk: compress(chunk) returns whatever compressed output is complete so
+far and flush() the rest, so a file never has to be held in memory.  A stream multiplexed
+transfer signals its codec in the low bits of the stream flags byte (see headers.py).
+"""
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+CODEC_NONE = 0
+CODEC_LZSS = 1
+CODEC_ZLIB = 2
+CODEC_MASK = 0x03
+
+CODEC_NAMES = {CODEC_NONE: "none", CODEC_LZSS: "lzss", CODEC_ZLIB: "zlib"}
+
+# LZSS: groups of up to 8 items, each group preceded by a byte of flags, one bit per item
+# (1: a literal byte, 0: a 2 byte match of 12 bits (distance - 1) and 4 bits (length - MIN_MATCH))
+WINDOW = 4096
+MIN_MATCH = 3
+MAX_MATCH = MIN_MATCH + 15
+
+READ_SIZE = 512
+
+
+class LZSSCompressor:
+    """Compresses a stream with LZSS, chunk by chunk"""
+
+    def __init__(self):
+        self._buf = bytearray()  # up to WINDOW bytes of history, then the bytes not yet encoded
+        self._pos = 0
+        self._group = bytearray()
+        self._flags = 0
+        self._items = 0
+        self._out = bytearray()
+
+    def compress(self, data):
+        self._buf += data
+        self._encode(False)
+        return self._take()
+
+    def flush(self):
+        self._encode(True)
+        if self._items:
+            self._end_group()
+        return self._take()
+
+    def _encode(self, final):
+        buf = self._buf
+        pos = self._pos
+        end = len(buf)
+        # hold back the last MAX_MATCH bytes until more data arrives, so matches are not cut short
+        limit = end if final else end - MAX_MATCH
+        while pos < limit:
+            length, distance = self._match(buf, pos, end)
+            if length:
+                self._item(False, ((distance - 1) << 4) | (length - MIN_MATCH))
+                pos += length
+            else:
+                self._item(True, buf[pos])
+                pos += 1
+        if pos > WINDOW:
+            del buf[:pos - WINDOW]
+            pos = WINDOW
+        self._pos = pos
+
+    def _match(self, buf, pos, end):
+        """The longest match for the bytes at pos that starts in the window, as (length, distance)"""
+        max_len = min(MAX_MATCH, end - pos)
+        if max_len < MIN_MATCH:
+            return 0, 0
+        start = max(0, pos - WINDOW)
+        length = MIN_MATCH
+        found = buf.rfind(buf[pos:pos + length], start, pos + length - 1)
+        if found < 0:
+            return 0, 0
+        while length < max_len:
+            if buf[found + length] == buf[pos + length]:
+                length += 1
+                continue
+            # the nearest match can't be extended; look further back for a longer one
+            longer = buf.rfind(buf[pos:pos + length + 1], start, pos + length)
+            if longer < 0:
+                break
+            found = longer
+            length += 1
+        return length, pos - found
+
+    def _item(self, literal, value):
+        if literal:
+            self._flags |= 1 << self._items
+            self._group.append(value)
+        else:
+            self._group.append(value >> 8)
+            self._group.append(value & 0xff)
+        self._items += 1
+        if self._items == 8:
+            self._end_group()
+
+    def _end_group(self):
+        self._out.append(self._flags)
+        self._out += self._group
+        self._group = bytearray()
+        self._flags = 0
+        self._items = 0
+
+    def _take(self):
+        out = bytes(self._out)
+        self._out = bytearray()
+        return out
+
+
+class LZSSDecompressor:
+    """Decompresses an LZSS stream, chunk by chunk"""
+
+    def __init__(self):
+        self._in = bytearray()
+        self._history = bytearray()
+        self._flags = 0
+        self._items = 8  # items left in the current group; 8 means a flags byte is next
+
+    def decompress(self, data):
+        self._in += data
+        src = self._in
+        out = self._history
+        history_len = len(out)
+        i = 0
+        n = len(src)
+        while i < n:
+            if self._items == 8:
+                self._flags = src[i]
+                self._items = 0
+                i += 1
+                continue
+            if self._flags & (1 << self._items):
+                out.append(src[i])
+                i += 1
+            else:
+                if i + 1 >= n:
+                    break  # the second byte of the match has not arrived yet
+                value = (src[i] << 8) | src[i + 1]
+                distance = (value >> 4) + 1
+                length = (value & 0x0f) + MIN_MATCH
+                start = len(out) - distance
+                if start < 0:
+                    raise ValueError("LZSS match before the start of the stream")
+                if distance >= length:
+                    out += out[start:start + length]
+                else:
+                    for k in range(length):  # overlapping match, e.g. a run of one byte
+                        out.append(out[start + k])
+                i += 2
+            self._items += 1
+        del src[:i]
+        result = bytes(out[history_len:])
+        if len(out) > WINDOW:
+            del out[:len(out) - WINDOW]
+        return result
+
+    def flush(self):
+        return b''
+
+
+class ZlibCompressor:
+
+    def __init__(self):
+        self._z = zlib.compressobj()
+
+    def compress(self, data):
+        return self._z.compress(data)
+
+    def flush(self):
+        return self._z.flush()
+
+
+class ZlibDecompressor:
+
+    def __init__(self):
+        self._z = zlib.decompressobj()
+
+    def decompress(self, data):
+        return self._z.decompress(data)
+
+    def flush(self):
+        return self._z.flush()
+
+
+def can_compress(codec):
+    if codec == CODEC_LZSS:
+        return True
+    return codec == CODEC_ZLIB and zlib is not None and hasattr(zlib, 'compressobj')
+
+
+def can_decompress(codec):
+    if codec == CODEC_LZSS:
+        return True
+    return codec == CODEC_ZLIB and zlib is not None and hasattr(zlib, 'decompressobj')
+
+
+def choose_codec(codecs):
+    """The first of codecs (in order of preference) this board can compress with, or CODEC_NONE"""
+    for codec in codecs:
+        if can_compress(codec):
+            return codec
+    return CODEC_NONE
+
+
+def compressor(codec):
+    if codec == CODEC_LZSS:
+        return LZSSCompressor()
+    if codec == CODEC_ZLIB:
+        return ZlibCompressor()
+    raise ValueError(f'Unknown codec {codec}')
+
+
+def decompressor(codec):
+    if codec == CODEC_LZSS:
+        return LZSSDecompressor()
+    if codec == CODEC_ZLIB:
+        return ZlibDecompressor()
+    raise ValueError(f'Unknown codec {codec}')
+
+
+def compress(codec, data):
+    c = compressor(codec)
+    return c.compress(data) + c.flush()
+
+
+def decompress(codec, data):
+    d = decompressor(codec)
+    return d.decompress(data) + d.flush()
+
+
+def compress_file(codec, source_path, dest_path):
+    """Compresses the file at source_path into dest_path, READ_SIZE bytes at a time. Returns the compressed size."""
+    return _transform_file(compressor(codec), source_path, dest_path, 'compress')
+
+
+def decompress_file(codec, source_path, dest_path):
+    """Decompresses the file at source_path into dest_path, READ_SIZE bytes at a time. Returns the decompressed size."""
+    return _transform_file(decompressor(codec), source_path, dest_path, 'decompress')
+
+
+def _transform_file(codec, source_path, dest_path, method):
+    transform = getattr(codec, method)
+    size = 0
+    with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+        while True:
+            chunk = source.read(READ_SIZE)
+            if not chunk:
+                break
+            out = transform(chunk)
+            dest.write(out)
+            size += len(out)
+        out = codec.flush()
+        dest.write(out)
+        size += len(out)
+    return size
@@ -0,0 +1,150 @@
+"""
+Block hashes and delta application for rsync style uploads.
+
+The satellite hashes fixed size blocks of its copy of a file (block_hashes).  The ground station
+finds those blocks in the new file with a rolling weak checksum (see gs_delta.py), and uplinks a
+delta: references to blocks the satellite already has, and the literal bytes in between.  The
+satellite rebuilds the new file from the delta and its old copy (apply_delta).
+
+Block hashes are downlinked as
+    block size (u32), file size (u32), strong hash length (u8),
+    then for each block: weak checksum (u32), strong hash
+and a delta is
+    strong hash length (u8), block size (u32), file size (u32), strong hash of the whole new file,
+    then ops: COPY_OP first block (u32), block count (u16) | LITERAL_OP length (u16), bytes
+All integers are big endian.
+"""
+import struct
+try:
+    import hashlib
+except ImportError:
+    hashlib = None
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+
+COPY_OP = 0x00
+LITERAL_OP = 0x01
+
+HASHES_HEADER = '>IIB'
+DELTA_HEADER = '>BII'
+COPY = '>BIH'
+LITERAL = '>BH'
+MAX_LITERAL = 0xffff
+
+SHA256_LEN = 8  # sha256 truncated to 8 bytes
+CRC32_LEN = 4
+
+READ_SIZE = 512
+
+
+def weak_checksum(data):
+    """The rsync rolling checksum of data: a 16 bit byte sum, and a 16 bit sum of the running sums"""
+    a = 0
+    b = 0
+    for x in data:
+        a += x
+        b += a
+    return ((b & 0xffff) << 16) | (a & 0xffff)
+
+
+def strong_hash_len():
+    """The length of the strong hashes this board produces: sha256 where available, otherwise crc32"""
+    return SHA256_LEN if hashlib is not None else CRC32_LEN
+
+
+class StrongHash:
+    """Incrementally hashes data with the strong hash of the given length (see strong_hash_len)"""
+
+    __slots__ = ('length', '_sha', '_crc')
+
+    def __init__(self, length):
+        self.length = length
+        if length == SHA256_LEN:
+            self._sha = hashlib.sha256()
+        elif length == CRC32_LEN:
+            self._sha = None
+            self._crc = 0
+        else:
+            raise ValueError(f'Unknown strong hash length {length}')
+
+    def update(self, data):
+        if self._sha is not None:
+            self._sha.update(data)
+        else:
+            self._crc = crc32(data, self._crc)
+
+    def digest(self):
+        if self._sha is not None:
+            return self._sha.digest()[:SHA256_LEN]
+        return struct.pack('>I', self._crc & 0xffffffff)
+
+
+def strong_hash(data, length):
+    h = StrongHash(length)
+    h.update(data)
+    return h.digest()
+
+
+def file_strong_hash(path, length):
+    """The strong hash of the whole file at path"""
+    h = StrongHash(length)
+    buf = bytearray(READ_SIZE)
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(memoryview(buf)[:n])
+    return h.digest()
+
+
+def block_hashes(path, block_size, out):
+    """Writes the weak and strong hash of each block_size block of the file at path to the file-like object out"""
+    length = strong_hash_len()
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(0)
+        out.write(struct.pack(HASHES_HEADER, block_size, size, length))
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            out.write(struct.pack('>I', weak_checksum(block)))
+            out.write(strong_hash(block, length))
+
+
+def apply_delta(basis_path, delta_path, out_path):
+    """Rebuilds a file from the delta at delta_path and the old copy at basis_path, writing it to out_path.
+    Raises ValueError if the result does not have the size and hash the delta was made for."""
+    with open(delta_path, 'rb') as delta, open(basis_path, 'rb') as basis, open(out_path, 'wb') as out:
+        length, block_size, size = struct.unpack(DELTA_HEADER, delta.read(struct.calcsize(DELTA_HEADER)))
+        expected = delta.read(length)
+        h = StrongHash(length)
+        written = 0
+        while True:
+            op = delta.read(1)
+            if not op:
+                break
+            if op[0] == COPY_OP:
+                first, count = struct.unpack('>IH', delta.read(6))
+                basis.seek(first * block_size)
+                remaining = count * block_size
+                source = basis
+            elif op[0] == LITERAL_OP:
+                remaining = struct.unpack('>H', delta.read(2))[0]
+                source = delta
+            else:
+                raise ValueError(f'Unknown delta op {op[0]}')
+            while remaining > 0:
+                data = source.read(min(READ_SIZE, remaining))
+                if not data:
+                    break  # a copy of the short last block
+                out.write(data)
+                h.update(data)
+                written += len(data)
+                remaining -= len(data)
+    if written != size or h.digest() != expected:
+        raise ValueError(f'Delta result does not match: {written} of {size} bytes')
@@ -1,56 +1,161 @@
-from .message import Message
+from .message import Message, write_stream_header
 from . import headers
-from . import PACKET_DATA_LEN
+from . import PACKET_DATA_LEN, STREAM_DATA_LEN, STREAM_HEADER_LEN
 import os
+try:
+    import mmap
+except ImportError:
+    mmap = None
 
 class DiskBufferedMessage(Message):
     """Transmits the message PACKET_DATA_LEN bytes at a time.
     Sets special headers for the first packet, middle packets, and last packet.
-    Reads from a file one chunk at a time.
+    Reads from a file through a read-ahead window, so most packets (and all retries) are served from memory.
+    The file stays open until the message is done or closed, and is memory mapped where mmap is available.
 
+    Without a stream id packets use the DISK_BUFFERED headers, and the message must not interleave
+    with other buffered messages.  With a stream id they use the DISK_STREAM headers, which carry
+    the stream id and chunk index, so the message can be sent at any priority.
+
+    :param path: The path to the file containing the message to send
+    :type path: str
     :param priority: The priority of the message (higher is better)
     :type priority: int
-    :param path: The path to the file containing the message to send
-    :type str: str | bytes | bytearray
+    :param stream_id: The stream id (0-255) to send the message on, or None for the legacy headers
+    :type stream_id: int | None
+    :param flags: The stream flags byte, e.g. the codec the message is compressed with (see compression.py)
+    :type flags: int
+    :param offset: The byte offset in the file to start sending from, e.g. to resume an interrupted transfer
+    :type offset: int
+    :param length: The number of bytes to send from offset, or None for the rest of the file
+    :type length: int | None
     """
 
+    __slots__ = ('cursor', 'offset', 'path', 'msg_len', 'file_err', 'stream_id', 'flags', '_file', '_map', '_map_view',
+                 '_window', '_window_start', '_window_len')
+
     packet_len = PACKET_DATA_LEN
+    read_ahead = 4096
 
-    def __init__(self, path):
-        self.cursor = 0
-        self.priority = 1  # fixed so DiskBufferredMessage packets don't interleave
+    def __init__(self, path, priority=1, stream_id=None, offset=0, length=None, flags=0):
+        self.cursor = offset
+        self.offset = offset
+        self.priority = priority  # 1 by default so legacy DiskBufferredMessage packets don't interleave
         self.path = path
+        # msg_len is the file position the message ends at
         self.msg_len = os.stat(path)[6]
+        if length is not None:
+            self.msg_len = min(self.msg_len, offset + length)
         self.file_err = False
+        self.stream_id = stream_id
+        self.flags = flags
+        if stream_id is not None and self.msg_len - offset > 0x10000 * STREAM_DATA_LEN:
+            raise ValueError("File too large for a stream's 16 bit chunk index")
+        self._file = None
+        self._map = None
+        self._map_view = None
+        self._window = None
+        self._window_start = 0
+        self._window_len = 0
 
     def packet(self):
         """Reads the next chunk of data from sd, and returns this is a packet.
         Always requests an ack."""
+        pkt = bytearray(self._chunk_len() + STREAM_HEADER_LEN)
+        length, with_ack = self.packet_into(pkt)
+        del pkt[length:]
+        return pkt, with_ack
+
+    def packet_into(self, buf):
+        """Writes the next chunk of data from sd into buf as a packet, and returns its length.
+        Always requests an ack."""
         try:
-            with open(self.path, "rb") as f:
-                f.seek(self.cursor)
-                payload = f.read(self.packet_len)
+            payload = self._chunk()
         except Exception as e:
             print(f'Error reading file {self.path}: {e}')
             self.file_err = True
-            pkt = bytearray([headers.DEFAULT]) + bytearray("Error reading file", "utf-8")
-            return pkt, True
-        pkt = bytearray(len(payload) + 1)
-        if self.msg_len <= self.cursor + self.packet_len:  # last packet
-            pkt[0] = headers.DISK_BUFFERED_END
-        elif self.cursor == 0:
-            pkt[0] = headers.DISK_BUFFERED_START
+            self.close()
+            error = b"Error reading file"
+            buf[0] = headers.DEFAULT
+            buf[1:len(error) + 1] = error
+            return len(error) + 1, True
+        chunk_len = self._chunk_len()
+        last = self.msg_len <= self.cursor + chunk_len
+
+        if self.stream_id is None:
+            if last:
+                buf[0] = headers.DISK_BUFFERED_END
+            elif self.cursor == self.offset:
+                buf[0] = headers.DISK_BUFFERED_START
+            else:
+                buf[0] = headers.DISK_BUFFERED_MID
+            start = 1
         else:
-            pkt[0] = headers.DISK_BUFFERED_MID
+            if last:
+                header = headers.DISK_STREAM_END
+            elif self.cursor == self.offset:
+                header = headers.DISK_STREAM_START
+            else:
+                header = headers.DISK_STREAM_MID
+            write_stream_header(buf, header, self.stream_id,
+                               (self.cursor - self.offset) // chunk_len, self.flags)
+            start = STREAM_HEADER_LEN
+
+        length = len(payload) + start
+        buf[start:length] = payload
+        return length, True
+
+    def _chunk_len(self):
+        return self.packet_len if self.stream_id is None else STREAM_DATA_LEN
+
+    def _chunk(self):
+        """The payload at the cursor, refilling the read-ahead window if it does not hold all of it"""
+        end = min(self.cursor + self._chunk_len(), self.msg_len)
+        if self._file is None:
+            self._open()
+        if self._map_view is not None:
+            return self._map_view[self.cursor:end]
+        offset = self.cursor - self._window_start
+        if offset < 0 or self._window_start + self._window_len < end:
+            self._file.seek(self.cursor)
+            self._window_start = self.cursor
+            self._window_len = self._file.readinto(self._window) or 0
+            offset = 0
+        return memoryview(self._window)[offset:offset + end - self.cursor]
+
+    def _open(self):
+        self._file = open(self.path, "rb")
+        if mmap is not None and self.msg_len > 0:
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._map_view = memoryview(self._map)
+                return
+            except (OSError, ValueError):
+                pass  # e.g. a filesystem that can't be mapped; fall back to buffered reads
+        if self._window is None:
+            self._window = bytearray(self.read_ahead)
+        self._window_len = 0
 
-        pkt[1:] = payload
-        return pkt, True
+    def close(self):
+        """Releases the file handle and read-ahead window. packet() reopens the file if it is called again."""
+        if self._map is not None:
+            self._map_view.release()
+            self._map_view = None
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._window = None
+        self._window_len = 0
 
     def done(self):
         return (self.msg_len <= self.cursor) or self.file_err
 
     def ack(self):
-        self.cursor += self.packet_len
+        self.cursor += self._chunk_len()
+        if self.msg_len <= self.cursor:
+            self.close()
 
     def __repr__(self) -> str:
         return f'<Disk Buffer: {self.path}>'
@@ -0,0 +1,196 @@
+"""
+Fountain (LT) coding for downlinks without per packet acks.
+
+A file is split into k blocks of SYMBOL_LEN bytes.  Symbol ids below k are the blocks themselves
+(so on a clean link no decoding is needed); every later symbol is the XOR of a set of blocks drawn
+from the robust soliton distribution, seeded by the symbol id.  The ground station regenerates the
+same sets from the ids it receives (see neighbors), so any k or slightly more symbols, in any order,
+recover the file, and a lost packet costs one more symbol instead of a turnaround.
+
+Each FOUNTAIN_SYMBOL packet is a stream header (see headers.py) carrying the symbol id as its
+chunk index, then the file size (u32 big endian), then the symbol.
+"""
+from math import log, sqrt
+from .message import Message, write_stream_header
+from . import headers
+from . import STREAM_HEADER_LEN, STREAM_DATA_LEN
+
+SIZE_LEN = 4
+SYMBOL_LEN = STREAM_DATA_LEN - SIZE_LEN
+MAX_SYMBOLS = 0x10000  # symbol ids are the 16 bit stream chunk index
+
+# robust soliton parameters
+C = 0.1
+DELTA = 0.5
+
+# symbols sent beyond k before giving up, as a fraction of k; with a quarter of the symbols lost,
+# about 1.4k must be sent before the blocks lost from the first k are recovered.  A ground station
+# that still can't decode asks for more with FOUNTAIN_MORE.
+DEFAULT_OVERHEAD = 1.0
+
+
+def block_count(size):
+    return max(1, (size + SYMBOL_LEN - 1) // SYMBOL_LEN)
+
+
+class Random:
+    """xorshift32, so the satellite and ground station draw the same numbers on any python"""
+
+    __slots__ = ('state',)
+
+    def __init__(self, seed):
+        self.state = ((seed + 1) * 2654435761) & 0xffffffff or 1
+
+    def next(self):
+        x = self.state
+        x ^= (x << 13) & 0xffffffff
+        x ^= x >> 17
+        x ^= (x << 5) & 0xffffffff
+        self.state = x
+        return x
+
+    def random(self):
+        return self.next() / 4294967296.0
+
+
+def soliton_cdf(k):
+    """Cumulative robust soliton distribution of the degrees 1..k (cdf[d - 1] is P(degree <= d))"""
+    if k == 1:
+        return [1.0]
+    r = C * log(k / DELTA) * sqrt(k)
+    pivot = min(k, max(1, int(k / r)))
+    weights = []
+    for d in range(1, k + 1):
+        rho = 1.0 / k if d == 1 else 1.0 / (d * (d - 1))
+        if d < pivot:
+            tau = r / (d * k)
+        elif d == pivot:
+            tau = max(0.0, r * log(r / DELTA) / k)
+        else:
+            tau = 0.0
+        weights.append(rho + tau)
+    total = sum(weights)
+    cdf = []
+    acc = 0.0
+    for w in weights:
+        acc += w / total
+        cdf.append(acc)
+    cdf[-1] = 1.0
+    return cdf
+
+
+def neighbors(symbol_id, k, cdf):
+    """The indices of the blocks XORed into symbol symbol_id"""
+    if symbol_id < k:
+        return [symbol_id]
+    rng = Random(symbol_id)
+    u = rng.random()
+    lo = 0
+    hi = k - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if cdf[mid] < u:
+            lo = mid + 1
+        else:
+            hi = mid
+    degree = lo + 1
+    chosen = []
+    while len(chosen) < degree:
+        block = rng.next() % k
+        if block not in chosen:
+            chosen.append(block)
+    return chosen
+
+
+class FountainMessage(Message):
+    """Transmits a file as fountain coded symbols, without acks.
+
+    Sends symbols until it has sent k * (1 + overhead) of them, and any more the ground station
+    asks for (see more), or is removed from the transmission queue, which the ground station asks
+    for with FOUNTAIN_DONE once it has decoded the file.
+
+    :param path: The path to the file to send
+    :type path: str
+    :param stream_id: The stream id (0-255) to send the symbols on
+    :type stream_id: int
+    :param priority: The priority of the message (higher is better)
+    :type priority: int
+    :param overhead: Symbols to send beyond k, as a fraction of k
+    :type overhead: float
+    """
+
+    __slots__ = ('path', 'stream_id', 'size', 'k', 'cdf', 'symbol_id', 'max_symbols', 'file_err', '_file')
+
+    def __init__(self, path, stream_id, priority=1, overhead=DEFAULT_OVERHEAD):
+        super().__init__(priority, b'')
+        self.path = path
+        self.stream_id = stream_id
+        with open(path, 'rb') as f:
+            f.seek(0, 2)
+            self.size = f.tell()
+        self.k = block_count(self.size)
+        if self.k > MAX_SYMBOLS // 2:
+            raise ValueError("File too large for 16 bit fountain symbol ids")
+        self.cdf = soliton_cdf(self.k)
+        self.symbol_id = 0
+        self.max_symbols = min(MAX_SYMBOLS, self.k + int(self.k * overhead) + 10)
+        self.file_err = False
+        self._file = None
+
+    def packet(self):
+        pkt = bytearray(STREAM_HEADER_LEN + SIZE_LEN + SYMBOL_LEN)
+        length, with_ack = self.packet_into(pkt)
+        del pkt[length:]
+        return pkt, with_ack
+
+    def packet_into(self, buf):
+        """Writes the next symbol into buf. Symbols are never acked, so each call moves on to the next one."""
+        try:
+            symbol = self._symbol(self.symbol_id)
+        except Exception as e:
+            print(f'Error reading file {self.path}: {e}')
+            self.file_err = True
+            self.close()
+            error = b"Error reading file"
+            buf[0] = headers.DEFAULT
+            buf[1:len(error) + 1] = error
+            return len(error) + 1, True
+        write_stream_header(buf, headers.FOUNTAIN_SYMBOL, self.stream_id, self.symbol_id)
+        start = STREAM_HEADER_LEN
+        buf[start:start + SIZE_LEN] = self.size.to_bytes(SIZE_LEN, 'big')
+        start += SIZE_LEN
+        buf[start:start + SYMBOL_LEN] = symbol
+        self.symbol_id += 1
+        if self.done():
+            self.close()
+        return start + SYMBOL_LEN, False
+
+    def _symbol(self, symbol_id):
+        if self._file is None:
+            self._file = open(self.path, 'rb')
+        acc = 0
+        for block in neighbors(symbol_id, self.k, self.cdf):
+            self._file.seek(block * SYMBOL_LEN)
+            data = self._file.read(SYMBOL_LEN)
+            acc ^= int.from_bytes(data + bytes(SYMBOL_LEN - len(data)), 'big')
+        return acc.to_bytes(SYMBOL_LEN, 'big')
+
+    def more(self, symbols):
+        """Sends `symbols` more symbols than planned, e.g. after too many were lost to decode the file"""
+        self.max_symbols = min(MAX_SYMBOLS, self.max_symbols + symbols)
+
+    def stop(self):
+        """Sends no more symbols"""
+        self.max_symbols = self.symbol_id
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def done(self):
+        return self.max_symbols <= self.symbol_id or self.file_err
+
+    def __repr__(self) -> str:
+        return f'<Fountain: {self.path}>'
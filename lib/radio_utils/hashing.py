@@ -0,0 +1,82 @@
+"""
+Whole file hashes, to check that a transfer arrived intact or find that it isn't needed.
+
+CRC32 comes from binascii, which every board has; SHA-256 needs hashlib, which some boards
+lack, so a satellite asked for SHA-256 without it answers with CRC32 (see best_available).
+Digests are compared as lowercase hex strings.
+"""
+try:
+    import hashlib
+except ImportError:
+    hashlib = None
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+
+SHA256 = "sha256"
+CRC32 = "crc32"
+ALGORITHMS = (SHA256, CRC32)  # in order of preference
+
+READ_SIZE = 512
+
+
+def available(algorithm):
+    if algorithm == SHA256:
+        return hashlib is not None
+    return algorithm == CRC32 and crc32 is not None
+
+
+def best_available(algorithm):
+    """algorithm if this board has it, otherwise the first of ALGORITHMS it has"""
+    if available(algorithm):
+        return algorithm
+    for fallback in ALGORITHMS:
+        if available(fallback):
+            return fallback
+    raise ValueError('No hash algorithm available')
+
+
+class Hasher:
+    """Incrementally hashes data with algorithm (one of ALGORITHMS)"""
+
+    __slots__ = ('algorithm', '_sha', '_crc')
+
+    def __init__(self, algorithm):
+        if not available(algorithm):
+            raise ValueError(f'Unknown hash algorithm {algorithm}')
+        self.algorithm = algorithm
+        self._sha = hashlib.sha256() if algorithm == SHA256 else None
+        self._crc = 0
+
+    def update(self, data):
+        if self._sha is not None:
+            self._sha.update(data)
+        else:
+            self._crc = crc32(data, self._crc)
+
+    def hexdigest(self):
+        if self._sha is not None:
+            return ''.join('%02x' % b for b in self._sha.digest())
+        return '%08x' % (self._crc & 0xffffffff)
+
+
+def hash_data(data, algorithm):
+    h = Hasher(algorithm)
+    h.update(data)
+    return h.hexdigest()
+
+
+def hash_file(path, algorithm):
+    """The size and hex digest of the file at path, read READ_SIZE bytes at a time"""
+    h = Hasher(algorithm)
+    buf = bytearray(READ_SIZE)
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(memoryview(buf)[:n])
+            size += n
+    return size, h.hexdigest()
@@ -8,6 +8,37 @@ DISK_BUFFERED_START = 0xfc
 DISK_BUFFERED_MID = 0xfb
 DISK_BUFFERED_END = 0xfa
 
+# Stream multiplexed buffered messages.  After the header byte each packet carries
+# a stream id, a flags byte, and a 2 byte big endian chunk index, so packets from
+# several transfers can interleave and be reassembled per stream.  The low bits of the
+# flags byte are the codec the transfer is compressed with (see compression.py).
+MEMORY_STREAM_START = 0xf9
+MEMORY_STREAM_MID = 0xf8
+MEMORY_STREAM_END = 0xf7
+
+DISK_STREAM_START = 0xf6
+DISK_STREAM_MID = 0xf5
+DISK_STREAM_END = 0xf4
+
+# A fountain coded symbol (see fountain.py), sent without ack on a stream
+FOUNTAIN_SYMBOL = 0xf3
+
+# A blast transfer (see blast_message.py): chunks sent without ack on a stream, and after each
+# round an acked BLAST_END carrying the chunk count (as its chunk index) and the file size
+BLAST_CHUNK = 0xf2
+BLAST_END = 0xf1
+
+# An upload session (see upload_session.py): UPLOAD_START declares the destination path, and
+# UPLOAD_DATA and UPLOAD_END carry the file, on the session id and chunk index of a stream header
+UPLOAD_START = 0xf0
+UPLOAD_DATA = 0xef
+UPLOAD_END = 0xee
+
 COMMAND = 0x01
+# A command tagged with a correlation id (the byte after the command code), which its responses echo:
+# packets as RESPONSE, followed by the correlation id and the header they would have had, and
+# buffered responses on a stream whose stream id is the correlation id
+COMMAND_CORRELATED = 0x03
+RESPONSE = 0x04
 
 BEACON = 0x02
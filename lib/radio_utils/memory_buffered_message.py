@@ -1,37 +1,78 @@
-from .message import Message
+from .message import Message, write_stream_header
 from . import headers
-from . import PACKET_DATA_LEN
+from . import PACKET_DATA_LEN, STREAM_DATA_LEN, STREAM_HEADER_LEN
 
 class MemoryBufferedMessage(Message):
     """Transmits the message PACKET_DATA_LEN bytes at a time.
     Sets special headers for the first packet, middle packets, and last packet.
 
+    Without a stream id packets use the MEMORY_BUFFERED headers, and the message must not interleave
+    with other buffered messages.  With a stream id they use the MEMORY_STREAM headers, which carry
+    the stream id and chunk index, so the message can be sent at any priority.
+
     :param str: The message to send
     :type str: str | bytes | bytearray
+    :param priority: The priority of the message (higher is better)
+    :type priority: int
+    :param stream_id: The stream id (0-255) to send the message on, or None for the legacy headers
+    :type stream_id: int | None
+    :param flags: The stream flags byte, e.g. the codec the message is compressed with (see compression.py)
+    :type flags: int
     """
 
+    __slots__ = ('cursor', 'stream_id', 'flags')
+
     packet_len = PACKET_DATA_LEN
 
-    def __init__(self, str):
-        priority = 2  # fixed so MemoryBufferedMessage packets don't interleave
+    def __init__(self, str, priority=2, stream_id=None, flags=0):
+        # priority 2 by default so legacy MemoryBufferedMessage packets don't interleave
         super().__init__(priority, str)
         self.cursor = 0
+        self.stream_id = stream_id
+        self.flags = flags
+        if stream_id is not None and len(self.str) > 0x10000 * STREAM_DATA_LEN:
+            raise ValueError("Message too long for a stream's 16 bit chunk index")
+
+    def _chunk_len(self):
+        return self.packet_len if self.stream_id is None else STREAM_DATA_LEN
 
     def packet(self):
-        payload = self.str[self.cursor:self.cursor + self.packet_len]
-        pkt = bytearray(len(payload) + 1)
-        if len(self.str) <= self.cursor + self.packet_len:  # last packet
-            pkt[0] = headers.MEMORY_BUFFERED_END
-        elif self.cursor == 0:
-            pkt[0] = headers.MEMORY_BUFFERED_START
+        pkt = bytearray(min(self._chunk_len(), len(self.str) - self.cursor) + STREAM_HEADER_LEN)
+        length, with_ack = self.packet_into(pkt)
+        del pkt[length:]
+        return pkt, with_ack
+
+    def packet_into(self, buf):
+        chunk_len = self._chunk_len()
+        end = self.cursor + chunk_len
+        last = len(self.str) <= end
+        if last:
+            end = len(self.str)
+
+        if self.stream_id is None:
+            if last:
+                buf[0] = headers.MEMORY_BUFFERED_END
+            elif self.cursor == 0:
+                buf[0] = headers.MEMORY_BUFFERED_START
+            else:
+                buf[0] = headers.MEMORY_BUFFERED_MID
+            start = 1
         else:
-            pkt[0] = headers.MEMORY_BUFFERED_MID
+            if last:
+                header = headers.MEMORY_STREAM_END
+            elif self.cursor == 0:
+                header = headers.MEMORY_STREAM_START
+            else:
+                header = headers.MEMORY_STREAM_MID
+            write_stream_header(buf, header, self.stream_id, self.cursor // chunk_len, self.flags)
+            start = STREAM_HEADER_LEN
 
-        pkt[1:] = payload
-        return pkt, True
+        length = end - self.cursor + start
+        buf[start:length] = memoryview(self.str)[self.cursor:end]
+        return length, True
 
     def done(self):
         return len(self.str) <= self.cursor
 
     def ack(self):
-        self.cursor += self.packet_len
+        self.cursor += self._chunk_len()
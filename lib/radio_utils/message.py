@@ -1,3 +1,12 @@
+def write_stream_header(buf, header, stream_id, index, flags=0):
+    """Writes a stream multiplexed packet header (see headers.py) to the start of buf."""
+    buf[0] = header
+    buf[1] = stream_id
+    buf[2] = flags
+    buf[3] = (index >> 8) & 0xff
+    buf[4] = index & 0xff
+
+
 class Message:
     """The most basic message type. Supports ascii messages no longer than 251 bytes.
     Other message types should inherit from this class.
@@ -8,6 +17,8 @@ class Message:
     :type str: str | bytes | bytearray
     """
 
+    __slots__ = ('priority', 'header', 'with_ack', 'str')
+
     def __init__(self, priority, str, with_ack=False, header=0x00):
         self.priority = priority
         self.header = header
@@ -24,6 +35,18 @@ class Message:
         pkt[1:] = self.str
         return pkt, self.with_ack
 
+    def packet_into(self, buf):
+        """Writes the packet into buf (a bytearray or memoryview of at least MAX_PACKET_LEN bytes)
+        instead of allocating it.
+
+        :return: The packet length, and if it should be sent with or without ack
+        :rtype: (int, bool)
+        """
+        length = len(self.str) + 1
+        buf[0] = self.header
+        buf[1:length] = self.str
+        return length, self.with_ack
+
     def done(self):
         """Returns true if the message is done sending."""
         return True
@@ -36,6 +59,10 @@ class Message:
         """Called when the message fails to be acknowledged."""
         pass
 
+    def close(self):
+        """Called when the message is dropped from the transmission queue, to release anything it holds open."""
+        pass
+
     def __lt__(self, other):
         return self.priority < other.priority
 
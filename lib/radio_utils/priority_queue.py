@@ -12,7 +12,7 @@ Usage:
 >>> heapify(x)        # transforms list into a heap, in-place, in linear time
 """
 
-__all__ = ['push', 'pop', 'heapify']
+__all__ = ['push', 'pop', 'heapify', 'heappush', 'heappop', 'heapify_min']
 
 def push(heap, item):
     """Push item onto heap, maintaining the heap invariant.
@@ -84,3 +84,54 @@ def _siftup_max(heap, pos):
     # to its final resting place (by sifting its parents down).
     heap[pos] = newitem
     _siftdown_max(heap, startpos, pos)
+
+# Min heap variants with the same interface as CPython's heapq, for ports built without it.
+
+def heappush(heap, item):
+    """Push item onto a min heap, maintaining the heap invariant."""
+    heap.append(item)
+    _siftdown_min(heap, 0, len(heap) - 1)
+
+def heappop(heap):
+    """Pop the smallest item off a min heap, maintaining the heap invariant."""
+    lastelt = heap.pop()    # raises appropriate IndexError if heap is empty
+    if heap:
+        returnitem = heap[0]
+        heap[0] = lastelt
+        _siftup_min(heap, 0)
+        return returnitem
+    return lastelt
+
+def heapify_min(heap):
+    """Transform list into a min heap, in-place, in O(len(x)) time."""
+    n = len(heap)
+    for i in reversed(range(n // 2)):
+        _siftup_min(heap, i)
+    return heap
+
+def _siftdown_min(heap, startpos, pos):
+    newitem = heap[pos]
+    while pos > startpos:
+        parentpos = (pos - 1) >> 1
+        parent = heap[parentpos]
+        if newitem < parent:
+            heap[pos] = parent
+            pos = parentpos
+            continue
+        break
+    heap[pos] = newitem
+
+def _siftup_min(heap, pos):
+    endpos = len(heap)
+    startpos = pos
+    newitem = heap[pos]
+    childpos = 2 * pos + 1
+    while childpos < endpos:
+        rightpos = childpos + 1
+        if rightpos < endpos and not heap[childpos] < heap[rightpos]:
+            childpos = rightpos
+        heap[pos] = heap[childpos]
+        pos = childpos
+        childpos = 2 * pos + 1
+    heap[pos] = newitem
+    _siftdown_min(heap, startpos, pos)
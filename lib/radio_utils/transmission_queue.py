@@ -1,50 +1,319 @@
-"""The Transmission Queue is a max heap of messages to be transmitted.
+"""The Transmission Queue holds the messages waiting to be transmitted.
 
-Messages must support the `__lt__`, `__le__`, `__eq__`, `__ge__`, and `__gt__` operators.
-This enables to the max heap to compare messages based on their priority.
+Messages are sent highest priority first, and in the order they were pushed within a priority.
+Each queued message has an id, returned by `push`, that can be used to remove or reprioritize it.
+
+Messages can be pushed with a time to live, after which they are discarded instead of transmitted.
+With priority aging enabled, a waiting message gains one priority level every `aging_interval` seconds,
+so low priority messages are not starved by a steady stream of higher priority ones.
+
+The module level `push`, `peek`, `pop`, `empty`, `clear` and `size` functions operate on the default
+queue, `queue`, which holds up to 100 messages. It does not age messages unless
+`queue.set_aging_interval` turns aging on.
 """
-from . import priority_queue as pq
+import time
+try:
+    from heapq import heappush, heappop, heapify
+except ImportError:
+    from .priority_queue import heappush, heappop, heapify_min as heapify
 
-queue = []
-limit = 100
+# What push does when the queue is full
+DROP_NEWEST = 0  # refuse the new message with a QueueFullError
+DROP_OLDEST = 1  # evict the message that has been queued the longest
+DROP_LOWEST = 2  # evict the lowest priority message, or drop the new one if it is no better
 
-def push(msg):
-    """Push a msg into the transmission queue
+# Rebuild the heap once it holds this many more removed entries than live ones
+_COMPACT_SLACK = 16
 
-    :param msg: The message to push
-    :type msg: Message | MemoryBufferedMessage | DiskBufferedMessage
-    """
-    if len(queue) < limit:
-        pq.push(queue, msg)
-    else:
-        raise Exception("Queue is full")
 
-def peek():
-    """Returns the next message to be transmitted
+class QueueFullError(Exception):
+    pass
+
+
+class TransmissionQueue:
+    """A priority queue of messages to be transmitted.
 
-    :return: The next message to be transmitted
-    :rtype: Message | MemoryBufferedMessage | DiskBufferedMessage
+    Entries are `[key, sequence, message, enqueued_ns, expires_ns]` lists kept in a heap, so ties
+    are broken by push order and no Message comparisons are needed. The key is `-priority`, or with
+    aging `enqueued_ns - priority * aging_interval_ns`: a message pushed one interval later ranks as
+    one priority level lower, which ages waiting messages without ever rekeying the heap. Removed,
+    reprioritized and expired entries are emptied in place and discarded when they reach the top.
+    Messages that leave the queue without being popped are closed, releasing any open files.
+    `dropped` and `expired` count the messages lost to the drop policy and to their ttl, and `aged`
+    counts the pops that aging moved ahead of a queued message of higher priority.
+
+    :param limit: The maximum number of queued messages
+    :type limit: int
+    :param drop_policy: What `push` does when the queue is full: DROP_NEWEST, DROP_OLDEST or DROP_LOWEST
+    :type drop_policy: int
+    :param aging_interval: Seconds of waiting worth one priority level, or None to disable aging
+    :type aging_interval: float | None
     """
-    return queue[0]
+
+    def __init__(self, limit=100, drop_policy=DROP_NEWEST, aging_interval=None):
+        self.limit = limit
+        self.drop_policy = drop_policy
+        self.dropped = 0
+        self.expired = 0
+        self.aged = 0
+        self._heap = []
+        self._entries = {}  # message id -> live heap entry
+        self._sequence = 0
+        self._space = None  # tasko.sync.Event, created by the first put() that has to wait
+        self.set_aging_interval(aging_interval)
+
+    def set_aging_interval(self, aging_interval):
+        """Sets the seconds of waiting worth one priority level, or None to disable aging
+
+        :param aging_interval: The aging interval in seconds
+        :type aging_interval: float | None
+        """
+        self._aging_nanos = int(aging_interval * 1000000000) if aging_interval else 0
+        for entry in self._entries.values():
+            entry[0] = self._key(entry[2].priority, entry[3])
+        self._heap = list(self._entries.values())
+        heapify(self._heap)
+
+    def push(self, msg, ttl=None):
+        """Push a msg into the transmission queue
+
+        :param msg: The message to push
+        :type msg: Message | MemoryBufferedMessage | DiskBufferedMessage
+        :param ttl: Seconds after which the message is discarded if it has not been popped
+        :type ttl: float | None
+        :return: The id of the queued message, or None if the drop policy dropped it
+        :rtype: int | None
+        """
+        now = time.monotonic_ns()
+        key = self._key(msg.priority, now)
+        if len(self._entries) >= self.limit and not self._make_room(key):
+            return None
+        msg_id = self._sequence
+        self._sequence += 1
+        expires = now + int(ttl * 1000000000) if ttl is not None else None
+        entry = [key, msg_id, msg, now, expires]
+        self._entries[msg_id] = entry
+        heappush(self._heap, entry)
+        return msg_id
+
+    async def put(self, msg, ttl=None):
+        """Push a msg into the transmission queue, waiting for space if it is full
+
+        :param msg: The message to push
+        :type msg: Message | MemoryBufferedMessage | DiskBufferedMessage
+        :param ttl: Seconds after which the message is discarded if it has not been popped
+        :type ttl: float | None
+        :return: The id of the queued message
+        :rtype: int
+        """
+        while len(self._entries) >= self.limit and not self.purge_expired():
+            if self._space is None:
+                from tasko.sync import Event
+                self._space = Event()
+            self._space.clear()
+            await self._space.wait()
+        return self.push(msg, ttl)
+
+    def peek(self):
+        """Returns the next message to be transmitted
+
+        :return: The next message to be transmitted
+        :rtype: Message | MemoryBufferedMessage | DiskBufferedMessage
+        """
+        return self._top()[0][2]
+
+    def pop(self):
+        """Returns the next message to be transmitted and removes it from the transmission queue
+
+        :return: The next message to be transmitted
+        :rtype: Message | MemoryBufferedMessage | DiskBufferedMessage
+        """
+        entry = heappop(self._top())
+        del self._entries[entry[1]]
+        if self._aging_nanos and time.monotonic_ns() - entry[3] >= self._aging_nanos and self._overtook(entry):
+            self.aged += 1
+        self._freed()
+        return entry[2]
+
+    def purge_expired(self):
+        """Discards every expired message now, rather than as they reach the front of the queue
+
+        :return: The number of messages discarded
+        :rtype: int
+        """
+        now = time.monotonic_ns()
+        expired = [msg_id for msg_id, entry in self._entries.items() if entry[4] is not None and entry[4] <= now]
+        for msg_id in expired:
+            entry = self._entries.pop(msg_id)
+            entry[2].close()
+            entry[2] = None
+        self.expired += len(expired)
+        if expired:
+            self._compact()
+            self._freed()
+        return len(expired)
+
+    def remove(self, msg_id):
+        """Removes a queued message
+
+        :param msg_id: The id returned by push
+        :type msg_id: int
+        :return: The removed message, closed, or None if it is no longer queued
+        :rtype: Message | MemoryBufferedMessage | DiskBufferedMessage | None
+        """
+        entry = self._entries.pop(msg_id, None)
+        if entry is None:
+            return None
+        msg = entry[2]
+        msg.close()
+        entry[2] = None
+        self._compact()
+        self._freed()
+        return msg
+
+    def reprioritize(self, msg_id, priority):
+        """Changes the priority of a queued message, keeping its place among messages of the new priority
+
+        :param msg_id: The id returned by push
+        :type msg_id: int
+        :param priority: The new priority (higher is better)
+        :type priority: int
+        :return: If the message was still queued
+        :rtype: bool
+        """
+        entry = self._entries.get(msg_id)
+        if entry is None:
+            return False
+        msg = entry[2]
+        entry[2] = None
+        msg.priority = priority
+        entry = [self._key(priority, entry[3]), msg_id, msg, entry[3], entry[4]]
+        self._entries[msg_id] = entry
+        heappush(self._heap, entry)
+        self._compact()
+        return True
+
+    def empty(self):
+        """Returns if the transmission queue is empty"""
+        return not self._entries
+
+    def full(self):
+        """Returns if the transmission queue holds `limit` messages"""
+        return len(self._entries) >= self.limit
+
+    def clear(self):
+        """Clears the transmission queue"""
+        for entry in self._entries.values():
+            entry[2].close()
+        self._heap = []
+        self._entries = {}
+        self._freed()
+
+    def size(self):
+        """Returns the number of messages in the transmission queue"""
+        return len(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _key(self, priority, enqueued_ns):
+        if self._aging_nanos:
+            return enqueued_ns - priority * self._aging_nanos
+        return -priority
+
+    def _top(self):
+        """Discards removed and expired entries from the top of the heap, and returns the heap"""
+        heap = self._heap
+        now = None
+        while heap:
+            entry = heap[0]
+            if entry[2] is not None:
+                if entry[4] is None:
+                    break
+                if now is None:
+                    now = time.monotonic_ns()
+                if entry[4] > now:
+                    break
+                del self._entries[entry[1]]
+                entry[2].close()
+                self.expired += 1
+                self._freed()
+            heappop(heap)
+        if not heap:
+            raise IndexError("Transmission queue is empty")
+        return heap
+
+    def _overtook(self, entry):
+        """Returns if aging popped entry ahead of a queued message of higher priority.
+
+        Only a message that waited at least one aging interval can have overtaken one, so pop only
+        scans the queue for those.
+        """
+        priority = entry[2].priority
+        for other in self._entries.values():
+            if other[2].priority > priority:
+                return True
+        return False
+
+    def _make_room(self, key):
+        """Applies the drop policy to a full queue. Returns False if the new message should be dropped."""
+        if self.purge_expired():
+            return True
+        if self.drop_policy == DROP_OLDEST:
+            victim = min(self._entries)
+        elif self.drop_policy == DROP_LOWEST:
+            victim = max(self._entries.values())
+            if victim[0] <= key:
+                self.dropped += 1
+                return False
+            victim = victim[1]
+        else:
+            raise QueueFullError("Queue is full")
+        self.dropped += 1
+        self.remove(victim)
+        return True
+
+    def _compact(self):
+        heap = self._heap
+        if len(heap) > 2 * len(self._entries) + _COMPACT_SLACK:
+            self._heap = [entry for entry in heap if entry[2] is not None]
+            heapify(self._heap)
+
+    def _freed(self):
+        if self._space is not None:
+            self._space.set()
+
+
+queue = TransmissionQueue(limit=100)
+
+def push(msg, ttl=None):
+    """Push a msg into the default transmission queue. See TransmissionQueue.push"""
+    return queue.push(msg, ttl)
+
+def peek():
+    """Returns the next message to be transmitted from the default transmission queue"""
+    return queue.peek()
 
 def pop():
-    """Returns the next message to be transmitted and removes it from the transmission queue
+    """Returns and removes the next message to be transmitted from the default transmission queue"""
+    return queue.pop()
 
-    :return: The next message to be transmitted
-    :rtype: Message | MemoryBufferedMessage | DiskBufferedMessage
-    """
-    return pq.pop(queue)
+def remove(msg_id):
+    """Removes a message from the default transmission queue. See TransmissionQueue.remove"""
+    return queue.remove(msg_id)
+
+def reprioritize(msg_id, priority):
+    """Changes the priority of a message in the default transmission queue. See TransmissionQueue.reprioritize"""
+    return queue.reprioritize(msg_id, priority)
 
 def empty():
-    """Returns if the transmission queue is empty"""
-    return len(queue) == 0
+    """Returns if the default transmission queue is empty"""
+    return queue.empty()
 
 def clear():
-    """Clears the transmission queue"""
-    global queue
-    queue = []
+    """Clears the default transmission queue"""
+    queue.clear()
 
 def size():
-    """Returns the number of messages in the transmission queue"""
-    global queue
-    return len(queue)
+    """Returns the number of messages in the default transmission queue"""
+    return queue.size()
@@ -0,0 +1,234 @@
+"""
+Upload sessions: uplinked files that say where they go.
+
+An upload is sent as one or more sessions, each on a session id (0-255, in the stream id slot of a
+stream header, see headers.py).  UPLOAD_START (chunk 0) carries the offset in the file the session
+starts at and the size of the whole file (u32 big endian each), then the destination path; the
+UPLOAD_DATA chunks and the final UPLOAD_END carry the file's bytes from that offset.
+
+The satellite (UploadReceiver) appends the bytes to the destination's .part file as they arrive,
+renames it into place once it holds the whole file, and answers each UPLOAD_END with the size of
+the .part file.  So several uploads can be in flight at once, no staging file has to be moved
+into place afterwards, and an interrupted upload picks up where its .part file ends.
+"""
+import os
+import struct
+from .message import Message, write_stream_header
+from . import headers
+from . import STREAM_HEADER_LEN, STREAM_DATA_LEN
+
+START = '>II'  # offset, file size
+START_LEN = struct.calcsize(START)
+MAX_PATH_LEN = STREAM_DATA_LEN - START_LEN
+MAX_SESSION_BYTES = 0xffff * STREAM_DATA_LEN  # data chunks are numbered 1 to 0xffff
+MAX_SESSIONS = 4
+
+
+def _file_size(path):
+    try:
+        return os.stat(path)[6]
+    except OSError:
+        return None
+
+
+class UploadMessage(Message):
+    """Sends length bytes of a file from offset as an upload session.
+
+    :param path: The path to the local file to send
+    :type path: str
+    :param dest: The path to write the file to on the satellite
+    :type dest: str
+    :param session_id: The session id (0-255) to send the upload on
+    :type session_id: int
+    :param offset: The byte offset in the file the session starts at
+    :type offset: int
+    :param length: The number of bytes to send from offset, or None for the rest of the file
+    :type length: int | None
+    """
+
+    __slots__ = ('path', 'dest', 'session_id', 'offset', 'size', 'end', 'cursor', 'started', 'finished', 'file_err',
+                 '_file')
+
+    def __init__(self, path, dest, session_id, offset=0, length=None, priority=1):
+        super().__init__(priority, b'', with_ack=True)
+        self.path = path
+        self.dest = bytes(dest, 'utf-8')
+        if len(self.dest) > MAX_PATH_LEN:
+            raise ValueError(f'Upload path longer than {MAX_PATH_LEN} bytes')
+        self.session_id = session_id
+        self.offset = offset
+        self.size = os.stat(path)[6]
+        if length is None:
+            length = self.size - offset
+        self.end = min(self.size, offset + min(length, MAX_SESSION_BYTES))
+        self.cursor = offset
+        self.started = False
+        self.finished = False
+        self.file_err = False
+        self._file = None
+
+    def packet(self):
+        pkt = bytearray(STREAM_HEADER_LEN + STREAM_DATA_LEN)
+        length, with_ack = self.packet_into(pkt)
+        del pkt[length:]
+        return pkt, with_ack
+
+    def packet_into(self, buf):
+        """Writes UPLOAD_START, then the next chunk of the file, into buf. Every packet is acked."""
+        if not self.started:
+            write_stream_header(buf, headers.UPLOAD_START, self.session_id, 0)
+            buf[STREAM_HEADER_LEN:STREAM_HEADER_LEN + START_LEN] = struct.pack(START, self.offset, self.size)
+            length = STREAM_HEADER_LEN + START_LEN + len(self.dest)
+            buf[STREAM_HEADER_LEN + START_LEN:length] = self.dest
+            return length, True
+
+        try:
+            if self._file is None:
+                self._file = open(self.path, 'rb')
+            self._file.seek(self.cursor)
+            n = min(STREAM_DATA_LEN, self.end - self.cursor)
+            data = self._file.read(n)
+        except Exception as e:
+            print(f'Error reading file {self.path}: {e}')
+            self.file_err = True
+            self.close()
+            error = b"Error reading file"
+            buf[0] = headers.DEFAULT
+            buf[1:len(error) + 1] = error
+            return len(error) + 1, True
+        last = self.end <= self.cursor + len(data)
+        index = (self.cursor - self.offset) // STREAM_DATA_LEN + 1
+        write_stream_header(buf, headers.UPLOAD_END if last else headers.UPLOAD_DATA, self.session_id, index)
+        buf[STREAM_HEADER_LEN:STREAM_HEADER_LEN + len(data)] = data
+        return STREAM_HEADER_LEN + len(data), True
+
+    def ack(self):
+        if not self.started:
+            self.started = True
+            return
+        if self.end <= self.cursor + STREAM_DATA_LEN:
+            self.finished = True  # UPLOAD_END was acked
+            self.close()
+        self.cursor = min(self.end, self.cursor + STREAM_DATA_LEN)
+
+    def acked_bytes(self):
+        """The bytes of the file the satellite has acked, from offset"""
+        return self.cursor - self.offset
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def done(self):
+        return self.finished or self.file_err
+
+    def __repr__(self) -> str:
+        return f'<Upload: {self.path}>'
+
+
+class _Session:
+
+    __slots__ = ('dest', 'offset', 'size', 'index', 'written', 'file', 'error')
+
+    def __init__(self, dest, offset, size):
+        self.dest = dest
+        self.offset = offset
+        self.size = size
+        self.index = 1
+        self.written = offset
+        self.file = None
+        self.error = None
+        part_size = _file_size(dest + '.part')
+        try:
+            if offset == 0:
+                self.file = open(dest + '.part', 'wb')
+            elif part_size == offset:
+                self.file = open(dest + '.part', 'ab')
+            else:
+                self.written = part_size or 0
+                self.error = f'offset {offset} is not the end of the part file'
+        except Exception as e:
+            self.written = part_size or 0
+            self.error = str(e)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class UploadReceiver:
+    """Writes upload sessions to their destination files on the satellite.
+    The radio task hands every UPLOAD_START, UPLOAD_DATA and UPLOAD_END packet to receive()."""
+
+    def __init__(self):
+        self.sessions = {}  # session id -> _Session
+        self._order = []  # session ids, oldest first
+
+    def receive(self, packet):
+        """Handles one upload packet (header byte first).
+        Returns the response to downlink, 'Success uploading <id>: size <bytes>' or 'Error uploading <id>: ...'
+        at the end of a session, otherwise None."""
+        header = packet[0]
+        session_id = packet[1]
+        index = (packet[3] << 8) | packet[4]
+        data = packet[STREAM_HEADER_LEN:]
+
+        session = self.sessions.get(session_id)
+        if header == headers.UPLOAD_START:
+            offset, size = struct.unpack(START, bytes(data[:START_LEN]))
+            dest = str(bytes(data[START_LEN:]), 'utf-8')
+            if session is not None and (session.dest, session.offset) == (dest, offset):
+                return None  # a resent UPLOAD_START whose ack was lost
+            self._start(session_id, dest, offset, size)
+            return None
+
+        if session is None:
+            return f'Error uploading {session_id}: unknown session' if header == headers.UPLOAD_END else None
+        if index < session.index:
+            return None  # resent after a lost ack
+        if session.file is not None:
+            if index > session.index:
+                session.close()
+                session.error = f'missing chunk {session.index}'
+            else:
+                try:
+                    session.file.write(data)
+                    session.written += len(data)
+                except Exception as e:
+                    session.close()
+                    session.error = str(e)
+        session.index = index + 1
+        if header == headers.UPLOAD_END:
+            return self._end(session_id, session)
+        return None
+
+    def _start(self, session_id, dest, offset, size):
+        # a new session for a file replaces any earlier one, e.g. one cut short by the end of a pass
+        for other_id in [i for i, s in self.sessions.items() if s.dest == dest or i == session_id]:
+            self._forget(other_id)
+        while len(self._order) >= MAX_SESSIONS:
+            self._forget(self._order[0])
+        self.sessions[session_id] = _Session(dest, offset, size)
+        self._order.append(session_id)
+
+    def _end(self, session_id, session):
+        if session.error is not None:
+            return f'Error uploading {session_id}: {session.error}, size {session.written}'
+        session.close()
+        if session.written == session.size:
+            try:
+                if _file_size(session.dest) is not None:
+                    os.remove(session.dest)
+                os.rename(session.dest + '.part', session.dest)
+            except Exception as e:
+                session.error = str(e)
+                return f'Error uploading {session_id}: {e}, size {session.written}'
+        return f'Success uploading {session_id}: size {session.written}'
+
+    def _forget(self, session_id):
+        session = self.sessions.pop(session_id, None)
+        if session is not None:
+            session.close()
+            self._order.remove(session_id)
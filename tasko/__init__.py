@@ -1,4 +1,4 @@
-from .loop import Loop
+from .loop import Loop, monotonic, monotonic_ns
 
 # Enable logging by setting builtins.tasko_logging = True before importing the first time.
 #
@@ -34,6 +34,9 @@ schedule = get_loop().schedule
 schedule_later = get_loop().schedule_later
 sleep = get_loop().sleep
 suspend = get_loop().suspend
+run_in_executor = get_loop().run_in_executor
+set_default_executor = get_loop().set_default_executor
+call_soon_threadsafe = get_loop().call_soon_threadsafe
 
 run = get_loop().run
 
@@ -50,8 +53,13 @@ def reset():
     global schedule_later
     global sleep
     global suspend
+    global run_in_executor
+    global set_default_executor
+    global call_soon_threadsafe
     global run
 
+    if __global_event_loop is not None:
+        __global_event_loop.shutdown_default_executor()
     __global_event_loop = None
     dbg = get_loop().dbg
     add_task = get_loop().add_task
@@ -60,5 +68,8 @@ def reset():
     schedule_later = get_loop().schedule_later
     sleep = get_loop().sleep
     suspend = get_loop().suspend
+    run_in_executor = get_loop().run_in_executor
+    set_default_executor = get_loop().set_default_executor
+    call_soon_threadsafe = get_loop().call_soon_threadsafe
 
     run = get_loop().run
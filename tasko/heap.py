@@ -0,0 +1,49 @@
+"""
+A minimal min heap with the interface of CPython's heapq, for ports built without it.
+"""
+
+
+def heappush(heap, item):
+    """Push item onto the heap, maintaining the heap invariant."""
+    heap.append(item)
+    _siftdown(heap, 0, len(heap) - 1)
+
+
+def heappop(heap):
+    """Pop the smallest item off the heap, maintaining the heap invariant."""
+    last = heap.pop()  # raises IndexError if the heap is empty
+    if heap:
+        smallest = heap[0]
+        heap[0] = last
+        _siftup(heap, 0)
+        return smallest
+    return last
+
+
+def _siftdown(heap, startpos, pos):
+    item = heap[pos]
+    while pos > startpos:
+        parentpos = (pos - 1) >> 1
+        parent = heap[parentpos]
+        if not item < parent:
+            break
+        heap[pos] = parent
+        pos = parentpos
+    heap[pos] = item
+
+
+def _siftup(heap, pos):
+    endpos = len(heap)
+    startpos = pos
+    item = heap[pos]
+    # Move the smaller child up until hitting a leaf, then sift item down into place from there.
+    childpos = 2 * pos + 1
+    while childpos < endpos:
+        rightpos = childpos + 1
+        if rightpos < endpos and not heap[childpos] < heap[rightpos]:
+            childpos = rightpos
+        heap[pos] = heap[childpos]
+        pos = childpos
+        childpos = 2 * pos + 1
+    heap[pos] = item
+    _siftdown(heap, startpos, pos)
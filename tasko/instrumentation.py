@@ -0,0 +1,98 @@
+"""
+Scheduler statistics collected by a Loop after Loop.enable_instrumentation().
+
+Nothing in this module is imported or called while instrumentation is disabled.
+"""
+
+# Step latency histogram buckets: bucket i counts steps that took at most 2**i microseconds.
+# The final bucket counts everything slower than that.
+_HISTOGRAM_BUCKETS = 21
+
+
+def task_name(task):
+    """A readable, stable name for a loop Task to key statistics by"""
+    if task.name is not None:
+        return task.name
+    name = getattr(task.coroutine, '__qualname__', None)
+    return name if name is not None else repr(task.coroutine)
+
+
+class _Timing:
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def record(self, nanos):
+        self.count += 1
+        self.total_ns += nanos
+        if nanos > self.max_ns:
+            self.max_ns = nanos
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "total_ns": self.total_ns,
+            "max_ns": self.max_ns,
+            "mean_ns": self.total_ns // self.count if self.count else 0,
+        }
+
+
+class LoopStats:
+    """
+    Per-task cpu time, per-step latency, sleeper lateness and ScheduledTask overrun and deadline miss counters.
+    """
+    def __init__(self):
+        self.steps = 0
+        self.step_histogram = [0] * (_HISTOGRAM_BUCKETS + 1)
+        self.idle_ns = 0
+        self.task_cpu = {}
+        self.lateness = {}
+        self.overruns = {}
+        self.deadline_misses = {}
+
+    def record_step(self, nanos):
+        self.steps += 1
+        micros = nanos // 1000
+        bucket = 0
+        while bucket < _HISTOGRAM_BUCKETS and micros > (1 << bucket):
+            bucket += 1
+        self.step_histogram[bucket] += 1
+
+    def record_idle(self, nanos):
+        self.idle_ns += nanos
+
+    def record_run(self, task, nanos):
+        name = task_name(task)
+        timing = self.task_cpu.get(name)
+        if timing is None:
+            timing = self.task_cpu[name] = _Timing()
+        timing.record(nanos)
+
+    def record_lateness(self, task, nanos):
+        name = task_name(task)
+        timing = self.lateness.get(name)
+        if timing is None:
+            timing = self.lateness[name] = _Timing()
+        timing.record(nanos if nanos > 0 else 0)
+
+    def record_overrun(self, name):
+        self.overruns[name] = self.overruns.get(name, 0) + 1
+
+    def record_deadline_miss(self, name):
+        self.deadline_misses[name] = self.deadline_misses.get(name, 0) + 1
+
+    def snapshot(self):
+        """Returns a plain dict copy of the statistics, suitable for json.dumps"""
+        return {
+            "steps": self.steps,
+            "idle_ns": self.idle_ns,
+            "step_latency_us": {
+                "bucket_max_us": [1 << i for i in range(_HISTOGRAM_BUCKETS)] + [None],
+                "counts": list(self.step_histogram),
+            },
+            "task_cpu": {name: timing.snapshot() for name, timing in self.task_cpu.items()},
+            "sleeper_lateness": {name: timing.snapshot() for name, timing in self.lateness.items()},
+            "overruns": dict(self.overruns),
+            "deadline_misses": dict(self.deadline_misses),
+        }
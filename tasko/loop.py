@@ -1,11 +1,58 @@
 import time
 
+try:
+    import threading
+except ImportError:
+    # No threads on this platform (e.g. CircuitPython); run_in_executor runs work inline.
+    threading = None
+
 _monotonic_ns = time.monotonic_ns
+_virtual_clock = None
+
+# Loop scheduling policies (see Loop.set_scheduling_policy)
+PRIORITY = 'priority'
+EARLIEST_DEADLINE_FIRST = 'edf'
+
+# What a ScheduledTask does when an invocation runs past the start of its next window
+# (see ScheduledTask.set_overrun_policy)
+OVERRUN_COALESCE = 'coalesce'
+OVERRUN_SKIP = 'skip'
+OVERRUN_CATCH_UP = 'catch_up'
+
+# Deadline of tasks that did not declare one; sorts after every real deadline.
+NO_DEADLINE = 1 << 62
 
 
 def set_time_provider(monotonic_ns):
     global _monotonic_ns
+    global _virtual_clock
     _monotonic_ns = monotonic_ns
+    _virtual_clock = None
+
+
+def set_virtual_clock(clock):
+    """
+    Run all loops on a virtual clock (see tasko.simulation.VirtualClock).  Instead of sleeping,
+    an idle loop advances the clock straight to the next sleeper's deadline.
+    Pass None to go back to real time.
+    """
+    global _monotonic_ns
+    global _virtual_clock
+    if clock is None:
+        _monotonic_ns = time.monotonic_ns
+    else:
+        _monotonic_ns = clock.monotonic_ns
+    _virtual_clock = clock
+
+
+def monotonic_ns():
+    """The loop's notion of time.monotonic_ns(), which is virtual while a virtual clock is set"""
+    return _monotonic_ns()
+
+
+def monotonic():
+    """The loop's notion of time.monotonic(), which is virtual while a virtual clock is set"""
+    return _monotonic_ns() / 1000000000.0
 
 
 def _yield_once():
@@ -28,6 +75,8 @@ def _get_future_nanos(seconds_in_future):
 
 
 class Sleeper:
+    __slots__ = ('task', '_resume_nanos')
+
     def __init__(self, resume_nanos, task):
         self.task = task
         self._resume_nanos = resume_nanos
@@ -38,6 +87,9 @@ class Sleeper:
     def priority_sort(self):
         return self.task.priority
 
+    def deadline_sort(self):
+        return self.task.deadline_sort()
+
     def __repr__(self):
         return "{{Sleeper remaining: {:.2f}, task: {} }}".format(
             (self.resume_nanos() - _monotonic_ns()) , self.task
@@ -47,14 +99,23 @@ class Sleeper:
 
 
 class Task:
-    def __init__(self, coroutine, priority):
+    __slots__ = ('coroutine', 'priority', 'name', 'deadline')
+
+    def __init__(self, coroutine, priority, name=None):
         # Added a priority level
         self.coroutine = coroutine
         self.priority = priority
+        self.name = name
+        # Absolute deadline in monotonic nanos, only used by the EARLIEST_DEADLINE_FIRST policy
+        self.deadline = NO_DEADLINE
 
     def priority_sort(self):
         return self.priority
 
+    def deadline_sort(self):
+        # Earliest deadline first, then priority to break ties (and to order tasks without deadlines).
+        return (self.deadline, self.priority)
+
     def __repr__(self):
         return "{{Task {}, Priority {}}}".format(self.coroutine, self.priority)
 
@@ -62,10 +123,38 @@ class Task:
 
 
 class ScheduledTask:
+    __slots__ = (
+        '_loop', '_forward_async_fn', '_forward_args', '_forward_kwargs', '_nanoseconds_per_invocation',
+        '_stop', '_running', '_scheduled_to_run', '_priority', '_deadline_nanos', '_overrun_policy',
+        '_invocations', '_deadline_misses', '_max_lateness_nanos', '_skipped',
+    )
+
     def change_rate(self, hz):
         ### Update the task rate to a new frequency ###
         self._nanoseconds_per_invocation = (1 / hz) * 1000000000
 
+    def set_deadline(self, seconds):
+        ### Each invocation should finish within `seconds` of its window starting.  None to clear. ###
+        # Under the EARLIEST_DEADLINE_FIRST policy the loop runs the task with the nearest deadline first.
+        self._deadline_nanos = None if seconds is None else int(seconds * 1000000000)
+
+    def set_overrun_policy(self, policy):
+        ### What to do when an invocation runs past the start of the next window ###
+        # OVERRUN_COALESCE (default): run once, right away, and restart the schedule from now.
+        # OVERRUN_SKIP: drop the missed windows and wait for the next window on the original schedule.
+        # OVERRUN_CATCH_UP: run every missed window back to back until caught up with the original schedule.
+        assert policy in (OVERRUN_COALESCE, OVERRUN_SKIP, OVERRUN_CATCH_UP), "unknown overrun policy"
+        self._overrun_policy = policy
+
+    def deadline_stats(self):
+        ### Invocation, deadline miss and skipped window counts for this task ###
+        return {
+            "invocations": self._invocations,
+            "deadline_misses": self._deadline_misses,
+            "max_lateness_ns": self._max_lateness_nanos,
+            "skipped": self._skipped,
+        }
+
     def stop(self):
         ### Stop the task (does not interrupt a currently running task) ###
         self._stop = True
@@ -76,7 +165,7 @@ class ScheduledTask:
         if not self._scheduled_to_run:
             # Don't double-up the task if it's still in the run list!
             # print("Added task to loop._task")
-            self._loop.add_task(self._run_at_fixed_rate(), self._priority)
+            self._loop.add_task(self._run_at_fixed_rate(), self._priority, name=self._name())
 
     def __init__(
         self, loop, hz, forward_async_fn, priority, forward_args, forward_kwargs
@@ -90,15 +179,33 @@ class ScheduledTask:
         self._running = False
         self._scheduled_to_run = False
         self._priority = priority
+        self._deadline_nanos = None
+        self._overrun_policy = OVERRUN_COALESCE
+        self._invocations = 0
+        self._deadline_misses = 0
+        self._max_lateness_nanos = 0
+        self._skipped = 0
+
+    def _name(self):
+        return getattr(self._forward_async_fn, '__name__', repr(self._forward_async_fn))
 
     async def _run_at_fixed_rate(self):
         self._scheduled_to_run = True
+        # The loop Task driving this coroutine, which carries the deadline for EDF scheduling.
+        task = self._loop._current
         try:
             target_run_nanos = _monotonic_ns()
             while True:
                 if self._stop:
                     return  # Check before running
 
+                if self._deadline_nanos is not None:
+                    deadline_nanos = target_run_nanos + self._deadline_nanos
+                    task.deadline = deadline_nanos
+                else:
+                    deadline_nanos = None
+                    task.deadline = NO_DEADLINE
+
                 iteration = self._forward_async_fn(
                     *self._forward_args, **self._forward_kwargs
                 )
@@ -109,26 +216,58 @@ class ScheduledTask:
                     await iteration
                 finally:
                     self._running = False
+                self._invocations += 1
+
+                if deadline_nanos is not None:
+                    lateness_nanos = _monotonic_ns() - deadline_nanos
+                    if lateness_nanos > 0:
+                        self._record_deadline_miss(lateness_nanos)
 
                 if self._stop:
                     return  # Check before waiting
 
                 # Try to reschedule for the next window without skew. If we're falling behind,
-                # just go as fast as possible & schedule to run "now." If we catch back up again
-                # we'll return to seconds_per_invocation without doing a bunch of catchup runs.
+                # the overrun policy decides between running "now" (coalesce), waiting for the next
+                # window on the original schedule (skip) or running back to back (catch up).
                 target_run_nanos = target_run_nanos + self._nanoseconds_per_invocation
                 # print('target_run_nanos is ', target_run_nanos)
                 now_nanos = _monotonic_ns()
                 if now_nanos <= target_run_nanos:
                     # print("Going to put to sleep")
+                    self._set_window_deadline(task, target_run_nanos)
                     await self._loop._sleep_until_nanos(target_run_nanos)
                 else:
-                    target_run_nanos = now_nanos
+                    stats = self._loop._stats
+                    if stats is not None:
+                        stats.record_overrun(self._name())
+                    if self._overrun_policy == OVERRUN_SKIP:
+                        missed = int((now_nanos - target_run_nanos) // self._nanoseconds_per_invocation) + 1
+                        self._skipped += missed
+                        target_run_nanos += missed * self._nanoseconds_per_invocation
+                        self._set_window_deadline(task, target_run_nanos)
+                        await self._loop._sleep_until_nanos(target_run_nanos)
+                        continue
+                    if self._overrun_policy == OVERRUN_COALESCE:
+                        target_run_nanos = now_nanos
+                    self._set_window_deadline(task, target_run_nanos)
                     # Allow other tasks a chance to run if this task is too slow.
                     await _yield_once()
         finally:
             self._scheduled_to_run = False
 
+    def _set_window_deadline(self, task, window_nanos):
+        # Lets EDF order this task's wake up by the deadline of the window it is waiting for.
+        if self._deadline_nanos is not None:
+            task.deadline = window_nanos + self._deadline_nanos
+
+    def _record_deadline_miss(self, lateness_nanos):
+        self._deadline_misses += 1
+        if lateness_nanos > self._max_lateness_nanos:
+            self._max_lateness_nanos = lateness_nanos
+        stats = self._loop._stats
+        if stats is not None:
+            stats.record_deadline_miss(self._name())
+
     def __repr__(self):
         hz = 1 / (self._nanoseconds_per_invocation / 1000000000)
         state = "running" if self._running else "waiting"
@@ -153,6 +292,21 @@ class Loop:
         self._sleeping = []
         self._ready = []
         self._current = None
+        self._default_executor = None
+        self._owns_default_executor = False
+        # Callbacks queued from other threads, drained at the start of each step.
+        self._threadsafe_calls = []
+        self._pending_external = 0
+        if threading is not None:
+            self._threadsafe_lock = threading.Lock()
+            self._wakeup = threading.Event()
+        else:
+            self._threadsafe_lock = None
+            self._wakeup = None
+        self._task_sort = Task.priority_sort
+        self._sleeper_sort = Sleeper.priority_sort
+        # LoopStats while instrumentation is enabled.  None keeps the hot paths free of bookkeeping.
+        self._stats = None
         self.debug=debug
         if debug:
             self._debug = print
@@ -165,16 +319,67 @@ class Loop:
         print(f"There are {len(self._ready)} ready tasks")
         print(self._current)
 
-    def add_task(self, awaitable_task, priority):
+    def set_scheduling_policy(self, policy):
+        """
+        Choose how runnable tasks are ordered within a step.
+        PRIORITY (default): by the static priority given to add_task/schedule, lowest first.
+        EARLIEST_DEADLINE_FIRST: by the deadline declared with ScheduledTask.set_deadline, earliest
+        first, with priority breaking ties.  Tasks without a deadline run after those with one.
+        """
+        if policy == PRIORITY:
+            self._task_sort = Task.priority_sort
+            self._sleeper_sort = Sleeper.priority_sort
+        elif policy == EARLIEST_DEADLINE_FIRST:
+            self._task_sort = Task.deadline_sort
+            self._sleeper_sort = Sleeper.deadline_sort
+        else:
+            raise ValueError("Unknown scheduling policy {}".format(policy))
+
+    def set_task_deadline(self, seconds):
+        """
+        From within a coroutine, declare that the current task should finish within `seconds`.
+        Only affects ordering under the EARLIEST_DEADLINE_FIRST policy.  None clears the deadline.
+        """
+        assert self._current is not None, "You can only set a deadline from within a task"
+        if seconds is None:
+            self._current.deadline = NO_DEADLINE
+        else:
+            self._current.deadline = _get_future_nanos(seconds)
+
+    def enable_instrumentation(self):
+        """
+        Start collecting scheduler statistics: per-task cpu time, a step latency histogram,
+        sleeper lateness and ScheduledTask overruns.  Any previous statistics are discarded.
+        """
+        from .instrumentation import LoopStats
+        self._stats = LoopStats()
+        # Shadow _run_task with the timing version rather than testing a flag on every task switch.
+        self._run_task = self._run_task_instrumented
+
+    def disable_instrumentation(self):
+        """Stop collecting scheduler statistics"""
+        self._stats = None
+        self.__dict__.pop('_run_task', None)
+
+    def instrumentation_snapshot(self):
+        """
+        :returns: A dict of the statistics collected since enable_instrumentation(), or None if disabled.
+        """
+        if self._stats is None:
+            return None
+        return self._stats.snapshot()
+
+    def add_task(self, awaitable_task, priority, name=None):
         """
         Add a concurrent task (known as a coroutine, implemented as a generator in CircuitPython)
         Use:
           scheduler.add_task( my_async_method() )
         :param awaitable_task:  The coroutine to be concurrently driven to completion.
+        :param name: Optional name to report the task under in instrumentation snapshots.
         """
         self._debug("adding task ", awaitable_task)
         # Added a priority parameter
-        self._tasks.append(Task(awaitable_task, priority))
+        self._tasks.append(Task(awaitable_task, priority, name))
 
     async def sleep(self, seconds):
         """
@@ -225,6 +430,76 @@ class Loop:
         self._current = None
         return _yield_once(), resume
 
+    def call_soon_threadsafe(self, callback):
+        """
+        Queue a callback to run on the loop from another thread, waking the loop if it is idle.
+        This is the only Loop method that is safe to call from outside the loop's thread.
+
+        :param callback: function() => void, run at the start of the next step.
+        """
+        if self._threadsafe_lock is None:
+            self._threadsafe_calls.append(callback)
+            return
+        with self._threadsafe_lock:
+            self._threadsafe_calls.append(callback)
+        self._wakeup.set()
+
+    def set_default_executor(self, executor):
+        """
+        Replace the executor used by run_in_executor when none is given.
+        Any concurrent.futures.Executor works, e.g. a ThreadPoolExecutor for blocking I/O or a
+        ProcessPoolExecutor for CPU-heavy work (functions and arguments must then be picklable).
+        """
+        if self._owns_default_executor:
+            self.shutdown_default_executor()
+        self._default_executor = executor
+
+    def _get_default_executor(self):
+        if self._default_executor is None and threading is not None:
+            try:
+                from concurrent.futures import ThreadPoolExecutor
+            except ImportError:
+                return None
+            self._default_executor = ThreadPoolExecutor(max_workers=4)
+            self._owns_default_executor = True
+        return self._default_executor
+
+    def shutdown_default_executor(self):
+        """Stop the worker threads of the executor this loop created for run_in_executor, if any."""
+        if self._owns_default_executor:
+            self._default_executor.shutdown(wait=False)
+            self._default_executor = None
+            self._owns_default_executor = False
+
+    async def run_in_executor(self, fn, *args, executor=None):
+        """
+        From within a coroutine, run a blocking function on an executor and await its result.
+        The calling task is suspended until the function completes; the rest of the loop keeps running.
+        Use:
+          data = await tasko.run_in_executor(read_file, path)
+
+        On platforms without threads the function is simply called inline.
+
+        :param fn: The blocking function to run.
+        :param executor: The executor to run fn on.  Defaults to a shared thread pool.
+        :returns: The return value of fn (exceptions raised by fn are re-raised here)
+        """
+        if executor is None:
+            executor = self._get_default_executor()
+            if executor is None:
+                return fn(*args)
+
+        future = executor.submit(fn, *args)
+        await_handle, resume = self.suspend()
+        # Keeps run() alive while nothing but executor work is outstanding.
+        self._pending_external += 1
+        future.add_done_callback(lambda _: self.call_soon_threadsafe(resume))
+        try:
+            await await_handle
+        finally:
+            self._pending_external -= 1
+        return future.result()
+
     def schedule(self, hz: float, coroutine_function, priority, *args, **kwargs):
         """
         Describe how often a method should be called.
@@ -290,24 +565,36 @@ class Loop:
             self._current is None
         ), "Loop can only be advanced by 1 stack frame at a time."
         self._loopnum = 0
-        while self._tasks or self._sleeping:
-            self._debug(
-                "[{}] ---- sleeping: {}, active: {}".format(
-                    self._loopnum, len(self._sleeping), len(self._tasks)
+        while self._tasks or self._sleeping or self._pending_external:
+            if self.debug:
+                self._debug(
+                    "[{}] ---- sleeping: {}, active: {}".format(
+                        self._loopnum, len(self._sleeping), len(self._tasks)
+                    )
                 )
-            )
             self._step()
-            self._debug("\n")
+            if self.debug:
+                self._debug("\n")
             self._loopnum += 1
         # while self._tasks or self._sleeping:
         # self._step()
         self._debug("Loop completed", self._tasks, self._sleeping)
 
     def _step(self):
-        self._debug("  stepping over ", len(self._tasks), " tasks")
+        stats = self._stats
+        if stats is not None:
+            step_start = time.monotonic_ns()
+            idle_before = stats.idle_ns
+        if self._threadsafe_calls:
+            self._run_threadsafe_calls()
+        if _virtual_clock is not None:
+            _virtual_clock.tick()
+
+        if self.debug:
+            self._debug("  stepping over ", len(self._tasks), " tasks")
 
-        # Sort tasks by priority
-        self._tasks.sort(key=Task.priority_sort)
+        # Sort tasks by priority (or deadline)
+        self._tasks.sort(key=self._task_sort)
 
         for _ in range(len(self._tasks)):
             task = self._tasks.pop(0)
@@ -320,8 +607,8 @@ class Loop:
 
         #Create the ready list based on whichever tasks are ready to be executed
         self._ready = [x for x in self._sleeping if x.resume_nanos() <= _monotonic_ns()]
-        #Sort the ready tasks based on priority
-        self._ready.sort(key=lambda x: x.task.priority)
+        #Sort the ready tasks based on priority (or deadline)
+        self._ready.sort(key=self._sleeper_sort)
 
         if self.debug:
             self._debug("  ready list (sorted)")
@@ -333,6 +620,8 @@ class Loop:
         for i in range(len(self._ready)):
             ready_task = self._ready.pop(0)
             self._sleeping.remove(ready_task)
+            if stats is not None:
+                stats.record_lateness(ready_task.task, _monotonic_ns() - ready_task.resume_nanos())
             self._run_task(ready_task.task)
 
         if len(self._tasks) == 0 and len(self._sleeping) > 0:
@@ -345,7 +634,11 @@ class Loop:
             next_sleeper = self._sleeping[0]
             sleep_nanos = next_sleeper.resume_nanos() - _monotonic_ns()
 
-            if sleep_nanos > 0:
+            if sleep_nanos > 0 and _virtual_clock is not None:
+                # Simulated time: nothing can happen before the next sleeper is due, so skip ahead.
+                _virtual_clock.advance_to(next_sleeper.resume_nanos())
+
+            elif sleep_nanos > 0:
                 # Give control to the system, there's nothing to be done right now,
                 # and nothing else is scheduled to run for this long.
                 # This is the real sleep. If/when interrupts are implemented this will likely need to change.
@@ -357,7 +650,46 @@ class Loop:
                     self._sleeping,
                 )
 
+                self._idle(sleep_seconds)
+
+        elif not self._tasks and self._pending_external and not self._threadsafe_calls:
+            # Only executor work is outstanding; wait for it to call back.
+            self._idle(None)
+
+        if stats is not None:
+            stats.record_step(time.monotonic_ns() - step_start - (stats.idle_ns - idle_before))
+
+    def _idle(self, sleep_seconds):
+        """
+        Give control to the system for sleep_seconds (forever if None), returning early if
+        another thread calls call_soon_threadsafe.
+        """
+        if self._stats is not None:
+            idle_start = time.monotonic_ns()
+            self._idle_uninstrumented(sleep_seconds)
+            self._stats.record_idle(time.monotonic_ns() - idle_start)
+        else:
+            self._idle_uninstrumented(sleep_seconds)
+
+    def _idle_uninstrumented(self, sleep_seconds):
+        if self._wakeup is None:
+            if sleep_seconds is not None:
                 time.sleep(sleep_seconds)
+            return
+        if not self._threadsafe_calls:
+            self._wakeup.wait(sleep_seconds)
+        self._wakeup.clear()
+
+    def _run_threadsafe_calls(self):
+        if self._threadsafe_lock is None:
+            calls = self._threadsafe_calls
+            self._threadsafe_calls = []
+        else:
+            with self._threadsafe_lock:
+                calls = self._threadsafe_calls
+                self._threadsafe_calls = []
+        for callback in calls:
+            callback()
 
     def _run_task(self, task: Task):
         """
@@ -380,6 +712,15 @@ class Loop:
         finally:
             self._current = None
 
+    def _run_task_instrumented(self, task: Task):
+        start = time.monotonic_ns()
+        try:
+            Loop._run_task(self, task)
+        finally:
+            stats = self._stats
+            if stats is not None:
+                stats.record_run(task, time.monotonic_ns() - start)
+
     async def _sleep_until_nanos(self, target_run_nanos):
         """
         From within a coroutine, sleeps until the target time.monotonic_ns
@@ -1,4 +1,14 @@
+try:
+    from heapq import heappush, heappop
+except ImportError:
+    from .heap import heappush, heappop
+
 import tasko
+from tasko.loop import monotonic_ns
+
+
+class ResourceTimeoutError(Exception):
+    pass
 
 
 class ManagedResource:
@@ -8,20 +18,43 @@ class ManagedResource:
     This class vends access to `resource` via a fair queue.  Intended use is with something like a busio.SPI
     with on_acquire setting a chip select pin and on_release resetting that pin.
 
+    Waiters are handed the resource in priority order (lowest value first, like tasko task priorities),
+    and first come first served within a priority.  A waiter's priority is its handle's priority if set,
+    otherwise the priority of the waiting task.
+
     A ManagedResource instance should be shared among all users of `resource`.
     """
-    def __init__(self, resource, on_acquire=lambda *args, **kwargs: None, on_release=lambda *args, **kwargs: None, loop=tasko.get_loop()):
+    def __init__(self, resource, on_acquire=lambda *args, **kwargs: None, on_release=lambda *args, **kwargs: None, loop=None):
         """
         :param resource: The resource you want to manage access to (e.g., a busio.SPI)
         :param on_acquire: function(*args, **kwargs) => void  acquires your singleton resource (CS pin low or something)
         :param on_release: function(*args, **kwargs) => void  releases your singleton resource (CS pin high or something)
+        :param loop: The loop the resource is used from.  Defaults to the global loop, even after tasko.reset()
         """
         self._resource = resource
         self._on_acquire = on_acquire
         self._on_release = on_release
-        self._loop = loop
+        self._fixed_loop = loop
+        # Heap of [priority, sequence, resume_fn, timed_out, expiry].  resume_fn is None once the waiter has been
+        # resumed, either with ownership or by its timeout; such entries are discarded when they surface.
+        # expiry is the coroutine of the waiter's timeout task, if it has a timeout.
         self._ownership_queue = []
+        self._sequence = 0
+        self._waiting = 0
         self._owned = False
+        self._acquired_nanos = 0
+        self._acquisitions = 0
+        self._contended = 0
+        self._timeouts = 0
+        self._wait_nanos = 0
+        self._max_wait_nanos = 0
+        self._hold_nanos = 0
+        self._max_hold_nanos = 0
+        self._max_queue_depth = 0
+
+    @property
+    def _loop(self):
+        return self._fixed_loop if self._fixed_loop is not None else tasko.get_loop()
 
     def handle(self, *args, **kwargs):
         """
@@ -30,41 +63,132 @@ class ManagedResource:
         """
         return Handle(self, args, kwargs)
 
-    async def _aenter(self, args, kwargs):
+    def metrics(self):
+        """
+        Returns contention metrics for this resource: acquisition and timeout counts, wait and hold times
+        in nanoseconds, and the current and deepest ownership queue.
+        """
+        return {
+            "acquisitions": self._acquisitions,
+            "contended": self._contended,
+            "timeouts": self._timeouts,
+            "wait_ns": self._wait_nanos,
+            "max_wait_ns": self._max_wait_nanos,
+            "hold_ns": self._hold_nanos,
+            "max_hold_ns": self._max_hold_nanos,
+            "queue_depth": self._waiting,
+            "max_queue_depth": self._max_queue_depth,
+        }
+
+    def _try_acquire(self, args, kwargs):
+        """Synchronously takes the resource if nobody owns it.  Returns False instead of waiting."""
+        if self._owned:
+            return False
+        self._owned = True
+        self._acquired(args, kwargs)
+        return True
+
+    async def _aenter(self, args, kwargs, priority=None, timeout=None):
         if self._owned:
+            if priority is None:
+                current = self._loop._current
+                priority = current.priority if current is not None else 0
             # queue up for access to the resource later
             await_handle, resume_fn = self._loop.suspend()
-            self._ownership_queue.append(resume_fn)
+            entry = [priority, self._sequence, resume_fn, False, None]
+            self._sequence += 1
+            heappush(self._ownership_queue, entry)
+            self._waiting += 1
+            if self._waiting > self._max_queue_depth:
+                self._max_queue_depth = self._waiting
+            if timeout is not None:
+                entry[4] = self._expire(entry, timeout)
+                self._loop.add_task(entry[4], priority)
+            wait_start = monotonic_ns()
             # This leverages the suspend() feature in tasko; this current coroutine is not considered again until
             # the owning job is complete and __aexit__s below.  This keeps waiting handles as cheap as possible.
             await await_handle
+            if entry[3]:
+                raise ResourceTimeoutError("Timed out after {}s waiting for managed resource".format(timeout))
+            waited = monotonic_ns() - wait_start
+            self._contended += 1
+            self._wait_nanos += waited
+            if waited > self._max_wait_nanos:
+                self._max_wait_nanos = waited
         self._owned = True
-        self._on_acquire(*args, **kwargs)
+        self._acquired(args, kwargs)
         return self._resource
 
+    def _acquired(self, args, kwargs):
+        self._acquisitions += 1
+        self._acquired_nanos = monotonic_ns()
+        self._on_acquire(*args, **kwargs)
+
+    async def _expire(self, entry, timeout):
+        if entry[2] is None:
+            return  # handed the resource before this task first ran
+        await self._loop.sleep(timeout)
+        resume_fn = entry[2]
+        if resume_fn is not None:
+            # Still waiting: give up our place in the queue and wake with the timeout flag set.
+            entry[2] = None
+            entry[3] = True
+            self._waiting -= 1
+            self._timeouts += 1
+            resume_fn()
+
+    def _cancel_expiry(self, expiry):
+        """Drops the sleeping timeout task of a waiter that got the resource, so it doesn't keep the loop running"""
+        loop = self._loop
+        for sleeper in loop._sleeping:
+            if sleeper.task.coroutine is expiry:
+                if sleeper not in loop._ready:  # otherwise it runs this step anyway and finds nothing to do
+                    loop._sleeping.remove(sleeper)
+                    expiry.close()
+                return
+
     async def _aexit(self, args, kwargs):
+        self._release(args, kwargs)
+
+    def _release(self, args, kwargs):
         assert self._owned, 'Exited from a context where a managed resource was not owned'
         self._on_release(*args, **kwargs)
-        if len(self._ownership_queue) > 0:
-            resume_fn = self._ownership_queue.pop(0)
+        held = monotonic_ns() - self._acquired_nanos
+        self._hold_nanos += held
+        if held > self._max_hold_nanos:
+            self._max_hold_nanos = held
+        while self._ownership_queue:
+            entry = heappop(self._ownership_queue)
+            resume_fn = entry[2]
+            if resume_fn is None:
+                continue  # this waiter already timed out
+            entry[2] = None
+            self._waiting -= 1
+            if entry[4] is not None:
+                self._cancel_expiry(entry[4])
             # Note that the awaiter has already passed the ownership check.
             # By not resetting to unowned here we avoid unfair resource starvation in certain code constructs.
             resume_fn()
-        else:
-            self._owned = False
+            return
+        self._owned = False
 
 class Handle:
     """
     For binding resource initialization/teardown args to a resource.
+
+    Set `priority` to queue for the resource at a priority other than the waiting task's, and
+    `timeout` (seconds) to raise ResourceTimeoutError from `async with` instead of waiting longer.
     """
     def __init__(self, managed_resource, args, kwargs):
         self._managed_resource = managed_resource
         self._args = args
         self._kwargs = kwargs
         self.active = False
+        self.priority = None
+        self.timeout = None
 
     async def __aenter__(self):
-        resource = await self._managed_resource._aenter(self._args, self._kwargs)
+        resource = await self._managed_resource._aenter(self._args, self._kwargs, self.priority, self.timeout)
         self.active = True
         return resource
 
@@ -2,20 +2,25 @@ from .managed_resource import ManagedResource
 import tasko
 
 class ManagedSpi:
-    def __init__(self, spi_bus, loop=tasko.get_loop()):
+    def __init__(self, spi_bus, loop=None):
         """
         Vends access to an SPI bus via chip select leases.
         """
         self._resource = ManagedResource(spi_bus, on_acquire=self._acquire_spi, on_release=self._release_spi, loop=loop)
         self._handles = {}
-    
-    def _acquire_spi(self, chip_select):
-        chip_select.value = False
 
-    def _release_spi(self, chip_select):
+    def _acquire_spi(self, chip_select, device=None):
+        if device is None:
+            chip_select.value = False
+        else:
+            device._on_lease()
+
+    def _release_spi(self, chip_select, device=None):
         chip_select.value = True
-    
-    def cs_handle(self, chip_select):
+        if device is not None:
+            device._on_unlease()
+
+    def cs_handle(self, chip_select, priority=None, timeout=None):
         """
         pass in a digitalio.DigitalInOut chip select.
         This will be pulled low when a SpiHandle acquires the bus.
@@ -29,10 +34,85 @@ class ManagedSpi:
         You need to:
           * configure the bus to work with your devices
           * configure the chip select pins as outputs
-        
+
         You get:
           * non-blocking, awaitable access to an SPI
+
+        Leases are granted in priority order (see ManagedResource).  Pass priority to override the
+        waiting task's priority, and timeout (seconds) to give up on the lease with a ResourceTimeoutError.
         """
         chip_select.value = True
         spi_handle = self._resource.handle(chip_select=chip_select)
+        spi_handle.priority = priority
+        spi_handle.timeout = timeout
         return spi_handle
+
+    def device(self, chip_select, baudrate=100000, polarity=0, phase=0, priority=None, timeout=None):
+        """
+        pass in a digitalio.DigitalInOut chip select.
+        Returns a ManagedSpiDevice: a drop-in for adafruit_bus_device.spi_device.SPIDevice whose
+        bus is shared through this ManagedSpi.
+
+        Use this instead of cs_handle for register based chips (radios, sensors) that need chip select
+        toggled around every transaction.  Hold `device.lease` to batch several transactions into one
+        turn with the bus; chip select still toggles per `with device as spi:` block inside it.
+        """
+        return ManagedSpiDevice(self, chip_select, baudrate, polarity, phase, priority, timeout)
+
+    def metrics(self):
+        """Lease contention metrics for the bus (see ManagedResource.metrics)"""
+        return self._resource.metrics()
+
+
+class ManagedSpiDevice:
+    """
+    An SPIDevice whose bus is leased from a ManagedSpi.
+
+        async with device.lease:
+            with device as spi:      # chip select low
+                spi.write(register)
+            with device as spi:      # chip select toggled between transactions
+                spi.readinto(buffer)
+
+    Transactions outside a lease take the bus for just that transaction if it is free, and raise
+    a RuntimeError if another task holds it.
+    """
+    def __init__(self, managed_spi, chip_select, baudrate, polarity, phase, priority, timeout):
+        self._resource = managed_spi._resource
+        self._spi = managed_spi._resource._resource
+        self._chip_select = chip_select
+        self._baudrate = baudrate
+        self._polarity = polarity
+        self._phase = phase
+        self._leased = False
+        self._transaction_lease = False
+        self._lease_kwargs = {"chip_select": chip_select, "device": self}
+        chip_select.switch_to_output(value=True)
+        self.lease = self._resource.handle(**self._lease_kwargs)
+        self.lease.priority = priority
+        self.lease.timeout = timeout
+
+    def _on_lease(self):
+        while not self._spi.try_lock():
+            pass
+        self._spi.configure(baudrate=self._baudrate, polarity=self._polarity, phase=self._phase)
+        self._leased = True
+
+    def _on_unlease(self):
+        self._spi.unlock()
+        self._leased = False
+
+    def __enter__(self):
+        if not self._leased:
+            if not self._resource._try_acquire((), self._lease_kwargs):
+                raise RuntimeError("SPI bus is leased by another task; use `async with device.lease`")
+            self._transaction_lease = True
+        self._chip_select.value = False
+        return self._spi
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._chip_select.value = True
+        if self._transaction_lease:
+            self._transaction_lease = False
+            self._resource._release((), self._lease_kwargs)
+        return False
@@ -0,0 +1,96 @@
+"""
+Virtual-time helpers for running tasko applications faster than real time.
+
+usage:
+  with virtual_time():
+      loop = Loop()
+      loop.schedule(0.1, send_beacon, 10)
+      run_for(loop, 10 * 60)  # a 10 minute pass, in a few milliseconds
+"""
+from .loop import _yield_once, monotonic_ns, set_virtual_clock
+
+
+class VirtualClock:
+    """
+    A monotonic clock that only moves when told to.  An idle loop moves it to the next sleeper's
+    deadline; tests may also advance it by hand.
+
+    :param step_nanos: Simulated cost of every loop step.  Keeps code that polls with
+        `await tasko.sleep(0)` (like the radio driver's receive timeout) moving forward in time.
+    """
+    def __init__(self, start_nanos=0, step_nanos=100000):
+        self._now_nanos = start_nanos
+        self.step_nanos = step_nanos
+
+    def monotonic_ns(self):
+        return self._now_nanos
+
+    def monotonic(self):
+        return self._now_nanos / 1000000000.0
+
+    def advance(self, seconds):
+        self._now_nanos += int(seconds * 1000000000)
+
+    def tick(self):
+        """Called by the loop once per step"""
+        self._now_nanos += self.step_nanos
+
+    def advance_to(self, nanos):
+        """Moves the clock forward to nanos.  The clock never runs backwards."""
+        if nanos > self._now_nanos:
+            self._now_nanos = nanos
+
+
+class virtual_time:
+    """
+    Context manager that installs a VirtualClock for every tasko loop and restores real time on exit.
+    Entering returns the clock.
+    """
+    def __init__(self, start_nanos=0, step_nanos=100000):
+        self.clock = VirtualClock(start_nanos, step_nanos)
+
+    def __enter__(self):
+        set_virtual_clock(self.clock)
+        return self.clock
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        set_virtual_clock(None)
+
+
+def run_for(loop, seconds):
+    """
+    Step loop until `seconds` of loop time have passed, even if it runs out of work before then.
+    Under virtual_time() this returns as soon as the simulated work is done.
+    """
+    end_nanos = monotonic_ns() + int(seconds * 1000000000)
+    finished = False
+
+    async def _timer():
+        nonlocal finished
+        await loop._sleep_until_nanos(end_nanos)
+        finished = True
+        # Stay runnable for the rest of this step so the loop does not idle past end_nanos.
+        await _yield_once()
+
+    loop.add_task(_timer(), 0)
+    while not finished:
+        loop._step()
+
+
+def run_until_complete(loop, coroutine, priority=0):
+    """
+    Add coroutine to loop and step the loop until it completes.
+
+    :returns: The coroutine's return value
+    """
+    result = []
+
+    async def _wrapper():
+        result.append(await coroutine)
+
+    loop.add_task(_wrapper(), priority)
+    while not result:
+        if not (loop._tasks or loop._sleeping or loop._pending_external):
+            raise RuntimeError("Loop ran out of work before the coroutine completed")
+        loop._step()
+    return result[0]
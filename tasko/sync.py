@@ -0,0 +1,172 @@
+import tasko
+
+
+class QueueEmpty(Exception):
+    pass
+
+
+class QueueFull(Exception):
+    pass
+
+
+class _Waiters:
+    """
+    A FIFO of suspended tasks.  Waiting tasks are parked with Loop.suspend(), so they are not
+    considered by the scheduler at all until something wakes them.
+
+    Without a fixed loop, the global loop is looked up each time a task waits, so primitives
+    created before tasko.reset() park their waiters on the new loop.
+    """
+    def __init__(self, loop=None):
+        self._fixed_loop = loop
+        self._resumers = []
+
+    @property
+    def _loop(self):
+        return self._fixed_loop if self._fixed_loop is not None else tasko.get_loop()
+
+    def __len__(self):
+        return len(self._resumers)
+
+    async def wait(self):
+        await_handle, resume_fn = self._loop.suspend()
+        self._resumers.append(resume_fn)
+        await await_handle
+
+    def wake_one(self):
+        if self._resumers:
+            self._resumers.pop(0)()
+            return True
+        return False
+
+    def wake_all(self):
+        resumers = self._resumers
+        self._resumers = []
+        for resume_fn in resumers:
+            resume_fn()
+
+
+class Event:
+    """
+    A flag that tasks can wait on.  set() wakes every waiting task.
+
+    usage:
+      ready = Event()
+
+      async def consumer():
+          await ready.wait()
+
+      async def producer():
+          ready.set()
+    """
+    def __init__(self, loop=None):
+        self._waiters = _Waiters(loop)
+        self._value = False
+
+    def is_set(self):
+        return self._value
+
+    def set(self):
+        self._value = True
+        self._waiters.wake_all()
+
+    def clear(self):
+        self._value = False
+
+    async def wait(self):
+        """Returns immediately if the event is set, otherwise suspends until set() is called."""
+        if not self._value:
+            await self._waiters.wait()
+        return True
+
+
+class Semaphore:
+    """
+    Limits concurrent access to `value` holders.  Usable as an async context manager:
+
+      async with semaphore:
+          await do_limited_work()
+
+    Released permits are handed directly to the longest waiting task, so a task that releases
+    and immediately re-acquires can not starve the tasks already waiting.
+    """
+    def __init__(self, value=1, loop=None):
+        assert value >= 0, "Semaphore value must be >= 0"
+        self._waiters = _Waiters(loop)
+        self._value = value
+
+    def locked(self):
+        return self._value == 0
+
+    async def acquire(self):
+        if self._value > 0:
+            self._value -= 1
+        else:
+            # The releasing task keeps the permit count unchanged and hands its permit to us.
+            await self._waiters.wait()
+        return True
+
+    def release(self):
+        if not self._waiters.wake_one():
+            self._value += 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return None
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class Queue:
+    """
+    A FIFO queue for handing items between tasks, e.g. from a radio receive task to a slower
+    logger or decoder.
+
+    :param maxsize: put() waits while the queue holds this many items.  0 means unbounded.
+    """
+    def __init__(self, maxsize=0, loop=None):
+        self._maxsize = maxsize
+        self._items = []
+        self._getters = _Waiters(loop)
+        self._putters = _Waiters(loop)
+
+    def qsize(self):
+        return len(self._items)
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    def empty(self):
+        return not self._items
+
+    def full(self):
+        return 0 < self._maxsize <= len(self._items)
+
+    def put_nowait(self, item):
+        """Adds item to the queue, raising QueueFull if there is no room."""
+        if self.full():
+            raise QueueFull()
+        self._items.append(item)
+        self._getters.wake_one()
+
+    def get_nowait(self):
+        """Removes and returns the oldest item, raising QueueEmpty if there is none."""
+        if not self._items:
+            raise QueueEmpty()
+        item = self._items.pop(0)
+        self._putters.wake_one()
+        return item
+
+    async def put(self, item):
+        """Adds item to the queue, suspending while the queue is full."""
+        while self.full():
+            await self._putters.wait()
+        self.put_nowait(item)
+
+    async def get(self):
+        """Removes and returns the oldest item, suspending while the queue is empty."""
+        while not self._items:
+            await self._getters.wait()
+        return self.get_nowait()
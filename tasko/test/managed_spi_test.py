@@ -102,3 +102,115 @@ class TestManagedSpi(TestCase):
         self.assertTrue(did_sensor)
         self.assertTrue(did_screen)
         self.assertTrue(did_read)
+
+
+class FakeBus:
+    def __init__(self):
+        self.locked = False
+        self.baudrate = None
+        self.log = []
+
+    def try_lock(self):
+        if self.locked:
+            return False
+        self.locked = True
+        return True
+
+    def unlock(self):
+        self.locked = False
+
+    def configure(self, baudrate, polarity, phase):
+        self.baudrate = baudrate
+
+    def write(self, data):
+        self.log.append(bytes(data))
+
+
+class FakeChipSelect(FakeDigitalIO):
+    def switch_to_output(self, value):
+        self.value = value
+
+
+class TestManagedSpiDevice(TestCase):
+    def test_transactions_toggle_chip_select_inside_lease(self):
+        loop = Loop()
+        bus = FakeBus()
+        managed_spi = ManagedSpi(bus, loop=loop)
+        radio_cs = FakeChipSelect('RF_CS')
+        radio = managed_spi.device(radio_cs, baudrate=5000000)
+        cs_levels = []
+
+        async def burst():
+            async with radio.lease:
+                self.assertTrue(bus.locked)
+                self.assertEqual(bus.baudrate, 5000000)
+                for register in (b'\x01', b'\x02'):
+                    with radio as spi:
+                        cs_levels.append(radio_cs.value)
+                        spi.write(register)
+                    cs_levels.append(radio_cs.value)
+
+        loop.add_task(burst(), 1)
+        loop.run()
+        self.assertEqual(cs_levels, [False, True, False, True])
+        self.assertEqual(bus.log, [b'\x01', b'\x02'])
+        self.assertFalse(bus.locked)
+        self.assertEqual(managed_spi.metrics()['acquisitions'], 1)
+
+    def test_transaction_outside_lease(self):
+        bus = FakeBus()
+        managed_spi = ManagedSpi(bus, loop=Loop())
+        radio = managed_spi.device(FakeChipSelect('RF_CS'))
+        with radio as spi:
+            spi.write(b'\x42')
+        self.assertFalse(bus.locked)
+        self.assertEqual(managed_spi.metrics()['acquisitions'], 1)
+
+    def test_transaction_while_bus_leased_elsewhere(self):
+        loop = Loop()
+        bus = FakeBus()
+        managed_spi = ManagedSpi(bus, loop=loop)
+        sdcard = managed_spi.cs_handle(FakeChipSelect('SD_CS'))
+        radio = managed_spi.device(FakeChipSelect('RF_CS'))
+        raised = False
+
+        async def hold_sdcard():
+            async with sdcard:
+                await YieldOne()
+
+        async def unleased_register_read():
+            nonlocal raised
+            try:
+                with radio:
+                    pass
+            except RuntimeError:
+                raised = True
+
+        loop.add_task(hold_sdcard(), 1)
+        loop.add_task(unleased_register_read(), 2)
+        loop.run()
+        self.assertTrue(raised)
+
+    def test_radio_waits_for_its_turn(self):
+        loop = Loop()
+        bus = FakeBus()
+        managed_spi = ManagedSpi(bus, loop=loop)
+        sdcard = managed_spi.cs_handle(FakeChipSelect('SD_CS'))
+        radio = managed_spi.device(FakeChipSelect('RF_CS'))
+        order = []
+
+        async def hold_sdcard():
+            async with sdcard:
+                order.append('sd')
+                await YieldOne()
+
+        async def radio_burst():
+            async with radio.lease:
+                with radio as spi:
+                    order.append('radio')
+
+        loop.add_task(hold_sdcard(), 1)
+        loop.add_task(radio_burst(), 2)
+        loop.run()
+        self.assertEqual(order, ['sd', 'radio'])
+        self.assertEqual(managed_spi.metrics()['contended'], 1)
@@ -0,0 +1,123 @@
+import time
+from unittest import TestCase
+
+from tasko import Loop
+from tasko.loop import (EARLIEST_DEADLINE_FIRST, OVERRUN_CATCH_UP, OVERRUN_COALESCE, OVERRUN_SKIP,
+                        _yield_once, set_time_provider)
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestEarliestDeadlineFirst(TestCase):
+    def test_deadline_beats_priority(self):
+        loop = Loop()
+        loop.set_scheduling_policy(EARLIEST_DEADLINE_FIRST)
+        order = []
+
+        async def bulk():
+            await _yield_once()
+            order.append('bulk')
+
+        async def ack():
+            loop.set_task_deadline(0.1)
+            await _yield_once()
+            order.append('ack')
+
+        loop.add_task(bulk(), 1)   # better static priority
+        loop.add_task(ack(), 10)
+        loop._step()
+        loop._step()
+        self.assertEqual(order, ['ack', 'bulk'])
+
+    def test_priority_policy_ignores_deadlines(self):
+        loop = Loop()
+        order = []
+
+        async def bulk():
+            await _yield_once()
+            order.append('bulk')
+
+        async def ack():
+            loop.set_task_deadline(0.1)
+            await _yield_once()
+            order.append('ack')
+
+        loop.add_task(bulk(), 1)
+        loop.add_task(ack(), 10)
+        loop._step()
+        loop._step()
+        self.assertEqual(order, ['bulk', 'ack'])
+
+    def test_scheduled_deadlines_order_wakeups(self):
+        clock = FakeTime()
+        set_time_provider(clock)
+        try:
+            loop = Loop()
+            loop.set_scheduling_policy(EARLIEST_DEADLINE_FIRST)
+            order = []
+
+            async def beacon():
+                order.append('beacon')
+
+            async def telemetry():
+                order.append('telemetry')
+
+            loop.schedule(1000000000 / 10, telemetry, 1).set_deadline(0.000000009)
+            loop.schedule(1000000000 / 10, beacon, 10).set_deadline(0.000000002)
+            loop._step()  # first windows; deadlines are declared as the tasks start
+            order.clear()
+
+            clock.now = 10
+            loop._step()
+            self.assertEqual(order, ['beacon', 'telemetry'])
+        finally:
+            set_time_provider(time.monotonic_ns)
+
+
+class TestOverrunPolicies(TestCase):
+    def run_policy(self, policy):
+        """A 10ns period task whose first invocation takes 35ns, stepped once per ns"""
+        clock = FakeTime()
+        set_time_provider(clock)
+        try:
+            loop = Loop()
+            starts = []
+
+            async def work():
+                starts.append(clock.now)
+                if len(starts) == 1:
+                    clock.now += 35
+
+            task = loop.schedule(1000000000 / 10, work, 1)
+            task.set_overrun_policy(policy)
+            task.set_deadline(0.000000010)
+            while clock.now < 60:
+                loop._step()
+                clock.now += 1
+            return starts, task.deadline_stats()
+        finally:
+            set_time_provider(time.monotonic_ns)
+
+    def test_coalesce(self):
+        starts, stats = self.run_policy(OVERRUN_COALESCE)
+        self.assertEqual(starts, [0, 36, 45, 55])  # runs once right away, schedule restarts from 35
+        self.assertEqual(stats['deadline_misses'], 1)
+        self.assertEqual(stats['skipped'], 0)
+
+    def test_skip(self):
+        starts, stats = self.run_policy(OVERRUN_SKIP)
+        self.assertEqual(starts, [0, 40, 50])  # windows 10, 20 and 30 are dropped
+        self.assertEqual(stats['skipped'], 3)
+        self.assertEqual(stats['deadline_misses'], 1)
+
+    def test_catch_up(self):
+        starts, stats = self.run_policy(OVERRUN_CATCH_UP)
+        self.assertEqual(starts, [0, 36, 37, 38, 40, 50])  # windows 10, 20 and 30 run back to back
+        self.assertEqual(stats['invocations'], 6)
+        self.assertEqual(stats['deadline_misses'], 3)
@@ -0,0 +1,90 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import threading
+import time
+from unittest import TestCase
+
+from tasko import Loop
+
+
+class TestRunInExecutor(TestCase):
+    def test_loop_keeps_running_during_blocking_call(self):
+        loop = Loop()
+        ticks = 0
+        result = None
+        release = threading.Event()
+
+        def blocking_read():
+            release.wait(1)
+            return b'chunk'
+
+        async def reader():
+            nonlocal result
+            result = await loop.run_in_executor(blocking_read)
+
+        async def ticker():
+            nonlocal ticks
+            while ticks < 5:
+                ticks += 1
+                await loop.sleep(0.01)
+            release.set()
+
+        loop.add_task(reader(), 1)
+        loop.add_task(ticker(), 2)
+        loop.run()
+        loop.shutdown_default_executor()
+
+        self.assertEqual(ticks, 5)
+        self.assertEqual(result, b'chunk')
+
+    def test_idle_loop_wakes_on_completion(self):
+        loop = Loop()
+        finished_at = None
+
+        async def reader():
+            nonlocal finished_at
+            await loop.run_in_executor(time.sleep, 0.05)
+            finished_at = time.monotonic()
+
+        # A distant sleeper would hold the loop in a long idle sleep without the thread-safe wake up.
+        async def distant():
+            await loop.sleep(0.5)
+
+        loop.add_task(reader(), 1)
+        loop.add_task(distant(), 2)
+        start = time.monotonic()
+        while finished_at is None:
+            loop._step()
+        loop.shutdown_default_executor()
+        self.assertLess(finished_at - start, 0.4)
+
+    def test_exception_is_raised_in_task(self):
+        loop = Loop()
+        caught = None
+
+        def fails():
+            raise OSError('disk gone')
+
+        async def reader():
+            nonlocal caught
+            try:
+                await loop.run_in_executor(fails)
+            except OSError as e:
+                caught = e
+
+        loop.add_task(reader(), 1)
+        loop.run()
+        loop.shutdown_default_executor()
+        self.assertEqual(str(caught), 'disk gone')
+
+    def test_pluggable_executors(self):
+        loop = Loop()
+        results = []
+
+        async def compute(executor):
+            results.append(await loop.run_in_executor(pow, 2, 10, executor=executor))
+
+        with ThreadPoolExecutor(1) as threads, ProcessPoolExecutor(1) as processes:
+            loop.add_task(compute(threads), 1)
+            loop.add_task(compute(processes), 1)
+            loop.run()
+        self.assertEqual(results, [1024, 1024])
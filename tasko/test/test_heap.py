@@ -0,0 +1,21 @@
+import heapq
+import random
+from unittest import TestCase
+
+from tasko.heap import heappush, heappop
+
+
+class TestHeap(TestCase):
+    def test_matches_heapq(self):
+        rng = random.Random(1)
+        heap = []
+        expected = []
+        for _ in range(500):
+            if heap and rng.random() < 0.4:
+                self.assertEqual(heappop(heap), heapq.heappop(expected))
+            else:
+                item = [rng.randrange(10), rng.randrange(1000)]
+                heappush(heap, item)
+                heapq.heappush(expected, list(item))
+        self.assertEqual([heappop(heap) for _ in range(len(heap))], sorted(expected))
+        self.assertRaises(IndexError, heappop, heap)
@@ -0,0 +1,78 @@
+import json
+import time
+from unittest import TestCase
+
+from tasko import Loop
+from tasko.loop import set_time_provider
+
+
+class TestInstrumentation(TestCase):
+    def test_disabled_by_default(self):
+        loop = Loop()
+        self.assertIsNone(loop.instrumentation_snapshot())
+        self.assertNotIn('_run_task', loop.__dict__)
+
+    def test_task_cpu_and_steps(self):
+        loop = Loop()
+        loop.enable_instrumentation()
+
+        async def hog():
+            busy_until = time.monotonic() + 0.01
+            while time.monotonic() < busy_until:
+                pass
+
+        async def light():
+            pass
+
+        loop.add_task(hog(), 1, name='hog')
+        loop.add_task(light(), 1)
+        loop._step()
+
+        snapshot = loop.instrumentation_snapshot()
+        json.dumps(snapshot)  # snapshots are plain data
+        self.assertEqual(snapshot['steps'], 1)
+        self.assertEqual(sum(snapshot['step_latency_us']['counts']), 1)
+        self.assertGreaterEqual(snapshot['task_cpu']['hog']['total_ns'], 10000000)
+        light_name = [name for name in snapshot['task_cpu'] if 'light' in name][0]
+        self.assertLess(snapshot['task_cpu'][light_name]['total_ns'],
+                        snapshot['task_cpu']['hog']['total_ns'])
+
+        loop.disable_instrumentation()
+        self.assertIsNone(loop.instrumentation_snapshot())
+        self.assertNotIn('_run_task', loop.__dict__)
+
+    def test_lateness_and_overruns(self):
+        now = 0
+
+        def nanos():
+            return now
+
+        set_time_provider(nanos)
+        try:
+            loop = Loop()
+            loop.enable_instrumentation()
+
+            async def slow():
+                nonlocal now
+                now += 3000  # each run takes 3 periods
+
+            loop.schedule(1000000000 / 1000, slow, 1)
+            loop._step()  # first run; falls behind and yields
+            loop._step()  # second run
+            now += 500
+            loop._step()
+
+            snapshot = loop.instrumentation_snapshot()
+            self.assertGreaterEqual(snapshot['overruns']['slow'], 2)
+
+            async def sleeper():
+                await loop.sleep(0.000001)
+
+            loop.add_task(sleeper(), 1, name='sleeper')
+            loop._step()
+            now += 1000 + 250  # resume 250ns late
+            loop._step()
+            lateness = loop.instrumentation_snapshot()['sleeper_lateness']['sleeper']
+            self.assertEqual(lateness['count'], 1)
+        finally:
+            set_time_provider(time.monotonic_ns)
@@ -1,6 +1,7 @@
+import time
 from unittest import TestCase
 
-from tasko.managed_resource import ManagedResource
+from tasko.managed_resource import ManagedResource, ResourceTimeoutError
 from tasko import Loop
 
 
@@ -62,3 +63,116 @@ class TestManagedResource(TestCase):
 
         loop._step()  # 2 end
         self.assertEqual(loop._tasks, [])  # 2 is finished
+
+
+class TestPriorityHandoff(TestCase):
+    def test_priority_order_then_fifo(self):
+        loop = Loop()
+        spi = Resource()
+        managed_spi = ManagedResource(spi, spi.acquire, spi.release, loop=loop)
+        order = []
+
+        async def use(name, chip_select, priority):
+            handle = managed_spi.handle(chip_select=chip_select)
+            handle.priority = priority
+            async with handle:
+                order.append(name)
+                await YieldOne()
+                await YieldOne()
+
+        loop.add_task(use('owner', 1, 5), 1)
+        loop._step()  # owner holds the bus
+        loop.add_task(use('bulk1', 2, 5), 1)
+        loop.add_task(use('bulk2', 3, 5), 1)
+        loop.add_task(use('ack', 4, 0), 1)
+        loop._step()  # all three queue up behind the owner
+        loop.run()
+        self.assertEqual(order, ['owner', 'ack', 'bulk1', 'bulk2'])
+
+    def test_task_priority_is_default(self):
+        loop = Loop()
+        spi = Resource()
+        managed_spi = ManagedResource(spi, spi.acquire, spi.release, loop=loop)
+        order = []
+
+        async def use(name, chip_select):
+            async with managed_spi.handle(chip_select=chip_select):
+                order.append(name)
+                await YieldOne()
+                await YieldOne()
+
+        loop.add_task(use('owner', 1), 1)
+        loop._step()
+        loop.add_task(use('bulk', 2), 10)
+        loop.add_task(use('ack', 3), 0)
+        loop._step()
+        loop.run()
+        self.assertEqual(order, ['owner', 'ack', 'bulk'])
+
+    def test_timeout(self):
+        loop = Loop()
+        spi = Resource()
+        managed_spi = ManagedResource(spi, spi.acquire, spi.release, loop=loop)
+        timed_out = False
+        acquired_after = False
+
+        async def hog():
+            async with managed_spi.handle(chip_select=1):
+                await loop.sleep(0.05)
+
+        async def impatient():
+            nonlocal timed_out
+            handle = managed_spi.handle(chip_select=2)
+            handle.timeout = 0.01
+            try:
+                async with handle:
+                    pass
+            except ResourceTimeoutError:
+                timed_out = True
+
+        async def patient():
+            nonlocal acquired_after
+            async with managed_spi.handle(chip_select=3):
+                acquired_after = True
+
+        loop.add_task(hog(), 1)
+        loop.add_task(impatient(), 1)
+        loop.add_task(patient(), 1)
+        loop.run()
+        self.assertTrue(timed_out)
+        self.assertTrue(acquired_after)
+        self.assertIsNone(spi.active_cs)
+
+        metrics = managed_spi.metrics()
+        self.assertEqual(metrics['acquisitions'], 2)
+        self.assertEqual(metrics['timeouts'], 1)
+        self.assertEqual(metrics['contended'], 1)
+        self.assertEqual(metrics['max_queue_depth'], 2)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertGreaterEqual(metrics['max_hold_ns'], 50000000)
+
+    def test_acquire_cancels_timeout(self):
+        loop = Loop()
+        spi = Resource()
+        managed_spi = ManagedResource(spi, spi.acquire, spi.release, loop=loop)
+        acquired = False
+
+        async def hog():
+            async with managed_spi.handle(chip_select=1):
+                await loop.sleep(0.01)
+
+        async def waiter():
+            nonlocal acquired
+            handle = managed_spi.handle(chip_select=2)
+            handle.timeout = 5
+            async with handle:
+                acquired = True
+
+        loop.add_task(hog(), 1)
+        loop.add_task(waiter(), 1)
+        start = time.monotonic()
+        loop.run()
+        self.assertTrue(acquired)
+        self.assertLess(time.monotonic() - start, 1)  # the timeout task did not sleep on
+        self.assertEqual(loop._sleeping, [])
+        self.assertEqual(managed_spi.metrics()['timeouts'], 0)
@@ -0,0 +1,79 @@
+import time
+from unittest import TestCase
+
+from tasko import Loop
+from tasko.loop import monotonic
+from tasko.simulation import VirtualClock, run_for, run_until_complete, virtual_time
+
+
+class FakeRadio:
+    """Acks every other packet; waits out the full ack timeout on the rest."""
+    def __init__(self, loop, ack_wait):
+        self._loop = loop
+        self.ack_wait = ack_wait
+        self.sent = 0
+
+    async def send_with_ack(self, packet):
+        self.sent += 1
+        if self.sent % 2:
+            return True
+        await self._loop.sleep(self.ack_wait)
+        return False
+
+
+class TestSimulation(TestCase):
+    def test_virtual_clock(self):
+        clock = VirtualClock(start_nanos=5, step_nanos=0)
+        clock.advance(1)
+        self.assertEqual(clock.monotonic_ns(), 1000000005)
+        clock.advance_to(10)
+        self.assertEqual(clock.monotonic_ns(), 1000000005, 'clock never runs backwards')
+
+    def test_ten_minute_pass(self):
+        wall_start = time.monotonic()
+        with virtual_time() as clock:
+            loop = Loop()
+            radio = FakeRadio(loop, ack_wait=5)
+            beacons = 0
+            acked = 0
+
+            async def beacon():
+                nonlocal beacons
+                beacons += 1
+
+            async def upload():
+                nonlocal acked
+                while True:
+                    if await radio.send_with_ack(b'chunk'):
+                        acked += 1
+                    await loop.sleep(1)
+
+            loop.schedule(0.1, beacon, 10)
+            loop.add_task(upload(), 1)
+            run_for(loop, 10 * 60)
+
+            self.assertAlmostEqual(clock.monotonic(), 600, delta=0.01)
+        self.assertLess(time.monotonic() - wall_start, 5)
+        self.assertAlmostEqual(beacons, 60, delta=1)
+        # Every other packet costs ack_wait + 1s, the acked ones only the 1s sleep.
+        self.assertAlmostEqual(acked, 600 / 7, delta=2)
+
+    def test_polling_timeout_advances(self):
+        with virtual_time():
+            loop = Loop()
+
+            async def receive(timeout):
+                start = monotonic()
+                polls = 0
+                while monotonic() - start < timeout:
+                    polls += 1
+                    await loop.sleep(0)
+                return polls
+
+            polls = run_until_complete(loop, receive(0.5))
+        self.assertGreater(polls, 0)
+
+    def test_real_time_restored(self):
+        with virtual_time():
+            pass
+        self.assertGreater(monotonic(), 0)
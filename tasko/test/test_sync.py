@@ -0,0 +1,151 @@
+from unittest import TestCase
+
+import tasko
+from tasko import Loop
+from tasko.sync import Event, Queue, QueueEmpty, QueueFull, Semaphore
+
+
+class YieldOne:
+    def __await__(self):
+        yield
+
+
+class TestEvent(TestCase):
+    def test_wait_until_set(self):
+        loop = Loop()
+        event = Event(loop=loop)
+        woke = []
+
+        async def waiter(i):
+            await event.wait()
+            woke.append(i)
+
+        loop.add_task(waiter(1), 1)
+        loop.add_task(waiter(2), 1)
+        loop._step()
+        self.assertEqual(woke, [])
+        self.assertEqual(loop._tasks, [])  # waiters are suspended, not polled
+
+        event.set()
+        loop._step()
+        self.assertEqual(woke, [1, 2])
+
+    def test_set_event_does_not_suspend(self):
+        loop = Loop()
+        event = Event(loop=loop)
+        event.set()
+        done = False
+
+        async def waiter():
+            nonlocal done
+            await event.wait()
+            done = True
+
+        loop.add_task(waiter(), 1)
+        loop._step()
+        self.assertTrue(done)
+
+    def test_follows_reset(self):
+        event = Event()
+        tasko.reset()
+        woke = []
+
+        async def waiter():
+            await event.wait()
+            woke.append(True)
+
+        async def setter():
+            event.set()
+
+        tasko.add_task(waiter(), 1)
+        tasko.add_task(setter(), 2)
+        tasko.run()
+        self.assertEqual(woke, [True])
+
+
+class TestSemaphore(TestCase):
+    def test_limits_holders(self):
+        loop = Loop()
+        semaphore = Semaphore(2, loop=loop)
+        holding = 0
+        max_holding = 0
+
+        async def worker():
+            nonlocal holding, max_holding
+            async with semaphore:
+                holding += 1
+                max_holding = max(max_holding, holding)
+                await YieldOne()
+                holding -= 1
+
+        for _ in range(5):
+            loop.add_task(worker(), 1)
+        loop.run()
+        self.assertEqual(max_holding, 2)
+        self.assertFalse(semaphore.locked())
+
+    def test_release_hands_off_to_waiter(self):
+        loop = Loop()
+        semaphore = Semaphore(1, loop=loop)
+        order = []
+
+        async def worker(i):
+            async with semaphore:
+                order.append(i)
+                await YieldOne()
+
+        loop.add_task(worker(1), 1)
+        loop.add_task(worker(2), 1)
+        loop.run()
+        self.assertEqual(order, [1, 2])
+
+
+class TestQueue(TestCase):
+    def test_nowait(self):
+        loop = Loop()
+        queue = Queue(maxsize=1, loop=loop)
+        queue.put_nowait('a')
+        self.assertTrue(queue.full())
+        self.assertRaises(QueueFull, queue.put_nowait, 'b')
+        self.assertEqual(queue.get_nowait(), 'a')
+        self.assertRaises(QueueEmpty, queue.get_nowait)
+
+    def test_producer_consumer(self):
+        loop = Loop()
+        queue = Queue(maxsize=2, loop=loop)
+        received = []
+
+        async def producer():
+            for i in range(10):
+                await queue.put(i)
+            await queue.put(None)
+
+        async def consumer():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                received.append(item)
+                await YieldOne()
+                self.assertLessEqual(queue.qsize(), 2)
+
+        loop.add_task(consumer(), 1)
+        loop.add_task(producer(), 1)
+        loop.run()
+        self.assertEqual(received, list(range(10)))
+
+    def test_get_suspends_until_put(self):
+        loop = Loop()
+        queue = Queue(loop=loop)
+        received = []
+
+        async def consumer():
+            received.append(await queue.get())
+
+        loop.add_task(consumer(), 1)
+        loop._step()
+        self.assertEqual(loop._tasks, [])
+
+        queue.put_nowait('packet')
+        loop._step()
+        self.assertEqual(received, ['packet'])
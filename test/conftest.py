@@ -0,0 +1,53 @@
+"""
+Lets the tests import the ground station and the flight software's lib without the flight hardware.
+
+lib is put on the path the way gs_shell puts it there, and the CircuitPython libraries and msgpack
+are stood in for by minimal modules when they are not installed.
+"""
+import json
+import os
+import sys
+import types
+
+LIB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib')
+if LIB not in sys.path:
+    sys.path.append(LIB)
+
+
+def _stub(name, **attrs):
+    try:
+        __import__(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        sys.modules[name] = module
+        parent, _, child = name.rpartition('.')
+        if parent:
+            setattr(sys.modules[parent], child, module)
+
+
+class _SPIDevice:
+    """adafruit_bus_device.spi_device.SPIDevice: hands out the bus itself"""
+    def __init__(self, spi, chip_select=None, *, baudrate=100000, polarity=0, phase=0, extra_clocks=0):
+        self.spi = spi
+
+    def __enter__(self):
+        return self.spi
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+def _msgpack_pack(data, stream):
+    # JSON round trips everything the commands pack except bytes, which no test sends
+    stream.write(json.dumps(data).encode())
+
+
+def _msgpack_unpack(stream):
+    return json.loads(stream.read())
+
+
+_stub('micropython', const=lambda value: value)
+_stub('adafruit_bus_device')
+_stub('adafruit_bus_device.spi_device', SPIDevice=_SPIDevice)
+_stub('msgpack', pack=_msgpack_pack, unpack=_msgpack_unpack)
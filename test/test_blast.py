@@ -0,0 +1,54 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from gs_reassembly import Reassembler
+from lib.radio_utils import headers, STREAM_HEADER_LEN, STREAM_DATA_LEN
+from lib.radio_utils.blast_message import BlastMessage, read_bitmap, write_bitmap
+
+
+class TestBitmap(TestCase):
+    def test_round_trip(self):
+        indices = [5, 6, 13, 40, 41]
+        base, bitmap = write_bitmap(indices, 10)
+        self.assertEqual(base, 5)
+        self.assertEqual(read_bitmap(base, bitmap), indices)
+
+    def test_truncated_to_max_bytes(self):
+        base, bitmap = write_bitmap([0, 7, 8, 30], 1)
+        self.assertEqual(len(bitmap), 1)
+        self.assertEqual(read_bitmap(base, bitmap), [0, 7])
+        self.assertEqual(write_bitmap([], 4), (0, bytearray()))
+
+
+class TestBlastMessage(TestCase):
+    def test_repair_rounds(self):
+        data = bytes(range(256)) * 3
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'file')
+            with open(path, 'wb') as f:
+                f.write(data)
+            msg = BlastMessage(path, 9)
+            r = Reassembler()
+            while True:
+                pkt, with_ack = msg.packet()
+                if pkt[0] == headers.BLAST_END:
+                    self.assertTrue(with_ack)
+                    self.assertEqual((pkt[3] << 8) | pkt[4], msg.chunk_count)
+                    msg.ack()
+                    self.assertTrue(msg.done())
+                    r.finish(msg.chunk_count - 1)
+                    missing = r.missing()
+                    if not missing:
+                        break
+                    msg.repair(read_bitmap(*write_bitmap(missing, 8)))
+                    continue
+                self.assertEqual(pkt[0], headers.BLAST_CHUNK)
+                self.assertFalse(with_ack)
+                index = (pkt[3] << 8) | pkt[4]
+                if msg.rounds == 1 and index % 3 == 1:
+                    continue  # lost in the first round
+                r.add(index, bytes(pkt[STREAM_HEADER_LEN:]))
+            self.assertEqual(msg.rounds, 2)
+            self.assertEqual(r.join(), data)
+            self.assertEqual(msg.chunk_count, (len(data) + STREAM_DATA_LEN - 1) // STREAM_DATA_LEN)
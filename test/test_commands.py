@@ -0,0 +1,326 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, skipIf
+
+import tasko
+from lib.radio_utils import commands, compression, headers, STREAM_HEADER_LEN
+from lib.radio_utils.upload_session import UploadReceiver
+
+try:
+    import gs_commands
+    from gs_download_manager import DownloadManager
+except ImportError:  # lib.logs needs the flight software's pycubed module
+    gs_commands = DownloadManager = None
+
+tq = commands.tq
+
+
+class FakeCubeSat:
+    """A board without an SD card, so responses are downlinked from memory"""
+    sdcard = None
+    vfs = None
+
+
+class FakeTask:
+    def __init__(self):
+        self.messages = []
+
+    def debug(self, msg):
+        self.messages.append(msg)
+
+
+def downlinked():
+    """Sends every message in the transmission queue, and returns the packets"""
+    packets = []
+    while not tq.empty():
+        msg = tq.peek()
+        while True:  # a single packet Message is done before it is sent
+            pkt, _ = msg.packet()
+            packets.append(bytes(pkt))
+            msg.ack()
+            if msg.done():
+                break
+        tq.pop()
+    return packets
+
+
+def run(coroutine):
+    result = []
+
+    async def runner():
+        result.append(await coroutine)
+
+    tasko.reset()
+    tasko.add_task(runner(), 1)
+    tasko.run()
+    return result[0]
+
+
+class FakeRadioTask:
+    """The satellite's radio task at the other end of a perfect link, as the ground station's radio.
+    What is sent is handled as the radio task handles it, and what that queues is received back once
+    the ground station listens, in the order the transmission queue sends it.
+
+    :param staging: Where an uplinked DiskBufferedMessage is saved
+    :param upload_sessions: False for a radio task that predates upload sessions, and ignores their packets
+    :param correlated: False for one that predates COMMAND_CORRELATED, and ignores those commands
+    """
+    def __init__(self, staging, upload_sessions=True, correlated=True):
+        self.staging = staging
+        self.upload_sessions = upload_sessions
+        self.correlated = correlated
+        self.sent = []
+        self.rx = []
+        self.received = []
+        self.messages = []
+
+    def debug(self, msg):
+        self.messages.append(msg)
+
+    async def send_with_ack(self, packet, debug=False):
+        packet = bytes(packet)
+        self.sent.append(packet)
+        header = packet[0]
+        if header == headers.COMMAND or (header == headers.COMMAND_CORRELATED and self.correlated):
+            await commands.run_command(self, packet)
+        elif header in (headers.UPLOAD_START, headers.UPLOAD_DATA, headers.UPLOAD_END):
+            if self.upload_sessions:
+                commands.upload_packet(self, packet)
+        elif header in (headers.DISK_BUFFERED_START, headers.DISK_BUFFERED_MID, headers.DISK_BUFFERED_END):
+            with open(self.staging, 'wb' if header == headers.DISK_BUFFERED_START else 'ab') as f:
+                f.write(packet[1:])
+        return True
+
+    async def receive(self, **kwargs):
+        if not self.rx:
+            self.rx = downlinked()
+        if not self.rx:
+            return None
+        self.received.append(self.rx.pop(0))
+        return bytearray(5) + self.received[-1]
+
+
+def stream(packets):
+    """The (codec, data) of the stream packets"""
+    return packets[0][2] & compression.CODEC_MASK, b''.join(pkt[STREAM_HEADER_LEN:] for pkt in packets)
+
+
+class SatelliteTestCase(TestCase):
+    def setUp(self):
+        self._cubesat = commands.cubesat
+        self._downlink_path = commands._downlink_path
+        self._dir = tempfile.TemporaryDirectory()
+        commands.cubesat = FakeCubeSat()
+        commands._downlink_path = lambda extension: os.path.join(self._dir.name, 'downlink.' + extension)
+        commands._downlink_codecs = []
+        tq.clear()
+        self.task = FakeTask()
+
+    def tearDown(self):
+        commands.cubesat = self._cubesat
+        commands._downlink_path = self._downlink_path
+        commands._downlink_codecs = []
+        tq.clear()
+        self._dir.cleanup()
+
+
+class TestDownlinkCompression(SatelliteTestCase):
+    response = 'telemetry, telemetry, telemetry ' * 8
+
+    def test_uncompressed_until_codecs_are_sent(self):
+        commands._downlink(self.response)
+        self.assertEqual(stream(downlinked()), (compression.CODEC_NONE, self.response.encode()))
+
+    def test_codecs_sent_with_a_compressed_request(self):
+        path = os.path.join(self._dir.name, 'file')
+        with open(path, 'wb') as f:
+            f.write(self.response.encode())
+        commands.request_file_compressed(self.task, json.dumps([path, [compression.CODEC_LZSS]]))
+        codec, data = stream(downlinked())
+        self.assertEqual(codec, compression.CODEC_LZSS)
+        self.assertEqual(compression.decompress(codec, data), self.response.encode())
+
+        commands._downlink(self.response)
+        codec, data = stream(downlinked())
+        self.assertEqual(codec, compression.CODEC_LZSS)
+        self.assertEqual(compression.decompress(codec, data), self.response.encode())
+
+        commands._downlink('short')  # not worth compressing
+        self.assertEqual(stream(downlinked()), (compression.CODEC_NONE, b'short'))
+
+    def test_codecs_the_board_can_not_use(self):
+        commands._downlink_codecs = [0x03]
+        commands._downlink(self.response)
+        packets = downlinked()
+        self.assertEqual(packets[0][0], headers.MEMORY_STREAM_START)
+        self.assertEqual(stream(packets), (compression.CODEC_NONE, self.response.encode()))
+
+
+@skipIf(gs_commands is None, 'gs_commands can not be imported here')
+class TestUploads(SatelliteTestCase):
+    def setUp(self):
+        super().setUp()
+        self._uploads = commands._uploads
+        commands._uploads = UploadReceiver()
+        gs_commands._upload_sessions = None
+        self._staging_path = gs_commands.UPLOAD_STAGING_PATH
+        gs_commands.UPLOAD_STAGING_PATH = os.path.join(self._dir.name, 'staged')
+        self._cwd = os.getcwd()
+        os.chdir(self._dir.name)  # gs_transfer_state saves to the working directory
+        self.local = os.path.join(self._dir.name, 'local')
+        self.dest = os.path.join(self._dir.name, 'dest')
+        self.data = bytes(range(256)) * 3
+        with open(self.local, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        gs_commands.UPLOAD_STAGING_PATH = self._staging_path
+        gs_commands._upload_sessions = None
+        commands._uploads = self._uploads
+        super().tearDown()
+
+    def upload(self, radio, **kwargs):
+        return run(gs_commands.upload_file(radio, self.local, self.dest, segment_bytes=300, **kwargs))
+
+    def uploaded(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def headers_sent(self, radio):
+        return {packet[0] for packet in radio.sent}
+
+    def test_upload_sessions(self):
+        radio = FakeRadioTask(gs_commands.UPLOAD_STAGING_PATH)
+        self.assertTrue(self.upload(radio))
+        self.assertEqual(self.uploaded(), self.data)
+        self.assertFalse(os.path.exists(self.dest + '.part'))
+        self.assertTrue(gs_commands._upload_sessions)
+        self.assertNotIn(headers.DISK_BUFFERED_START, self.headers_sent(radio))
+        self.assertTrue(any(msg.startswith('Success uploading') and msg.endswith('size 300') for msg in radio.messages))
+
+        # verified, and skipped once it is in place
+        radio = FakeRadioTask(gs_commands.UPLOAD_STAGING_PATH)
+        self.assertTrue(self.upload(radio, verify=True))
+        self.assertNotIn(headers.UPLOAD_START, self.headers_sent(radio))
+
+    def test_falls_back_to_staged(self):
+        radio = FakeRadioTask(gs_commands.UPLOAD_STAGING_PATH, upload_sessions=False)
+        self.assertTrue(self.upload(radio, verify=False))
+        self.assertEqual(self.uploaded(), self.data)
+        self.assertIs(gs_commands._upload_sessions, False)
+        self.assertFalse(os.path.exists(gs_commands.UPLOAD_STAGING_PATH))  # appended and removed
+        self.assertTrue({headers.UPLOAD_START, headers.DISK_BUFFERED_START} <= self.headers_sent(radio))
+
+        # later uploads go straight to staged segments
+        os.remove(self.dest)
+        radio = FakeRadioTask(gs_commands.UPLOAD_STAGING_PATH, upload_sessions=False)
+        self.assertTrue(self.upload(radio, verify=False))
+        self.assertEqual(self.uploaded(), self.data)
+        self.assertNotIn(headers.UPLOAD_START, self.headers_sent(radio))
+
+    def test_sessions_are_kept_when_the_link_fails(self):
+        # nothing answers, not even the staged upload: that says nothing about upload sessions
+        radio = FakeRadioTask(gs_commands.UPLOAD_STAGING_PATH, upload_sessions=False)
+        radio.correlated = False
+
+        async def lost(packet, debug=False):
+            return packet[0] != headers.COMMAND  # the commands of the staged upload are lost
+        radio.send_with_ack = lost
+        self.assertFalse(self.upload(radio, verify=False))
+        self.assertIsNone(gs_commands._upload_sessions)
+
+
+@skipIf(gs_commands is None, 'gs_commands can not be imported here')
+class TestRunCommand(SatelliteTestCase):
+    def setUp(self):
+        super().setUp()
+        gs_commands._streams.clear()
+        gs_commands._correlated_commands = None
+        self._cwd = os.getcwd()
+        os.chdir(self._dir.name)  # gs_transfer_state saves to the working directory
+        for name, data in (('a.txt', b'a' * 70), ('b.txt', b'b' * 5), ('c.bin', b'c')):
+            with open(os.path.join(self._dir.name, name), 'wb') as f:
+                f.write(data)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        gs_commands._correlated_commands = None
+        super().tearDown()
+
+    def run_command(self, name, args, correlation_id=None):
+        command = gs_commands.commands_by_name[name]["bytes"] if name in gs_commands.commands_by_name else name
+        run(commands.run_command(self.task, gs_commands._command_packet(command, args, correlation_id)))
+        self.assertIsNone(commands._correlation_id)
+        return downlinked()
+
+    def test_responses_carry_the_correlation_id(self):
+        packets = self.run_command("QUERY", b'6 * 7', 0x85)
+        self.assertEqual(packets[0][0], headers.MEMORY_STREAM_END)  # one chunk
+        self.assertEqual(packets[0][1], 0x85)
+        self.assertEqual(stream(packets), (compression.CODEC_NONE, b'42'))
+
+        packets = self.run_command("REQUEST_FILE", b'/missing', 0x86)
+        self.assertEqual(packets, [bytes([headers.RESPONSE, 0x86, headers.DEFAULT]) + b'File not found'])
+
+        packets = self.run_command("REQUEST_FILE", b'/missing')
+        self.assertEqual(packets, [bytes([headers.DEFAULT]) + b'File not found'])
+
+    def test_errors_and_unknown_commands(self):
+        self.assertEqual(stream(self.run_command("QUERY", b'1 / 0', 0x90))[1],
+                         b'Error running command: division by zero')
+        self.assertEqual(stream(self.run_command(b'\x7f\x7f', b'', 0x91))[1], b"Unknown command b'\\x7f\\x7f'")
+        self.assertEqual(self.run_command(b'\x7f\x7f', b''), [])  # nothing is waiting for an uncorrelated one
+
+        packet = bytearray(gs_commands._command_packet(gs_commands.commands_by_name["QUERY"]["bytes"], b'1'))
+        packet[1] ^= 0xff
+        run(commands.run_command(self.task, packet))
+        self.assertEqual(downlinked(), [])
+        self.assertIn('Wrong command code', self.task.messages)
+
+    def test_pipeline(self):
+        radio = FakeRadioTask(None)
+        pipeline = gs_commands.CommandPipeline(radio)
+        size = run(pipeline.send("QUERY", gs_commands.file_size_query(os.path.join(self._dir.name, 'a.txt'))))
+        listing = run(pipeline.send("LIST_DIR", self._dir.name))
+        missing = run(pipeline.send("REQUEST_FILE", '/missing'))
+        self.assertTrue(run(pipeline.wait(max_rx_fails=1)))
+        # the error overtook the buffered responses in the transmission queue
+        self.assertEqual(radio.received[0][:2], bytes([headers.RESPONSE, missing.correlation_id]))
+        self.assertEqual(gs_commands.parse_file_size(*size.result()), (True, 70))
+        self.assertEqual(sorted(json.loads(listing.result()[2])), ['a.txt', 'b.txt', 'c.bin'])
+        self.assertEqual(missing.result(), (True, headers.DEFAULT, b'File not found'))
+
+    def test_uncorrelated_fallback(self):
+        radio = FakeRadioTask(None, correlated=False)
+        path = os.path.join(self._dir.name, 'a.txt')
+        success, _, response = run(gs_commands.request_file(radio, path))
+        self.assertTrue(success)
+        self.assertEqual(response, b'a' * 70)
+        self.assertIs(gs_commands._correlated_commands, False)
+        self.assertEqual([packet[0] for packet in radio.sent], [headers.COMMAND_CORRELATED, headers.COMMAND])
+
+    @skipIf(DownloadManager is None, 'gs_download_manager can not be imported here')
+    def test_sizes_fall_back_to_plain_queries(self):
+        radio = FakeRadioTask(None, correlated=False)
+        manager = DownloadManager(radio, 'files')
+        self.assertEqual(run(manager.add(os.path.join(self._dir.name, '*.txt'))),
+                         [os.path.join(self._dir.name, name) for name in ('a.txt', 'b.txt')])
+        self.assertEqual([entry['size'] for _, entry, _ in manager.pending()], [5, 70])
+        self.assertIs(gs_commands._correlated_commands, False)
+
+        # once known, the satellite is not sent correlated commands again
+        radio.sent.clear()
+        run(manager.add(os.path.join(self._dir.name, 'c.bin')))
+        self.assertEqual({packet[0] for packet in radio.sent}, {headers.COMMAND})
+
+    @skipIf(DownloadManager is None, 'gs_download_manager can not be imported here')
+    def test_sizes_pipelined(self):
+        radio = FakeRadioTask(None)
+        manager = DownloadManager(radio, 'files')
+        run(manager.add(os.path.join(self._dir.name, '*.txt')))
+        self.assertEqual([entry['size'] for _, entry, _ in manager.pending()], [5, 70])
+        self.assertIs(gs_commands._correlated_commands, True)
+        queries = [packet for packet in radio.sent if packet[0] == headers.COMMAND_CORRELATED]
+        self.assertEqual(len(queries), 2)
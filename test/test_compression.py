@@ -0,0 +1,69 @@
+import os
+import random
+import tempfile
+from unittest import TestCase
+
+from lib.radio_utils import compression
+from lib.radio_utils.compression import CODEC_LZSS, CODEC_ZLIB
+
+
+SAMPLES = [
+    b'',
+    b'a',
+    b'\x00' * 1000,  # one long overlapping run
+    b'abcabcabcabcabd' * 50,
+    random.Random(1).randbytes(2000),  # incompressible
+    b''.join(b'%d,%d,%d\n' % (i, i * i, i % 7) for i in range(1500)),  # longer than the window
+]
+
+
+class TestRoundTrip(TestCase):
+    def test_lzss(self):
+        for data in SAMPLES:
+            compressed = compression.compress(CODEC_LZSS, data)
+            self.assertEqual(compression.decompress(CODEC_LZSS, compressed), data)
+        self.assertLess(len(compression.compress(CODEC_LZSS, SAMPLES[3])), len(SAMPLES[3]) // 4)
+
+    def test_zlib(self):
+        if not compression.can_compress(CODEC_ZLIB):
+            self.skipTest('zlib can not compress here')
+        for data in SAMPLES:
+            self.assertEqual(compression.decompress(CODEC_ZLIB, compression.compress(CODEC_ZLIB, data)), data)
+
+    def test_chunked(self):
+        data = SAMPLES[5]
+        for codec in (CODEC_LZSS, CODEC_ZLIB):
+            if not compression.can_compress(codec):
+                continue
+            c = compression.compressor(codec)
+            compressed = b''.join(c.compress(data[i:i + 37]) for i in range(0, len(data), 37)) + c.flush()
+            self.assertEqual(compressed, compression.compress(codec, data))
+            # every split point, including between the two bytes of an LZSS match
+            d = compression.decompressor(codec)
+            out = b''.join(d.decompress(compressed[i:i + 1]) for i in range(len(compressed))) + d.flush()
+            self.assertEqual(out, data)
+
+    def test_corrupt_lzss(self):
+        with self.assertRaises(ValueError):
+            compression.decompress(CODEC_LZSS, b'\x00\x00\x10')  # a match before any output
+
+
+class TestFiles(TestCase):
+    def test_compress_file(self):
+        with tempfile.TemporaryDirectory() as d:
+            source = os.path.join(d, 'source')
+            packed = os.path.join(d, 'packed')
+            unpacked = os.path.join(d, 'unpacked')
+            with open(source, 'wb') as f:
+                f.write(SAMPLES[5])
+            size = compression.compress_file(CODEC_LZSS, source, packed)
+            self.assertEqual(size, os.path.getsize(packed))
+            self.assertEqual(compression.decompress_file(CODEC_LZSS, packed, unpacked), len(SAMPLES[5]))
+            with open(unpacked, 'rb') as f:
+                self.assertEqual(f.read(), SAMPLES[5])
+
+    def test_choose_codec(self):
+        self.assertEqual(compression.choose_codec([CODEC_LZSS]), CODEC_LZSS)
+        self.assertEqual(compression.choose_codec([]), compression.CODEC_NONE)
+        with self.assertRaises(ValueError):
+            compression.compressor(compression.CODEC_NONE)
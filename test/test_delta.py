@@ -0,0 +1,83 @@
+import io
+import os
+import random
+import tempfile
+from unittest import TestCase
+
+from gs_delta import parse_block_hashes, compute_delta
+from lib.radio_utils import delta
+
+
+def random_bytes(n, seed):
+    return random.Random(seed).randbytes(n)
+
+
+class TestDelta(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.dir = self._dir.name
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.dir, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def round_trip(self, old, new, block_size=64):
+        """Hashes old as the satellite would, deltas new against it and applies the delta. Returns the delta stats."""
+        basis = self.write('old', old)
+        out = io.BytesIO()
+        delta.block_hashes(basis, block_size, out)
+        d, literal_bytes, copied_blocks = compute_delta(new, *parse_block_hashes(out.getvalue()))
+        result = os.path.join(self.dir, 'new')
+        delta.apply_delta(basis, self.write('delta', d), result)
+        with open(result, 'rb') as f:
+            self.assertEqual(f.read(), new)
+        return literal_bytes, copied_blocks
+
+    def test_unchanged(self):
+        data = random_bytes(1000, 1)
+        self.assertEqual(self.round_trip(data, data), (0, 16))  # 15 full blocks and the short last one
+
+    def test_insert_and_change(self):
+        old = random_bytes(2048, 2)
+        new = old[:100] + b'inserted' + old[100:1500] + b'X' + old[1501:]
+        literal_bytes, copied_blocks = self.round_trip(old, new)
+        self.assertLess(literal_bytes, 200)
+        self.assertGreaterEqual(copied_blocks, 28)
+
+    def test_unrelated_and_empty(self):
+        self.assertEqual(self.round_trip(random_bytes(500, 3), random_bytes(300, 4)), (300, 0))
+        self.assertEqual(self.round_trip(random_bytes(500, 5), b''), (0, 0))
+
+    def test_weak_checksum_rolls(self):
+        data = random_bytes(200, 6)
+        L = 32
+        weak = delta.weak_checksum(data[:L])
+        a, b = weak & 0xffff, weak >> 16
+        for i in range(len(data) - L):
+            a = (a - data[i] + data[i + L]) & 0xffff
+            b = (b - L * data[i] + a) & 0xffff
+            self.assertEqual((b << 16) | a, delta.weak_checksum(data[i + 1:i + 1 + L]))
+
+    def test_bad_hashes_and_result(self):
+        with self.assertRaises(ValueError):
+            parse_block_hashes(b'\x00')
+        out = io.BytesIO()
+        delta.block_hashes(self.write('old', random_bytes(100, 7)), 64, out)
+        with self.assertRaises(ValueError):
+            parse_block_hashes(out.getvalue()[:-1])
+
+        basis = self.write('basis', b'a' * 64)
+        d, _, _ = compute_delta(b'a' * 64, *parse_block_hashes(self.hashes(basis)))
+        self.write('basis', b'b' * 64)  # the satellite's copy changed under the delta
+        with self.assertRaises(ValueError):
+            delta.apply_delta(basis, self.write('delta', d), os.path.join(self.dir, 'new'))
+
+    def hashes(self, path):
+        out = io.BytesIO()
+        delta.block_hashes(path, 64, out)
+        return out.getvalue()
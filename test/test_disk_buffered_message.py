@@ -0,0 +1,85 @@
+import os
+import random
+import tempfile
+from unittest import TestCase, skipIf
+
+from lib.radio_utils import disk_buffered_message, headers, PACKET_DATA_LEN, STREAM_HEADER_LEN, STREAM_DATA_LEN
+from lib.radio_utils.disk_buffered_message import DiskBufferedMessage
+
+
+class SmallWindowMessage(DiskBufferedMessage):
+    __slots__ = ()
+    read_ahead = 128  # a few packets, so the window refills several times
+
+
+def send(msg):
+    """Sends msg, asking for every packet twice as a retry would, and returns the packets"""
+    packets = []
+    while not msg.done():
+        pkt, with_ack = msg.packet()
+        assert with_ack
+        assert msg.packet()[0] == pkt  # a retry is the same packet
+        packets.append(bytes(pkt))
+        msg.ack()
+    return packets
+
+
+class TestDiskBufferedMessage(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'file')
+        self.data = random.Random(1).randbytes(1000)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+        self._mmap = disk_buffered_message.mmap
+
+    def tearDown(self):
+        disk_buffered_message.mmap = self._mmap
+        self._dir.cleanup()
+
+    def check_stream(self, msg, start, end):
+        packets = send(msg)
+        self.assertEqual([pkt[0] for pkt in packets],
+                         [headers.DISK_STREAM_START] + [headers.DISK_STREAM_MID] * (len(packets) - 2) +
+                         [headers.DISK_STREAM_END])
+        self.assertEqual([(pkt[3] << 8) | pkt[4] for pkt in packets], list(range(len(packets))))
+        self.assertTrue(all(pkt[1] == 4 for pkt in packets))
+        self.assertEqual(b''.join(pkt[STREAM_HEADER_LEN:] for pkt in packets), self.data[start:end])
+        self.assertEqual(len(packets), (end - start + STREAM_DATA_LEN - 1) // STREAM_DATA_LEN)
+        self.assertIsNone(msg._file)  # closed once done
+
+    def test_read_ahead_window(self):
+        disk_buffered_message.mmap = None
+        msg = SmallWindowMessage(self.path, stream_id=4, offset=100, length=700)
+        self.check_stream(msg, 100, 800)
+        self.assertIsNone(msg._window)
+
+    @skipIf(disk_buffered_message.mmap is None, 'mmap is not available')
+    def test_mmap_with_offset(self):
+        msg = DiskBufferedMessage(self.path, stream_id=4, offset=333)
+        msg.packet()
+        self.assertIsNotNone(msg._map_view)
+        self.check_stream(msg, 333, len(self.data))
+        self.assertIsNone(msg._map)
+
+    def test_legacy_headers_from_offset(self):
+        disk_buffered_message.mmap = None
+        packets = send(SmallWindowMessage(self.path, offset=500))
+        self.assertEqual(packets[0][0], headers.DISK_BUFFERED_START)
+        self.assertEqual(packets[-1][0], headers.DISK_BUFFERED_END)
+        self.assertEqual(b''.join(pkt[1:] for pkt in packets), self.data[500:])
+        self.assertTrue(all(len(pkt) == PACKET_DATA_LEN + 1 for pkt in packets[:-1]))
+
+    def test_reopens_after_close(self):
+        msg = DiskBufferedMessage(self.path, stream_id=1)
+        first, _ = msg.packet()
+        msg.close()
+        self.assertEqual(msg.packet()[0], first)
+        msg.close()
+
+    def test_read_error(self):
+        msg = DiskBufferedMessage(self.path)
+        os.remove(self.path)
+        pkt, _ = msg.packet()
+        self.assertEqual(pkt, bytes([headers.DEFAULT]) + b'Error reading file')
+        self.assertTrue(msg.done())
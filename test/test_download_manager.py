@@ -0,0 +1,104 @@
+import os
+import tempfile
+from unittest import TestCase, skipIf
+
+from lib.radio_utils import STREAM_DATA_LEN
+from test_gs_commands import FakeRadio, Satellite, run
+
+import gs_transfer_state
+
+try:
+    import gs_commands
+    from gs_download_manager import DownloadManager
+except ImportError:  # lib.logs needs the flight software's pycubed module
+    gs_commands = DownloadManager = None
+
+FILES = {
+    '/sd/logs/a.txt': bytes(range(256)) * 4,
+    '/sd/logs/b.txt': b'b' * 100,
+    '/sd/logs/c.bin': b'c' * 50,
+    '/sd/big': bytes(range(200)) * 10,
+}
+
+
+@skipIf(DownloadManager is None, 'gs_download_manager can not be imported here')
+class TestDownloadManager(TestCase):
+    def setUp(self):
+        gs_commands._streams.clear()
+        gs_commands._correlated_commands = None
+        self._dir = tempfile.TemporaryDirectory()
+        self._cwd = os.getcwd()
+        os.chdir(self._dir.name)  # the queue is saved in gs_transfer_state, in the working directory
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._dir.cleanup()
+
+    def manager(self, satellite, local_dir='files'):
+        return DownloadManager(FakeRadio(satellite), local_dir)
+
+    def queue(self, manager):
+        self.assertEqual(run(manager.add('/sd/logs/*.txt')), ['/sd/logs/a.txt', '/sd/logs/b.txt'])
+        self.assertEqual(run(manager.add('/sd/big', priority=2)), ['/sd/big'])
+        self.assertEqual(run(manager.add('/sd/missing')), [])
+
+    def remote_paths(self, manager):
+        return [entry['remote'] for _, entry, _ in manager.pending()]
+
+    def test_order(self):
+        manager = self.manager(Satellite(FILES))
+        self.queue(manager)
+        # the higher priority first, then the smallest
+        self.assertEqual(self.remote_paths(manager), ['/sd/big', '/sd/logs/b.txt', '/sd/logs/a.txt'])
+        self.assertEqual([entry['size'] for _, entry, _ in manager.pending()], [2000, 100, 1024])
+        self.assertEqual(manager.pending()[0][0], os.path.join('files', 'sd', 'big'))
+
+        results = run(manager.run())
+        self.assertEqual([r['remote'] for r in results], ['/sd/big', '/sd/logs/b.txt', '/sd/logs/a.txt'])
+        self.assertTrue(all(r['success'] for r in results))
+        self.assertEqual(manager.pending(), [])
+        for path in ('/sd/big', '/sd/logs/a.txt', '/sd/logs/b.txt'):
+            with open(manager.local_path(path), 'rb') as f:
+                self.assertEqual(f.read(), FILES[path])
+
+    def test_partial_download_is_ordered_by_what_is_left(self):
+        manager = self.manager(Satellite(FILES))
+        self.queue(manager)
+        gs_transfer_state.update('downloads', manager.local_path('/sd/logs/a.txt'),
+                                 {'remote': '/sd/logs/a.txt', 'offset': 1000})
+        self.assertEqual(self.remote_paths(manager), ['/sd/big', '/sd/logs/a.txt', '/sd/logs/b.txt'])
+
+    def test_queue_is_kept_across_runs(self):
+        self.queue(self.manager(Satellite(FILES)))
+        self.assertEqual(self.remote_paths(self.manager(Satellite(FILES), local_dir='elsewhere')), [])
+
+        # the pass ends partway into the first file
+        satellite = Satellite(FILES, cut_after=3)
+        results = run(self.manager(satellite).run(max_failures=1))
+        self.assertEqual([(r['remote'], r['success'], r['bytes']) for r in results],
+                         [('/sd/big', False, 3 * STREAM_DATA_LEN)])
+
+        manager = self.manager(Satellite(FILES))
+        self.assertEqual(self.remote_paths(manager), ['/sd/big', '/sd/logs/b.txt', '/sd/logs/a.txt'])
+        self.assertEqual(manager.pending()[0][1]['attempts'], 1)
+        self.assertEqual(manager.remaining_bytes(*manager.pending()[0][:2]), 2000 - 3 * STREAM_DATA_LEN)
+
+        satellite = Satellite(FILES)
+        manager = self.manager(satellite)
+        results = run(manager.run())
+        self.assertTrue(all(r['success'] for r in results))
+        self.assertIn('REQUEST_FILE_FROM', [name for name, _ in satellite.requests])
+        self.assertEqual(results[0]['bytes'], 2000 - 3 * STREAM_DATA_LEN)
+        self.assertEqual(manager.pending(), [])
+        with open(manager.local_path('/sd/big'), 'rb') as f:
+            self.assertEqual(f.read(), FILES['/sd/big'])
+
+
+    def test_up_to_date_files_are_skipped(self):
+        manager = self.manager(Satellite(FILES))
+        run(manager.add('/sd/logs/b.txt'))
+        run(manager.run())
+        run(manager.add('/sd/logs/b.txt'))
+        results = run(manager.run())
+        self.assertEqual([(r['success'], r['skipped'], r['bytes']) for r in results], [(True, True, 0)])
+        self.assertEqual(manager.pending(), [])
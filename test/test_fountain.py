@@ -0,0 +1,169 @@
+import os
+import random
+import tempfile
+from unittest import TestCase, skipIf
+
+from gs_fountain import FountainDecoder
+from lib.radio_utils import commands as satellite, headers, STREAM_HEADER_LEN
+from lib.radio_utils.fountain import FountainMessage, SIZE_LEN, SYMBOL_LEN, block_count, neighbors, soliton_cdf
+from test_commands import FakeTask
+from test_gs_commands import FakeRadio, run
+
+try:
+    import gs_commands
+except ImportError:  # lib.logs needs the flight software's pycubed module
+    gs_commands = None
+
+
+def symbols(path, overhead=1.0):
+    """(symbol id, symbol) for every packet a FountainMessage sends for the file at path"""
+    msg = FountainMessage(path, 7, overhead=overhead)
+    sent = []
+    while not msg.done():
+        pkt, with_ack = msg.packet()
+        assert not with_ack
+        assert pkt[0] == headers.FOUNTAIN_SYMBOL and pkt[1] == 7
+        size = int.from_bytes(pkt[STREAM_HEADER_LEN:STREAM_HEADER_LEN + SIZE_LEN], 'big')
+        assert size == msg.size
+        sent.append(((pkt[3] << 8) | pkt[4], bytes(pkt[STREAM_HEADER_LEN + SIZE_LEN:])))
+    return sent
+
+
+class TestFountain(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'file')
+        self.data = random.Random(1).randbytes(SYMBOL_LEN * 60 + 17)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_neighbors(self):
+        k = 50
+        cdf = soliton_cdf(k)
+        self.assertEqual(neighbors(3, k, cdf), [3])  # systematic
+        for symbol_id in range(k, k + 100):
+            blocks = neighbors(symbol_id, k, cdf)
+            self.assertEqual(blocks, neighbors(symbol_id, k, cdf))
+            self.assertEqual(len(set(blocks)), len(blocks))
+            self.assertTrue(all(0 <= b < k for b in blocks))
+        self.assertEqual(block_count(0), 1)
+
+    def test_clean_link(self):
+        sent = symbols(self.path)
+        decoder = FountainDecoder(len(self.data))
+        for symbol_id, symbol in sent[:decoder.k]:
+            decoder.add(symbol_id, symbol)
+        self.assertTrue(decoder.decode())
+        self.assertEqual(decoder.join(), self.data)
+
+    def test_lossy_link_out_of_order(self):
+        sent = [(symbol_id, symbol) for symbol_id, symbol in symbols(self.path) if symbol_id % 5 != 3]  # a fifth lost
+        random.Random(2).shuffle(sent)
+        decoder = FountainDecoder(len(self.data))
+        for symbol_id, symbol in sent:
+            decoder.add(symbol_id, symbol)
+            if decoder.decode():
+                break
+        self.assertTrue(decoder.complete())
+        self.assertEqual(decoder.join(), self.data)
+        self.assertFalse(decoder.add(symbol_id, symbol))
+        self.assertEqual(decoder.duplicates, 1)
+
+    def test_stop(self):
+        msg = FountainMessage(self.path, 1)
+        msg.packet()
+        msg.stop()
+        self.assertTrue(msg.done())
+
+    def test_decodes_only_when_a_block_can_be_peeled(self):
+        merges = []
+
+        class CountingDecoder(FountainDecoder):
+            def _merge(self):
+                merges.append(self.solved)
+                super()._merge()
+
+        sent = [(symbol_id, symbol) for symbol_id, symbol in symbols(self.path) if symbol_id % 5 != 3]
+        decoder = CountingDecoder(len(self.data))
+        for symbol_id, symbol in sent:
+            decoder.add(symbol_id, symbol)
+            solved = decoder.solved
+            peels = len(merges)
+            if decoder.received >= decoder.k and decoder.decode():  # as request_file_fountain does
+                break
+            if len(merges) > peels:
+                self.assertGreater(decoder.solved, solved)  # every peel finds a block
+        self.assertTrue(decoder.complete())
+        self.assertEqual(decoder.join(), self.data)
+        self.assertLess(len(merges), decoder.received - decoder.k)
+
+
+class LossySatellite:
+    """Runs the commands it is sent, and sends what they queue losing each packet with probability loss"""
+    def __init__(self, loss, seed):
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.task = FakeTask()
+        self.commands = []
+
+    def __call__(self, packet):
+        _, cmd, args = satellite.parse_command(packet)
+        self.commands.append(satellite.commands[cmd]["name"])
+        satellite.commands[cmd]["function"](self.task, args)
+        sent = []
+        while not satellite.tq.empty():
+            msg = satellite.tq.peek()
+            while True:  # a single packet Message is done before it is sent
+                pkt, _ = msg.packet()
+                if self.random.random() >= self.loss:
+                    sent.append(bytes(pkt))
+                msg.ack()
+                if msg.done():
+                    break
+            satellite.tq.pop()
+        return sent
+
+
+@skipIf(gs_commands is None, 'gs_commands can not be imported here')
+class TestRequestFileFountain(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'file')
+        self.data = random.Random(1).randbytes(SYMBOL_LEN * 60 + 17)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+        satellite.tq.clear()
+        satellite._fountains.clear()
+
+    def tearDown(self):
+        satellite.tq.clear()
+        satellite._fountains.clear()
+        self._dir.cleanup()
+
+    def request(self, loss, seed):
+        sat = LossySatellite(loss, seed)
+        result = run(gs_commands.request_file_fountain(FakeRadio(sat), self.path))
+        return result, sat.commands
+
+    def test_clean_link(self):
+        result, commands = self.request(0, 1)
+        self.assertEqual(result, (True, headers.DISK_BUFFERED_START, self.data))
+        self.assertEqual(commands, ['REQUEST_FILE_FOUNTAIN', 'FOUNTAIN_DONE'])
+        self.assertEqual(satellite._fountains, {})
+
+    def test_file_not_found(self):
+        os.remove(self.path)
+        result, commands = self.request(0, 1)
+        self.assertEqual(result, (False, headers.DEFAULT, b'File not found'))
+
+    def test_asks_for_more_symbols(self):
+        asked = 0
+        for seed in range(20):
+            result, commands = self.request(0.4, seed)
+            self.assertEqual(result, (True, headers.DISK_BUFFERED_START, self.data))
+            self.assertEqual(commands[-1], 'FOUNTAIN_DONE')
+            asked += 'FOUNTAIN_MORE' in commands
+        self.assertGreater(asked, 0)
@@ -0,0 +1,418 @@
+import json
+import os
+import struct
+import tempfile
+from unittest import TestCase, skipIf
+
+from tasko import Loop
+from lib.logs import beacon_format
+from lib.radio_utils import hashing, headers, STREAM_DATA_LEN
+from lib.radio_utils.message import write_stream_header
+
+import gs_transfer_state
+
+try:
+    import gs_commands
+except ImportError:  # lib.logs needs the flight software's pycubed module
+    gs_commands = None
+
+
+class ListSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, chunk):
+        self.chunks.append(bytes(chunk))
+
+
+def stream_payload(header, stream_id, index, data):
+    """The payload handle_stream is given: the stream header without its header byte, then data"""
+    buf = bytearray(5)
+    write_stream_header(buf, header, stream_id, index)
+    return buf[1:] + data
+
+
+def stream_packets(stream_id, data, memory=False):
+    """The packets a satellite sends data in on stream_id"""
+    start, mid, end = gs_commands.MEMORY_STREAM_HEADERS if memory else gs_commands.DISK_STREAM_HEADERS
+    chunks = [data[i:i + STREAM_DATA_LEN] for i in range(0, len(data), STREAM_DATA_LEN)] or [b'']
+    packets = []
+    for index, chunk in enumerate(chunks):
+        header = end if index == len(chunks) - 1 else start if index == 0 else mid
+        packets.append(bytes([header]) + stream_payload(header, stream_id, index, chunk))
+    return packets
+
+
+BEACON = bytes([headers.BEACON]) + struct.pack(beacon_format, 0, 0, 0, 1, *[0.0] * 11)
+
+
+@skipIf(gs_commands is None, 'gs_commands can not be imported here')
+class TestHandleStream(TestCase):
+    def setUp(self):
+        gs_commands._streams.clear()
+
+    def handle(self, header, stream_id, index, chunk, data):
+        return gs_commands.handle_stream(header, stream_payload(header, stream_id, index, chunk), data)
+
+    def test_stray_chunk_does_not_take_the_sink(self):
+        sink = ListSink()
+        data = gs_commands._data(sink, None)
+        self.assertIsNone(self.handle(headers.DISK_STREAM_MID, 5, 3, b'old!', data))
+        self.assertIsNone(self.handle(headers.DISK_STREAM_START, 6, 0, b'new!', data))
+        result = self.handle(headers.DISK_STREAM_END, 6, 1, b'data', data)
+        self.assertEqual(result, (headers.DISK_BUFFERED_START, None))
+        self.assertEqual(b''.join(sink.chunks), b'new!data')
+
+    def test_one_chunk_transfer_gets_the_sink(self):
+        sink = ListSink()
+        data = gs_commands._data(sink, None)
+        result = self.handle(headers.DISK_STREAM_END, 2, 0, b'tiny', data)
+        self.assertEqual(result, (headers.DISK_BUFFERED_START, None))
+        self.assertEqual(sink.chunks, [b'tiny'])
+
+    def test_in_memory(self):
+        data = gs_commands._data(None, None)
+        self.assertIsNone(self.handle(headers.MEMORY_STREAM_START, 1, 0, b'ab', data))
+        result = self.handle(headers.MEMORY_STREAM_END, 1, 1, b'cd', data)
+        self.assertEqual(result, (headers.MEMORY_BUFFERED_START, b'abcd'))
+
+
+class FakeRadio:
+    """Acks everything sent, and receives the packets in rx (without their 5 byte radio header).
+    on_send(packet), if set, returns the packets the satellite answers a sent packet with."""
+    def __init__(self, on_send=None):
+        self.sent = []
+        self.rx = []
+        self.on_send = on_send
+
+    async def send_with_ack(self, packet, debug=False):
+        self.sent.append(bytes(packet))
+        if self.on_send is not None:
+            self.rx.extend(self.on_send(bytes(packet)))
+        return True
+
+    async def receive(self, **kwargs):
+        return bytearray(5) + self.rx.pop(0) if self.rx else None
+
+
+def correlation_id(packet):
+    """The correlation id of a COMMAND_CORRELATED packet, or None for a COMMAND"""
+    if packet[0] != headers.COMMAND_CORRELATED:
+        return None
+    return packet[1 + len(gs_commands.super_secret_code)]
+
+
+def command(packet):
+    """The (correlation id, command name, arguments) of a COMMAND or COMMAND_CORRELATED packet"""
+    cid = correlation_id(packet)
+    start = 1 + len(gs_commands.super_secret_code) + (cid is not None)
+    return cid, gs_commands.commands[packet[start:start + 2]]["name"], packet[start + 2:]
+
+
+class Satellite:
+    """Answers file requests, file size QUERYs, LIST_DIR and FILE_HASH from files, a {path: data} dict.
+    With cut_after only that many packets of each file transfer are sent, as when the pass ends mid-transfer."""
+    def __init__(self, files, cut_after=None):
+        self.files = files
+        self.cut_after = cut_after
+        self.requests = []
+
+    def __call__(self, packet):
+        cid, name, args = command(packet)
+        self.requests.append((name, args))
+        stream_id = 1 if cid is None else cid
+        if name == "QUERY":
+            path = args.decode()[len("os.stat("):-len(")[6]")].strip("'")
+            if path not in self.files:
+                return [self.error(cid, b'No such file')]
+            return stream_packets(stream_id, str(len(self.files[path])).encode(), memory=True)
+        if name == "LIST_DIR":
+            directory = args.decode().rstrip('/') + '/'
+            names = [path[len(directory):] for path in self.files if path.startswith(directory)]
+            return stream_packets(stream_id, json.dumps(names).encode(), memory=True)
+        if name == "FILE_HASH":
+            path, algorithm = json.loads(args)
+            data = self.files[path]
+            return stream_packets(stream_id, f'Success hashing file: {algorithm} {len(data)} '
+                                             f'{hashing.hash_data(data, algorithm)}'.encode(), memory=True)
+        if name == "REQUEST_FILE_FROM":
+            path, offset = json.loads(args)
+        else:
+            path, offset = args.decode(), 0
+        if path not in self.files:
+            return [self.error(cid, b'File not found')]
+        return stream_packets(stream_id, self.files[path][offset:])[:self.cut_after]
+
+    @staticmethod
+    def error(cid, message):
+        if cid is None:
+            return bytes([headers.DEFAULT]) + message
+        return bytes([headers.RESPONSE, cid, headers.DEFAULT]) + message
+
+
+def run(coroutine):
+    result = []
+
+    async def runner():
+        result.append(await coroutine)
+
+    loop = Loop()
+    loop.add_task(runner(), 1)
+    loop.run()
+    return result[0]
+
+
+@skipIf(gs_commands is None, 'gs_commands can not be imported here')
+class TestCommandPipeline(TestCase):
+    def setUp(self):
+        gs_commands._streams.clear()
+        self.radio = FakeRadio()
+        self.pipeline = gs_commands.CommandPipeline(self.radio)
+
+    def test_routes_responses_out_of_order(self):
+        size = run(self.pipeline.send("QUERY", "os.stat('/sd/a')[6]"))
+        listing = run(self.pipeline.send("LIST_DIR", "/sd"))
+        self.assertEqual(self.radio.sent[0][0], headers.COMMAND_CORRELATED)
+        self.assertNotEqual(size.correlation_id, listing.correlation_id)
+
+        self.radio.rx.append(bytes([headers.MEMORY_STREAM_START]) +
+                             stream_payload(headers.MEMORY_STREAM_START, listing.correlation_id, 0, b'["a", '))
+        self.radio.rx.append(bytes([headers.RESPONSE, size.correlation_id, headers.DEFAULT]) + b'42')
+        self.radio.rx.append(bytes([headers.MEMORY_STREAM_END]) +
+                             stream_payload(headers.MEMORY_STREAM_END, listing.correlation_id, 1, b'"b"]'))
+        self.assertTrue(run(self.pipeline.wait(max_rx_fails=1)))
+        self.assertEqual(size.result(), (True, headers.DEFAULT, b'42'))
+        self.assertEqual(listing.result(), (True, headers.MEMORY_BUFFERED_START, b'["a", "b"]'))
+
+    def test_unanswered_commands_fail(self):
+        answered = run(self.pipeline.send("QUERY", "1"))
+        unanswered = run(self.pipeline.send("QUERY", "2"))
+        self.radio.rx.append(bytes([headers.RESPONSE, 0x7f, headers.DEFAULT]) + b'stray')  # not a pending id
+        self.radio.rx.append(bytes([headers.RESPONSE, answered.correlation_id, headers.DEFAULT]) + b'1')
+        self.assertFalse(run(self.pipeline.wait(max_rx_fails=1)))
+        self.assertEqual(answered.result(), (True, headers.DEFAULT, b'1'))
+        self.assertFalse(unanswered.result()[0])
+        self.assertEqual(self.pipeline.pending, {})
+
+    def test_window(self):
+        for _ in range(gs_commands.CommandPipeline.MAX_PENDING):
+            run(self.pipeline.send("QUERY", "1"))
+        with self.assertRaises(ValueError):
+            run(self.pipeline.send("QUERY", "1"))
+        run(self.pipeline.wait(max_rx_fails=0))
+        self.assertFalse(run(self.pipeline.send("QUERY", "1")).done())  # ids are free again
+
+
+@skipIf(gs_commands is None, 'gs_commands can not be imported here')
+class TestInterleaving(TestCase):
+    """Beacons and other transfers arriving while a response is awaited"""
+    def setUp(self):
+        gs_commands._streams.clear()
+        gs_commands._correlated_commands = None
+        self.data = bytes(range(256))
+        self._dir = tempfile.TemporaryDirectory()
+        self._cwd = os.getcwd()
+        os.chdir(self._dir.name)  # gs_transfer_state saves to the working directory
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._dir.cleanup()
+
+    def satellite(self, packet):
+        """Answers a file request on its correlation id, with a beacon and an unrelated transfer mixed in"""
+        stream_id = correlation_id(packet)
+        if stream_id is None:
+            stream_id = 9  # a satellite that predates COMMAND_CORRELATED picks its own stream id
+        mine = stream_packets(stream_id, self.data)
+        other = stream_packets(3, b'not the file' * 10)
+        if correlation_id(packet) is None:
+            # without a correlation id, the first transfer to start is taken to be the file
+            return [mine[0], other[0], BEACON, bytes([headers.DEFAULT]) + b'unrelated'] + mine[1:] + other[1:]
+        return ([other[0], mine[0], BEACON, bytes([headers.DEFAULT]) + b'unrelated', other[1]] +
+                mine[1:-1] + other[2:] + [mine[-1]])
+
+    def test_beacon_during_uncorrelated_stream(self):
+        radio = FakeRadio()
+        radio.rx = stream_packets(1, b'abcdef' * 20)
+        radio.rx.insert(1, BEACON)
+        self.assertEqual(run(gs_commands.wait_for_message(radio)), (headers.DISK_BUFFERED_START, b'abcdef' * 20))
+
+    def test_beacon_before_a_buffered_response(self):
+        radio = FakeRadio()
+        radio.rx = [BEACON] + stream_packets(1, b'listing')
+        self.assertEqual(run(gs_commands.wait_for_message(radio, beacons=False)),
+                         (headers.DISK_BUFFERED_START, b'listing'))
+
+    def test_in_memory(self):
+        radio = FakeRadio(self.satellite)
+        result = run(gs_commands.request_file(radio, '/sd/file', verify=False))
+        self.assertEqual(result, (True, headers.DISK_BUFFERED_START, self.data))
+        self.assertEqual(radio.sent[0][0], headers.COMMAND_CORRELATED)
+
+    def test_to_disk(self):
+        radio = FakeRadio(self.satellite)
+        result = run(gs_commands.request_file(radio, '/sd/file', local_path='file', verify=False))
+        self.assertEqual(result, (True, headers.DISK_BUFFERED_START, 'file'))
+        with open('file', 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+
+    def test_error_response(self):
+        def satellite(packet):
+            return [BEACON, bytes([headers.RESPONSE, correlation_id(packet), headers.DEFAULT]) + b'File not found']
+        result = run(gs_commands.request_file(FakeRadio(satellite), '/sd/missing', verify=False))
+        self.assertEqual(result, (False, headers.DEFAULT, b'File not found'))
+
+    def test_uncorrelated_fallback(self):
+        radio = FakeRadio(lambda packet: [] if correlation_id(packet) is not None else self.satellite(packet))
+        result = run(gs_commands.request_file(radio, '/sd/file', local_path='file', verify=False))
+        self.assertEqual(result, (True, headers.DISK_BUFFERED_START, 'file'))
+        self.assertFalse(gs_commands._correlated_commands)
+        with open('file', 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertEqual([p[0] for p in radio.sent], [headers.COMMAND_CORRELATED, headers.COMMAND])
+
+        # later requests go straight to uncorrelated commands
+        result = run(gs_commands.request_file(radio, '/sd/file', verify=False))
+        self.assertEqual(result, (True, headers.DISK_BUFFERED_START, self.data))
+        self.assertEqual(radio.sent[-1][0], headers.COMMAND)
+
+
+@skipIf(gs_commands is None, 'gs_commands can not be imported here')
+class TestRequestFile(TestCase):
+    def setUp(self):
+        gs_commands._streams.clear()
+        gs_commands._correlated_commands = None
+        self.data = bytes(range(256)) * 4
+        self._dir = tempfile.TemporaryDirectory()
+        self._cwd = os.getcwd()
+        os.chdir(self._dir.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._dir.cleanup()
+
+    def request(self, satellite, **kwargs):
+        return run(gs_commands.request_file(FakeRadio(satellite), '/sd/file', local_path='file', verify=False,
+                                            **kwargs))
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_streams_to_local_path(self):
+        progress = []
+        result = self.request(Satellite({'/sd/file': self.data}), progress=progress.append)
+        self.assertEqual(result, (True, headers.DISK_BUFFERED_START, 'file'))
+        self.assertEqual(self.read('file'), self.data)
+        self.assertFalse(os.path.exists('file.part'))
+        self.assertEqual(progress[-1], len(self.data))
+        self.assertEqual(progress, sorted(progress))
+
+    def test_interrupted_download_leaves_part(self):
+        success, _, _ = self.request(Satellite({'/sd/file': self.data}, cut_after=3))
+        self.assertFalse(success)
+        self.assertFalse(os.path.exists('file'))
+        self.assertEqual(self.read('file.part'), self.data[:3 * STREAM_DATA_LEN])
+        self.assertEqual(gs_commands._streams, {})  # the unfinished stream is not left writing to the file
+
+    def test_resumes_from_part(self):
+        self.request(Satellite({'/sd/file': self.data}, cut_after=3))
+        offset = 3 * STREAM_DATA_LEN
+        self.assertEqual(gs_transfer_state.get('downloads', 'file'), {'remote': '/sd/file', 'offset': offset})
+
+        satellite = Satellite({'/sd/file': self.data})
+        self.assertEqual(self.request(satellite), (True, headers.DISK_BUFFERED_START, 'file'))
+        self.assertEqual(satellite.requests, [('REQUEST_FILE_FROM', json.dumps(['/sd/file', offset]).encode())])
+        self.assertEqual(self.read('file'), self.data)
+        self.assertIsNone(gs_transfer_state.get('downloads', 'file'))
+
+    def test_resume_twice(self):
+        self.request(Satellite({'/sd/file': self.data}, cut_after=3))
+        self.request(Satellite({'/sd/file': self.data}, cut_after=5))
+        self.assertEqual(gs_transfer_state.get('downloads', 'file')['offset'], 8 * STREAM_DATA_LEN)
+        self.assertTrue(self.request(Satellite({'/sd/file': self.data}))[0])
+        self.assertEqual(self.read('file'), self.data)
+
+    def test_verified(self):
+        satellite = Satellite({'/sd/file': self.data})
+        result = run(gs_commands.request_file(FakeRadio(satellite), '/sd/file', local_path='file'))
+        self.assertEqual(result, (True, headers.DISK_BUFFERED_START, 'file'))
+        self.assertEqual([name for name, _ in satellite.requests], ['FILE_HASH', 'REQUEST_FILE'])
+
+        # the file is already in place
+        satellite = Satellite({'/sd/file': self.data})
+        result = run(gs_commands.request_file(FakeRadio(satellite), '/sd/file', local_path='file'))
+        self.assertEqual(result, (True, headers.DISK_BUFFERED_START, gs_commands.UP_TO_DATE))
+        self.assertEqual([name for name, _ in satellite.requests], ['FILE_HASH'])
+
+    def corrupting(self):
+        """A satellite whose file changes after it is hashed"""
+        satellite = Satellite({'/sd/file': self.data})
+
+        def corrupting(packet):
+            packets = satellite(packet)
+            satellite.files = {'/sd/file': b'x' + self.data[1:]}
+            return packets
+        return FakeRadio(corrupting)
+
+    def test_mismatch_is_discarded(self):
+        success, _, _ = run(gs_commands.request_file(self.corrupting(), '/sd/file', local_path='file'))
+        self.assertFalse(success)
+        self.assertEqual(os.listdir('.'), ['transfer_state.json'])  # no file, and no .part to resume from
+        self.assertIsNone(gs_transfer_state.get('downloads', 'file'))
+
+        success, _, _ = run(gs_commands.request_file(self.corrupting(), '/sd/file', verify=True))
+        self.assertFalse(success)
+
+    def test_starts_over(self):
+        self.request(Satellite({'/sd/file': self.data}, cut_after=3))
+        satellite = Satellite({'/sd/file': self.data})
+        self.assertTrue(self.request(satellite, resume=False)[0])
+        self.assertEqual(satellite.requests, [('REQUEST_FILE', b'/sd/file')])
+        self.assertEqual(self.read('file'), self.data)
+
+        # a .part file left by a different remote file is not resumed either
+        self.request(Satellite({'/sd/file': self.data}, cut_after=3))
+        satellite = Satellite({'/sd/other': self.data[::-1]})
+        success, _, _ = run(gs_commands.request_file(FakeRadio(satellite), '/sd/other', local_path='file',
+                                                     verify=False))
+        self.assertTrue(success)
+        self.assertEqual(satellite.requests, [('REQUEST_FILE', b'/sd/other')])
+        self.assertEqual(self.read('file'), self.data[::-1])
+
+
+class TestTransferState(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._dir.name, 'state.json')
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_empty(self):
+        self.assertEqual(gs_transfer_state.load(self.path), {kind: {} for kind in gs_transfer_state.KINDS})
+        with open(self.path, 'w') as f:
+            f.write('{"downloads": {')  # cut short
+        self.assertEqual(gs_transfer_state.load(self.path)['downloads'], {})
+
+    def test_update_and_get(self):
+        gs_transfer_state.update('downloads', 'a', {'remote': '/sd/a', 'offset': 52}, self.path)
+        gs_transfer_state.update('uploads', '/sd/b', {'sent': 1}, self.path)
+        self.assertEqual(gs_transfer_state.get('downloads', 'a', self.path), {'remote': '/sd/a', 'offset': 52})
+        self.assertIsNone(gs_transfer_state.get('downloads', '/sd/b', self.path))
+        gs_transfer_state.update('downloads', 'a', None, self.path)
+        gs_transfer_state.update('downloads', 'missing', None, self.path)
+        self.assertIsNone(gs_transfer_state.get('downloads', 'a', self.path))
+        self.assertEqual(gs_transfer_state.load(self.path)['uploads'], {'/sd/b': {'sent': 1}})
+        self.assertEqual(os.listdir(self._dir.name), ['state.json'])  # no temporary file left behind
+
+
+@skipIf(gs_commands is None, 'gs_commands can not be imported here')
+class TestLegacyBuffered(TestCase):
+    def test_resent_chunks_are_dropped(self):
+        for start, mid, end in ((headers.MEMORY_BUFFERED_START, headers.MEMORY_BUFFERED_MID, headers.MEMORY_BUFFERED_END),
+                                (headers.DISK_BUFFERED_START, headers.DISK_BUFFERED_MID, headers.DISK_BUFFERED_END)):
+            radio = FakeRadio()
+            # the MID chunk is resent after its ack was lost, and the END happens to repeat its payload
+            radio.rx = [bytes([start]) + b'ab', bytes([mid]) + b'cd', bytes([mid]) + b'cd', bytes([end]) + b'cd']
+            self.assertEqual(run(gs_commands.wait_for_message(radio))[1], b'abcdcd')
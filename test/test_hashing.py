@@ -0,0 +1,28 @@
+import hashlib
+import os
+import tempfile
+import zlib
+from unittest import TestCase
+
+from lib.radio_utils import hashing
+
+
+class TestHashing(TestCase):
+    def test_hash_data(self):
+        data = b'pycubed' * 100
+        self.assertEqual(hashing.hash_data(data, hashing.SHA256), hashlib.sha256(data).hexdigest())
+        self.assertEqual(hashing.hash_data(data, hashing.CRC32), '%08x' % zlib.crc32(data))
+
+    def test_hash_file(self):
+        data = bytes(range(256)) * 5  # more than one READ_SIZE read
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'file')
+            with open(path, 'wb') as f:
+                f.write(data)
+            self.assertEqual(hashing.hash_file(path, hashing.SHA256), (len(data), hashlib.sha256(data).hexdigest()))
+
+    def test_algorithms(self):
+        self.assertEqual(hashing.best_available(hashing.CRC32), hashing.CRC32)
+        self.assertEqual(hashing.best_available('md5'), hashing.SHA256)
+        with self.assertRaises(ValueError):
+            hashing.Hasher('md5')
@@ -0,0 +1,110 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from gs_reassembly import DecompressingSink, FileSink, Reassembler
+from lib.radio_utils import compression
+
+
+class ListSink:
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, chunk):
+        self.chunks.append(bytes(chunk))
+
+
+class TestReassembler(TestCase):
+    def test_out_of_order_and_duplicates(self):
+        r = Reassembler()
+        self.assertTrue(r.add(2, b'cc'))
+        self.assertTrue(r.add(0, b'aa'))
+        self.assertFalse(r.add(2, b'cc'))
+        self.assertEqual(r.missing(), [1])
+        r.finish(3)
+        self.assertEqual(r.missing(), [1, 3])
+        self.assertFalse(r.complete())
+        r.add(1, b'bb')
+        r.add(3, b'dd')
+        self.assertTrue(r.complete())
+        self.assertEqual(r.join(), b'aabbccdd')
+        self.assertEqual(r.duplicates, 1)
+        self.assertEqual(r.received_bytes, 8)
+
+    def test_identical_chunks_are_kept(self):
+        r = Reassembler()
+        for chunk in (b'\x00' * 4, b'\x00' * 4, b'\x00' * 4):
+            self.assertTrue(r.append(chunk))
+        r.finish()
+        self.assertTrue(r.complete())
+        self.assertEqual(r.join(), b'\x00' * 12)
+
+    def test_sink_gets_chunks_in_order(self):
+        sink = ListSink()
+        progress = []
+        r = Reassembler(sink, progress.append)
+        r.add(1, b'b')
+        self.assertEqual(sink.chunks, [])
+        r.add(0, b'a')
+        self.assertEqual(sink.chunks, [b'a', b'b'])
+        self.assertFalse(r.add(0, b'a'))  # already written out
+        r.add(2, b'c')
+        r.finish(2)
+        self.assertTrue(r.complete())
+        self.assertEqual(sink.chunks, [b'a', b'b', b'c'])
+        self.assertEqual(r.join(), b'')
+        self.assertEqual(progress, [1, 2, 3])
+
+
+class TestFileSink(TestCase):
+    def test_commit(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'out.bin')
+            sink = FileSink(path, batch_bytes=4)
+            sink.write(b'abc')
+            self.assertEqual(sink.bytes_written, 0)  # still batched
+            sink.write(b'def')
+            self.assertEqual(sink.bytes_written, 6)
+            sink.write(b'g')
+            sink.close()
+            self.assertEqual(os.path.getsize(path + '.part'), 7)  # written out, ready to be checked
+            sink.commit()
+            self.assertFalse(os.path.exists(path + '.part'))
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'abcdefg')
+
+    def test_abort_and_resume(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'out.bin')
+            sink = FileSink(path)
+            sink.write(b'first ')
+            sink.abort()
+            self.assertFalse(os.path.exists(path))
+            self.assertEqual(os.path.getsize(path + '.part'), 6)
+
+            sink = FileSink(path, resume=True)
+            self.assertEqual(sink.bytes_written, 6)
+            sink.write(b'second')
+            sink.commit()
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), b'first second')
+
+    def test_empty_abort_removes_part(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = os.path.join(d, 'out.bin')
+            FileSink(path).abort()
+            self.assertEqual(os.listdir(d), [])
+
+
+class TestDecompressingSink(TestCase):
+    def test_decompresses_chunks(self):
+        data = b'telemetry, telemetry, telemetry ' * 40
+        compressed = compression.compress(compression.CODEC_LZSS, data)
+        sink = ListSink()
+        decompressing = DecompressingSink(sink, compression.decompressor(compression.CODEC_LZSS))
+        r = Reassembler(decompressing)
+        chunks = [compressed[i:i + 7] for i in range(0, len(compressed), 7)]
+        for index in reversed(range(len(chunks))):
+            r.add(index, chunks[index])
+        decompressing.finish()
+        self.assertEqual(b''.join(sink.chunks), data)
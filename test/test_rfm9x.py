@@ -0,0 +1,115 @@
+from unittest import TestCase
+
+import tasko
+from lib.radio_utils import headers, MAX_PACKET_LEN
+from lib.radio_utils.memory_buffered_message import MemoryBufferedMessage
+from lib.radio_utils.message import Message
+from pycubed_rfm9x_fsk import RFM9x, bsd_checksum
+
+FIFO = 0x00
+IRQ_FLAGS_2 = 0x3F
+VERSION = 0x42
+
+
+class FakeChip:
+    """The radio's registers and FIFO behind the SPI bus.  What is written to the FIFO is kept in tx,
+    and reading the FIFO reads out the packet in rx."""
+    def __init__(self):
+        self.registers = bytearray(128)
+        self.registers[VERSION] = 18
+        self.tx = bytearray()
+        self.rx = bytearray()
+        self._address = None
+
+    def write(self, buf, *, start=0, end=None):
+        buf = bytes(buf[start:end])
+        if self._address is None:
+            address = buf[0] & 0x7f
+            if len(buf) == 1:
+                self._address = address  # the data follows in the next transfer
+            else:
+                self.registers[address] = buf[1]
+            return
+        if self._address == FIFO:
+            self.tx += buf
+        else:
+            self.registers[self._address] = buf[0]
+        self._address = None
+
+    def readinto(self, buf, *, start=0, end=None):
+        end = len(buf) if end is None else end
+        for i in range(start, end):
+            if self._address == FIFO:
+                buf[i] = self.rx.pop(0)
+            elif self._address == IRQ_FLAGS_2:
+                # tx is always done; rx done while a packet waits, fifo empty once it is read out
+                buf[i] = 0b1000 | (0b0100 if self.rx else 0b1000000)
+            else:
+                buf[i] = self.registers[self._address]
+        self._address = None
+
+
+class FakePin:
+    def switch_to_output(self, value=False):
+        self.value = value
+
+
+def run(coroutine):
+    result = []
+
+    async def runner():
+        result.append(await coroutine)
+
+    tasko.reset()
+    tasko.add_task(runner(), 1)
+    tasko.run()
+    return result[0]
+
+
+class TestFraming(TestCase):
+    def setUp(self):
+        self.chip = FakeChip()
+        self.radio = RFM9x(self.chip, None, FakePin(), 433)
+        self.radio.destination = 0x12
+        self.radio.node = 0x34
+        self.radio.identifier = 7
+
+    def send(self, data, **kwargs):
+        self.chip.tx = bytearray()
+        self.assertTrue(run(self.radio.send(data, **kwargs)))
+        return bytes(self.chip.tx)
+
+    def test_frame(self):
+        frame = self.send(b'hello')
+        body = bytes([0x12, 0x34, 7, 0]) + b'hello'
+        self.assertEqual(frame[0], len(frame) - 1)
+        self.assertEqual(frame[1:-2], body)
+        self.assertEqual(frame[-2:], bsd_checksum(frame[:-2]))
+
+    def test_kwargs_and_no_checksum(self):
+        self.radio.checksum = False
+        frame = self.send(b'x', destination=1, node=2, identifier=3, flags=4)
+        self.assertEqual(frame, bytes([5, 1, 2, 3, 4]) + b'x')
+
+    def test_reused_buffers(self):
+        buf = bytearray(MAX_PACKET_LEN)
+        long = MemoryBufferedMessage(bytes(range(100)))
+        length, _ = long.packet_into(buf)
+        self.assertEqual(length, MAX_PACKET_LEN)
+        full = self.send(memoryview(buf)[:length])
+        length, with_ack = Message(1, b'short', header=headers.BEACON).packet_into(buf)
+        self.assertFalse(with_ack)
+        short = self.send(memoryview(buf)[:length])
+        self.assertEqual(len(full), 1 + 4 + MAX_PACKET_LEN + 2)
+        self.assertEqual(short[5:-2], bytes([headers.BEACON]) + b'short')  # nothing left over from the long packet
+        self.assertEqual(short[-2:], bsd_checksum(short[:-2]))
+
+    def test_receive_what_was_sent(self):
+        frame = self.send(b'round trip', destination=self.radio.node)
+        self.chip.rx = bytearray(frame)
+        self.assertEqual(run(self.radio.receive(timeout=0)), b'round trip')
+
+        self.chip.rx = bytearray(frame)
+        self.chip.rx[6] ^= 1
+        self.assertIsNone(run(self.radio.receive(timeout=0)))
+        self.assertEqual(self.radio.checksum_error_count, 1)
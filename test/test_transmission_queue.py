@@ -0,0 +1,120 @@
+import time
+from unittest import TestCase
+
+import tasko
+from lib.radio_utils.message import Message
+from lib.radio_utils.transmission_queue import TransmissionQueue, DROP_OLDEST, DROP_LOWEST, QueueFullError
+
+
+class TestOrdering(TestCase):
+    def test_priority_then_fifo(self):
+        queue = TransmissionQueue()
+        queue.push(Message(1, 'low'))
+        queue.push(Message(5, 'high1'))
+        queue.push(Message(5, 'high2'))
+        queue.push(Message(3, 'mid'))
+        order = [queue.pop().str for _ in range(len(queue))]
+        self.assertEqual(order, [b'high1', b'high2', b'mid', b'low'])
+
+    def test_remove_and_reprioritize(self):
+        queue = TransmissionQueue()
+        first = queue.push(Message(1, 'first'))
+        second = queue.push(Message(1, 'second'))
+        third = queue.push(Message(1, 'third'))
+        self.assertEqual(queue.remove(first).str, b'first')
+        self.assertIsNone(queue.remove(first))
+        self.assertTrue(queue.reprioritize(third, 2))
+        self.assertEqual(queue.pop().str, b'third')
+        self.assertEqual(queue.pop().str, b'second')
+        self.assertFalse(queue.reprioritize(second, 2))
+        self.assertTrue(queue.empty())
+
+    def test_drop_policies(self):
+        queue = TransmissionQueue(limit=2)
+        queue.push(Message(1, 'a'))
+        queue.push(Message(1, 'b'))
+        with self.assertRaises(QueueFullError):
+            queue.push(Message(1, 'c'))
+
+        queue = TransmissionQueue(limit=2, drop_policy=DROP_OLDEST)
+        queue.push(Message(1, 'a'))
+        queue.push(Message(1, 'b'))
+        queue.push(Message(1, 'c'))
+        self.assertEqual([queue.pop().str, queue.pop().str], [b'b', b'c'])
+
+        queue = TransmissionQueue(limit=2, drop_policy=DROP_LOWEST)
+        queue.push(Message(1, 'low'))
+        queue.push(Message(5, 'high'))
+        self.assertIsNone(queue.push(Message(0, 'lower')))
+        queue.push(Message(3, 'mid'))
+        self.assertEqual([queue.pop().str, queue.pop().str], [b'high', b'mid'])
+        self.assertEqual(queue.dropped, 2)
+
+
+class TestExpiryAndAging(TestCase):
+    def test_ttl(self):
+        queue = TransmissionQueue()
+        queue.push(Message(5, 'stale'), ttl=0.001)
+        queue.push(Message(1, 'fresh'))
+        time.sleep(0.002)
+        self.assertEqual(queue.pop().str, b'fresh')
+        self.assertEqual(queue.expired, 1)
+        self.assertTrue(queue.empty())
+
+    def test_aging(self):
+        queue = TransmissionQueue(aging_interval=0.001)
+        queue.push(Message(1, 'old'))
+        time.sleep(0.005)
+        queue.push(Message(2, 'new'))
+        self.assertEqual(queue.pop().str, b'old')
+
+    def test_aged_counts_reordered_pops(self):
+        queue = TransmissionQueue(aging_interval=0.001)
+        queue.push(Message(1, 'waited'))
+        queue.push(Message(1, 'waited too'))
+        time.sleep(0.005)
+        self.assertEqual(queue.pop().str, b'waited')
+        self.assertEqual(queue.aged, 0)  # nothing of higher priority was waiting
+        queue.push(Message(2, 'new'))
+        self.assertEqual(queue.pop().str, b'waited too')
+        self.assertEqual(queue.aged, 1)
+        self.assertEqual(queue.pop().str, b'new')
+        self.assertEqual(queue.aged, 1)
+
+    def test_default_queue_does_not_age(self):
+        from lib.radio_utils import transmission_queue
+        self.assertEqual(transmission_queue.queue._aging_nanos, 0)
+
+
+class TestBackpressure(TestCase):
+    def put_after_pop(self, queue):
+        loop = tasko.get_loop()
+        done = []
+
+        async def producer():
+            await queue.put(Message(1, 'waited'))
+            done.append(True)
+
+        async def consumer():
+            await loop.sleep(0.001)
+            queue.pop()
+
+        loop.add_task(producer(), 1)
+        loop.add_task(consumer(), 1)
+        loop.run()
+        return done
+
+    def test_put_waits_for_space(self):
+        tasko.reset()
+        queue = TransmissionQueue(limit=1)
+        queue.push(Message(1, 'full'))
+        self.assertEqual(self.put_after_pop(queue), [True])
+        self.assertEqual(queue.pop().str, b'waited')
+
+    def test_put_after_reset(self):
+        queue = TransmissionQueue(limit=1)
+        for _ in range(2):
+            tasko.reset()
+            queue.clear()
+            queue.push(Message(1, 'full'))
+            self.assertEqual(self.put_after_pop(queue), [True])
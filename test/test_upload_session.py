@@ -0,0 +1,95 @@
+import os
+import tempfile
+from unittest import TestCase
+
+from lib.radio_utils import headers
+from lib.radio_utils.upload_session import UploadMessage, UploadReceiver
+
+
+def send(msg, receiver, drop=lambda pkt: False):
+    """Sends msg to receiver, resending packets that drop(pkt) loses, and returns the responses"""
+    responses = []
+    while not msg.done():
+        pkt, with_ack = msg.packet()
+        assert with_ack
+        response = receiver.receive(pkt)
+        if response is not None:
+            responses.append(response)
+        if not drop(pkt):
+            msg.ack()
+    return responses
+
+
+class TestUploadSession(TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self._dir.name, 'source')
+        self.dest = os.path.join(self._dir.name, 'dest')
+        self.data = bytes(range(256)) * 2
+        with open(self.source, 'wb') as f:
+            f.write(self.data)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def read_dest(self):
+        with open(self.dest, 'rb') as f:
+            return f.read()
+
+    def test_upload(self):
+        responses = send(UploadMessage(self.source, self.dest, 3), UploadReceiver())
+        self.assertEqual(responses, [f'Success uploading 3: size {len(self.data)}'])
+        self.assertEqual(self.read_dest(), self.data)
+        self.assertFalse(os.path.exists(self.dest + '.part'))
+
+    def test_lost_acks_are_resent(self):
+        lost = set()
+
+        def drop(pkt):
+            key = bytes(pkt[:5])
+            if key in lost:
+                return False
+            lost.add(key)  # the first ack of every packet is lost
+            return True
+
+        responses = send(UploadMessage(self.source, self.dest, 1), UploadReceiver(), drop)
+        self.assertEqual(responses[0], f'Success uploading 1: size {len(self.data)}')
+        self.assertEqual(self.read_dest(), self.data)
+
+    def test_resume_from_offset(self):
+        receiver = UploadReceiver()
+        responses = send(UploadMessage(self.source, self.dest, 1, length=100), receiver)
+        self.assertEqual(responses, ['Success uploading 1: size 100'])
+        self.assertFalse(os.path.exists(self.dest))
+        responses = send(UploadMessage(self.source, self.dest, 2, offset=100), receiver)
+        self.assertEqual(responses, [f'Success uploading 2: size {len(self.data)}'])
+        self.assertEqual(self.read_dest(), self.data)
+
+    def test_wrong_offset_and_unknown_session(self):
+        receiver = UploadReceiver()
+        responses = send(UploadMessage(self.source, self.dest, 1, offset=100), receiver)
+        self.assertEqual(len(responses), 1)
+        self.assertTrue(responses[0].startswith('Error uploading 1: offset 100'))
+
+        msg = UploadMessage(self.source, self.dest, 5)
+        msg.ack()  # skip UPLOAD_START
+        pkt = None
+        while not msg.done():
+            pkt, _ = msg.packet()
+            msg.ack()
+        self.assertEqual(pkt[0], headers.UPLOAD_END)
+        self.assertEqual(UploadReceiver().receive(pkt), 'Error uploading 5: unknown session')
+
+    def test_missing_chunk(self):
+        receiver = UploadReceiver()
+        msg = UploadMessage(self.source, self.dest, 1)
+        responses = []
+        while not msg.done():
+            pkt, _ = msg.packet()
+            if (pkt[3] << 8) | pkt[4] != 2:  # chunk 2 never arrives, but is acked
+                response = receiver.receive(pkt)
+                if response is not None:
+                    responses.append(response)
+            msg.ack()
+        self.assertEqual(responses, ['Error uploading 1: missing chunk 2, size 52'])
+        self.assertFalse(os.path.exists(self.dest))